@@ -2,7 +2,7 @@
 Django settings for transport_optimization project.
 """
 
-from decouple import config
+from decouple import config, Csv
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -117,6 +117,51 @@ USE_TZ = True
 
 STATIC_URL = 'static/'
 
+# Directory for the memory-mapped per-city travel matrices
+TRAVEL_MATRIX_DIR = config('TRAVEL_MATRIX_DIR', default=str(BASE_DIR / 'travel_matrices'))
+
+# Cities whose travel matrices are built and loaded in memory when the WSGI/ASGI application starts. With a
+# preloading server (e.g. gunicorn --preload) this happens once before forking and the workers share them
+PRELOAD_TRAVEL_MATRIX_CITIES = config('PRELOAD_TRAVEL_MATRIX_CITIES', default='', cast=Csv(int))
+
+# Number of geographically nearest stops with travel info fetched from the API for each new stop.
+# The other pairs are estimated from the great-circle distance. 0 fetches all pairs.
+TRAVEL_INFO_NEAREST_COUNT = config('TRAVEL_INFO_NEAREST_COUNT', default=0, cast=int)
+
+# Fetch the travel info of the stops created through the API (disabled e.g. by the load test)
+TRAVEL_INFO_FETCH_ON_CREATE = config('TRAVEL_INFO_FETCH_ON_CREATE', default=True, cast=bool)
+
+# Fetched travel info older than this is refreshed by the refresh_travel_info command
+TRAVEL_INFO_MAX_AGE_DAYS = config('TRAVEL_INFO_MAX_AGE_DAYS', default=30, cast=float)
+
+# Use an offline stub instead of the Google Maps API (load tests, local development), optionally with a delay
+# simulating the API latency and a share of requests failing with a transient error
+GMAPS_STUB = config('GMAPS_STUB', default=False, cast=bool)
+GMAPS_STUB_LATENCY_SECONDS = config('GMAPS_STUB_LATENCY_SECONDS', default=0.0, cast=float)
+GMAPS_STUB_ERROR_RATE = config('GMAPS_STUB_ERROR_RATE', default=0.0, cast=float)
+
+# Travel info fetching - concurrent API requests, requests per second (token bucket with a burst of the same size),
+# retries of transient errors with exponential backoff. GMAPS_BASE_URL points the client to another server,
+# e.g. the local stub server (manage.py run_gmaps_stub_server)
+GMAPS_MAX_WORKERS = config('GMAPS_MAX_WORKERS', default=4, cast=int)
+GMAPS_REQUESTS_PER_SECOND = config('GMAPS_REQUESTS_PER_SECOND', default=10.0, cast=float)
+GMAPS_MAX_RETRIES = config('GMAPS_MAX_RETRIES', default=4, cast=int)
+GMAPS_BACKOFF_SECONDS = config('GMAPS_BACKOFF_SECONDS', default=0.5, cast=float)
+GMAPS_BASE_URL = config('GMAPS_BASE_URL', default='')
+
+# Number of optimizations run at the same time by the async optimization endpoint (the others wait in a queue)
+OPTIMIZATION_EXECUTOR_WORKERS = config('OPTIMIZATION_EXECUTOR_WORKERS', default=2, cast=int)
+
+# Background optimization jobs (batches, decompositions) - directory of their input, status and result files
+# and how many of them can run at the same time (each in its own process with its own process pool)
+OPTIMIZATION_JOB_DIR = config('OPTIMIZATION_JOB_DIR', default=str(BASE_DIR / 'optimization_jobs'))
+OPTIMIZATION_JOBS_MAX_RUNNING = config('OPTIMIZATION_JOBS_MAX_RUNNING', default=2, cast=int)
+
+# Directory of the request profiles captured by staff users with ?profile=1 / X-Profile: 1 on /api/optimize/
+# and how many profiled requests a user can run (DRF throttle rate)
+PROFILE_DIR = config('PROFILE_DIR', default=str(BASE_DIR / 'profiles'))
+PROFILE_RATE_LIMIT = config('PROFILE_RATE_LIMIT', default='5/hour')
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.0/ref/settings/#default-auto-field
 
@@ -130,3 +175,19 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,
 }
+
+# Show the info messages of the app (e.g. the travel matrix preload report at startup) on the console,
+# Django itself logs only warnings and errors by default
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {'class': 'logging.StreamHandler'},
+    },
+    'loggers': {
+        'transport_optimization_app': {
+            'handlers': ['console'],
+            'level': config('APP_LOG_LEVEL', default='INFO'),
+        },
+    },
+}
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Stop, Route, RouteStop, TravelTime, City
+from .models import Stop, Route, RouteStop, TravelTime, City, TravelTimeFailure
 
 
 @admin.register(City)
@@ -28,5 +28,13 @@ class RouteStopAdmin(admin.ModelAdmin):
 
 @admin.register(TravelTime)
 class TravelTimeAdmin(admin.ModelAdmin):
-    list_display = ('start_stop', 'end_stop', 'travel_time_seconds', 'distance_meters', 'time_of_day')
+    list_display = ('start_stop', 'end_stop', 'travel_time_seconds', 'distance_meters', 'time_of_day', 'fetched_at',
+                    'source')
+    list_filter = ('source',)
     ordering = ('start_stop', 'end_stop')
+
+
+@admin.register(TravelTimeFailure)
+class TravelTimeFailureAdmin(admin.ModelAdmin):
+    list_display = ('start_stop', 'end_stop', 'time_of_day', 'error', 'attempts', 'last_attempt_at')
+    ordering = ('-last_attempt_at',)
@@ -2,10 +2,18 @@ import random
 import numpy as np
 from .StopHandler import StopHandler
 from .SolutionsHandler import SolutionsHandler
+from ..simulation_handlers.PassengerSurrogate import PassengerSurrogate
 
 
 class AntColonyOptimization:
-    def __init__(self, chosen_stops, num_routes, iterations=200, alpha=2, beta=3, evaporation_rate=0.5):
+    PHEROMONE_STRATEGIES = ("all", "elitist", "max_min")
+
+    def __init__(self, chosen_stops, num_routes, iterations=200, alpha=2, beta=3, evaporation_rate=0.5,
+                 pheromone_strategy="all", elite_ants_count=None, city_id=None, initial_solution=None,
+                 initial_pheromone_boost=1.0, surrogate_weight=0, cancellation_token=None):
+        if pheromone_strategy not in self.PHEROMONE_STRATEGIES:
+            raise ValueError(f"Unknown pheromone strategy '{pheromone_strategy}'!")
+
         self.__chosen_stops = chosen_stops
         self.__num_routes = num_routes
         self.__iterations = iterations
@@ -13,16 +21,41 @@ class AntColonyOptimization:
         self.__alpha = alpha
         self.__beta = beta
         self.__evaporation_rate = evaporation_rate
+        self.__pheromone_strategy = pheromone_strategy
+        self.__elite_ants_count = elite_ants_count if elite_ants_count else max(1, self.__num_ants // 10)
+        self.__cancellation_token = cancellation_token
+
+        # Map each stop to its row/column in the pheromone matrix
+        self.__stop_index = {stop: idx for idx, stop in enumerate(chosen_stops)}
+
+        # Pheromone bounds - only used by the MAX-MIN strategy and updated with the best score found so far
+        self.__pheromone_min = None
+        self.__pheromone_max = None
 
         # Get number of routes the chosen stops should be included in
         self.__stop_routes_count_map = StopHandler.define_stop_importance(chosen_stops, num_routes)
 
         # Initialize needed handlers
-        self.__solution_handler = SolutionsHandler()
+        self.__solution_handler = SolutionsHandler(city_id)
+
+        # Optimize also for the estimated passenger outcome, scaled to the route costs of the initial solution
+        # (or of a generated one)
+        self.__surrogate_weight = surrogate_weight
+        if surrogate_weight:
+            surrogate = PassengerSurrogate(chosen_stops, self.__solution_handler.stop_handler)
+            reference_solution = initial_solution or SolutionsHandler.generate_initial_routes(num_routes, chosen_stops)
+            self.__solution_handler.set_passenger_surrogate(surrogate, surrogate_weight, reference_solution)
 
         # Initialize pheromone levels between all pairs of stops.
         self.__pheromone = np.ones((len(chosen_stops), len(chosen_stops)))
 
+        # Seed the pheromone on the edges of a known solution (e.g. the current network), so ants start around it
+        self.__initial_solution_used = bool(initial_solution)
+        if initial_solution:
+            edges = self.__get_solution_edges(initial_solution)
+            np.add.at(self.__pheromone, (edges[:, 0], edges[:, 1]), initial_pheromone_boost)
+            np.add.at(self.__pheromone, (edges[:, 1], edges[:, 0]), initial_pheromone_boost)
+
     def __heuristic(self, first_stop, second_stop):
         """ Define heuristic desirability: closer stops are better. """
         distance = self.__solution_handler.stop_handler.get_distance(first_stop, second_stop)
@@ -31,10 +64,10 @@ class AntColonyOptimization:
     def __pick_next_stop(self, current_stop, unvisited):
         """ Choose the next stop based on pheromone and heuristic info. """
         probabilities = []
-        current_idx = self.__chosen_stops.index(current_stop)
+        current_idx = self.__stop_index[current_stop]
 
         for stop in unvisited:
-            stop_idx = self.__chosen_stops.index(stop)
+            stop_idx = self.__stop_index[stop]
             pheromone_influence = self.__pheromone[current_idx][stop_idx] ** self.__alpha
             heuristic_influence = self.__heuristic(current_stop, stop) ** self.__beta
             probabilities.append(pheromone_influence * heuristic_influence)
@@ -100,20 +133,44 @@ class AntColonyOptimization:
 
         return routes
 
-    def __update_pheromone(self, solutions):
+    def __get_solution_edges(self, routes):
+        """ Get the pheromone matrix indices of all consecutive stop pairs in the solution """
+        edges = [(self.__stop_index[route[i]], self.__stop_index[route[i + 1]])
+                 for route in routes for i in range(len(route) - 1)]
+        return np.array(edges, dtype=np.intp).reshape(-1, 2)
+
+    def __get_depositing_solutions(self, solutions):
+        """ Get the solutions allowed to deposit pheromone depending on the pheromone strategy """
+        if self.__pheromone_strategy == "elitist":
+            return sorted(solutions, key=lambda x: x[1])[:self.__elite_ants_count]
+        if self.__pheromone_strategy == "max_min":
+            # Only the best ant of the iteration deposits pheromone
+            return [min(solutions, key=lambda x: x[1])]
+        return solutions
+
+    def __update_pheromone_bounds(self, best_score):
+        """ Update the MAX-MIN pheromone bounds based on the best score found so far """
+        self.__pheromone_max = 1.0 / (self.__evaporation_rate * best_score)
+        self.__pheromone_min = self.__pheromone_max / (2 * len(self.__chosen_stops))
+
+    def __update_pheromone(self, solutions, best_score):
         """ Update the pheromone matrix """
         # Evaporate pheromone globally
         self.__pheromone *= (1 - self.__evaporation_rate)
 
-        for routes, score in solutions:
-            for route in routes:
-                for i in range(len(route) - 1):
-                    a = self.__chosen_stops.index(route[i])
-                    b = self.__chosen_stops.index(route[i + 1])
+        depositing_solutions = self.__get_depositing_solutions(solutions)
+
+        # Concatenate the edges of all depositing solutions and deposit pheromone inversely proportional
+        # to the solution score in a single unbuffered add (repeated edges accumulate)
+        edges = np.concatenate([solution_edges for _, _, solution_edges in depositing_solutions])
+        deposits = np.concatenate([np.full(len(solution_edges), 1.0 / score)
+                                   for _, score, solution_edges in depositing_solutions])
+        np.add.at(self.__pheromone, (edges[:, 0], edges[:, 1]), deposits)
+        np.add.at(self.__pheromone, (edges[:, 1], edges[:, 0]), deposits)
 
-                    # Add pheromone inversely proportional to solution score
-                    self.__pheromone[a][b] += 1.0 / score
-                    self.__pheromone[b][a] += 1.0 / score
+        if self.__pheromone_strategy == "max_min":
+            self.__update_pheromone_bounds(best_score)
+            np.clip(self.__pheromone, self.__pheromone_min, self.__pheromone_max, out=self.__pheromone)
 
     def execute_optimization(self):
         """ Execute ant colony optimization """
@@ -122,6 +179,10 @@ class AntColonyOptimization:
         best_score = float('inf')
 
         for iteration in range(self.__iterations):
+            # Stop early if the request that started the optimization was abandoned
+            if self.__cancellation_token:
+                self.__cancellation_token.raise_if_cancelled()
+
             solutions = []
             best_total_time = float('inf')
             best_total_distance = float('inf')
@@ -130,7 +191,7 @@ class AntColonyOptimization:
                 # Each ant builds a solution
                 routes = self.__construct_solution()
                 score, total_time, total_distance = self.__solution_handler.evaluate_solution(routes)
-                solutions.append((routes, score))
+                solutions.append((routes, score, self.__get_solution_edges(routes)))
 
                 # Update best solution found
                 if score < best_score:
@@ -154,16 +215,25 @@ class AntColonyOptimization:
             iteration_best_scores.append(min(solutions, key=lambda x: x[1])[1])
 
             # Update pheromones based on this generation's solutions
-            self.__update_pheromone(solutions)
+            self.__update_pheromone(solutions, best_score)
 
         algorithm_parameters = {
             "iterations": self.__iterations,
             "ants_count": self.__num_ants,
             "pheromone_influence_alpha": self.__alpha,
             "heuristic_influence_beta": self.__beta,
-            "evaporation_rate": self.__evaporation_rate
+            "evaporation_rate": self.__evaporation_rate,
+            "pheromone_strategy": self.__pheromone_strategy,
+            "initial_solution_used": self.__initial_solution_used,
+            "surrogate_weight": self.__surrogate_weight
         }
 
+        if self.__pheromone_strategy == "elitist":
+            algorithm_parameters["elite_ants_count"] = self.__elite_ants_count
+        elif self.__pheromone_strategy == "max_min":
+            algorithm_parameters["pheromone_min"] = self.__pheromone_min
+            algorithm_parameters["pheromone_max"] = self.__pheromone_max
+
         iteration_info = {
             "iteration_times": iteration_times,
             "iteration_distances": iteration_distances,
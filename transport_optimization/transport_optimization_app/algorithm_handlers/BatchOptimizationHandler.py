@@ -0,0 +1,102 @@
+import os
+import time
+import random
+import numpy as np
+from .OptimizationHandler import OptimizationHandler
+from .SolutionsHandler import SolutionsHandler
+from ..process_pool import create_process_pool
+from ..simulation_handlers.SimulationHandler import SimulationHandler
+
+# Stops, city and simulation handler shared by all variants in a worker process
+_worker_context = None
+
+
+def _init_batch_worker(context):
+    global _worker_context
+    _worker_context = context
+
+
+def _run_worker_variant(variant):
+    return BatchOptimizationHandler.run_variant(variant, **_worker_context)
+
+
+class BatchOptimizationHandler:
+    """ Run many optimization variants (algorithm, number of routes, parameters) over the same stops and compare
+    them. The travel matrix and the simulated passengers are loaded once and shared with all variants """
+
+    def __init__(self, chosen_stops, city_id, demand_model="uniform"):
+        self.__chosen_stops = chosen_stops
+        self.__city_id = city_id
+        # Loads the city matrix of this process before the workers are forked, so they all reuse it
+        self.__sim_handler = SimulationHandler(chosen_stops, city_id=city_id, demand_model=demand_model)
+
+    @staticmethod
+    def run_variant(variant, chosen_stops, city_id, sim_handler):
+        """ Optimize and simulate a single variant """
+        start_time = time.perf_counter()
+        if variant.get("seed") is not None:
+            random.seed(variant["seed"])
+            np.random.seed(variant["seed"])
+
+        parameters = {}
+        if variant["algorithm"] == "aco" and variant.get("pheromone_strategy"):
+            parameters["pheromone_strategy"] = variant["pheromone_strategy"]
+        if variant["algorithm"] in ("simulated_annealing", "aco") and variant.get("surrogate_weight"):
+            parameters["surrogate_weight"] = variant["surrogate_weight"]
+
+        _, final_solution, algorithm_parameters, _ = OptimizationHandler.execute_optimization(
+            variant["algorithm"], chosen_stops, variant["number_of_routes"], city_id, parameters)
+        score, total_time, total_distance = SolutionsHandler(city_id).evaluate_solution(final_solution)
+        metrics = sim_handler.run_simulation({f"route_{i}": route for i, route in enumerate(final_solution)})
+
+        return {
+            "variant": variant["name"],
+            "algorithm": variant["algorithm"],
+            "number_of_routes": variant["number_of_routes"],
+            "status": "ok",
+            "final_score": int(score),
+            "total_time_minutes": round(total_time / 60, 2),
+            "total_distance_km": round(total_distance / 1000, 2),
+            **metrics,
+            "duration_seconds": round(time.perf_counter() - start_time, 3),
+            "algorithm_parameters": algorithm_parameters,
+            "solution": [[stop.id for stop in route] for route in final_solution]
+        }
+
+    def run(self, variants, max_workers=None):
+        """ Run the variants in parallel processes and get the comparison table, best simulation score first """
+        context = {"chosen_stops": self.__chosen_stops, "city_id": self.__city_id, "sim_handler": self.__sim_handler}
+        max_workers = min(len(variants), max_workers or os.cpu_count() or 1)
+
+        if max_workers == 1:
+            results = [self.__run_safely(variant, context) for variant in variants]
+        else:
+            with create_process_pool(max_workers, initializer=_init_batch_worker, initargs=(context,)) as executor:
+                futures = [executor.submit(_run_worker_variant, variant) for variant in variants]
+                results = [self.__get_result(future, variant) for future, variant in zip(futures, variants)]
+
+        # Failed variants are listed after the successful ones
+        results.sort(key=lambda row: (row["status"] != "ok", row.get("score", float('inf'))))
+        for rank, row in enumerate(results, start=1):
+            row["rank"] = rank if row["status"] == "ok" else None
+
+        return results
+
+    @staticmethod
+    def __error_row(variant, error):
+        return {"variant": variant["name"], "algorithm": variant["algorithm"],
+                "number_of_routes": variant["number_of_routes"], "status": "error", "error": str(error)}
+
+    @classmethod
+    def __run_safely(cls, variant, context):
+        try:
+            return cls.run_variant(variant, **context)
+        except Exception as e:
+            return cls.__error_row(variant, e)
+
+    @classmethod
+    def __get_result(cls, future, variant):
+        try:
+            return future.result()
+        except Exception as e:
+            return cls.__error_row(variant, e)
@@ -0,0 +1,26 @@
+import threading
+
+
+class OptimizationCancelled(Exception):
+    """ Raised inside an optimization when its cancellation token was cancelled """
+
+
+class CancellationToken:
+    """ Thread-safe flag the optimization algorithms poll each iteration to stop abandoned runs early.
+    A multiprocessing event can be passed to share the token with worker processes """
+
+    def __init__(self, event=None):
+        self.__event = event or threading.Event()
+
+    def cancel(self):
+        """ Request the running optimization to stop """
+        self.__event.set()
+
+    @property
+    def is_cancelled(self):
+        return self.__event.is_set()
+
+    def raise_if_cancelled(self):
+        """ Stop the optimization by raising OptimizationCancelled if cancellation was requested """
+        if self.__event.is_set():
+            raise OptimizationCancelled("The optimization was cancelled!")
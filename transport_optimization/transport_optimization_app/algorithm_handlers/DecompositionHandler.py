@@ -0,0 +1,195 @@
+import math
+import time
+import numpy as np
+from concurrent.futures import wait, FIRST_COMPLETED
+from .CancellationToken import CancellationToken
+from .OptimizationHandler import OptimizationHandler
+from .SimulatedAnnealing import SimulatedAnnealing
+from ..process_pool import create_process_pool, get_mp_context
+
+
+# Cancellation token of the worker process, shared with the process running the decomposition
+_worker_cancellation_token = None
+
+
+def _init_cluster_worker(cancel_event):
+    global _worker_cancellation_token
+    _worker_cancellation_token = CancellationToken(cancel_event)
+
+
+def _optimize_cluster(algorithm, cluster_stops, num_routes, city_id, parameters):
+    """ Optimize the routes of a single cluster in a worker process and return them as stop ids """
+    start_time = time.perf_counter()
+    _, final_solution, _, _ = OptimizationHandler.execute_optimization(algorithm, cluster_stops, num_routes, city_id,
+                                                                       parameters,
+                                                                       cancellation_token=_worker_cancellation_token)
+    return [[stop.id for stop in route] for route in final_solution], round(time.perf_counter() - start_time, 3)
+
+
+class DecompositionHandler:
+    """ Optimize a large stop set by splitting it geographically. The stops are clustered around the final stops,
+    each cluster gets a share of the routes proportional to its size and is optimized in a separate process.
+    The partial networks are then stitched and refined together with simulated annealing, which can move stops
+    between the routes of different clusters """
+    KMEANS_ITERATIONS = 15
+    # How often the cancellation token is checked while waiting for the clusters
+    CANCELLATION_POLL_SECONDS = 0.5
+    # Each cluster needs two final stops and two routes, since the algorithms swap stops between routes
+    MIN_FINAL_STOPS = 2
+    MIN_ROUTES = 2
+    # The user parameters the refinement (simulated annealing) accepts, whatever the algorithm of the clusters
+    REFINEMENT_PARAMETERS = ("surrogate_weight", "cooling_rate")
+
+    def __init__(self, chosen_stops, num_routes, city_id=None, algorithm="simulated_annealing", parameters=None,
+                 cluster_size=150, refine_iterations=800, max_workers=None, cancellation_token=None):
+        if algorithm not in OptimizationHandler.ALGORITHMS:
+            raise ValueError(f"Unknown algorithm '{algorithm}'!")
+
+        self.__chosen_stops = chosen_stops
+        self.__num_routes = num_routes
+        self.__city_id = city_id
+        self.__algorithm = algorithm
+        self.__parameters = parameters or {}
+        self.__cluster_size = cluster_size
+        self.__refine_iterations = refine_iterations
+        self.__max_workers = max_workers
+        self.__cancellation_token = cancellation_token
+
+    def __get_coordinates(self):
+        """ Project the stops to a plane (equirectangular projection is accurate enough inside a city) """
+        latitudes = np.array([stop.latitude for stop in self.__chosen_stops], dtype=np.float64)
+        longitudes = np.array([stop.longitude for stop in self.__chosen_stops], dtype=np.float64)
+        return np.column_stack((longitudes * math.cos(math.radians(latitudes.mean())), latitudes))
+
+    def __cluster_stops(self, cluster_count):
+        """ K-means clustering seeded with far apart final stops. Returns the stop indices of each cluster """
+        coordinates = self.__get_coordinates()
+        final_indices = [idx for idx, stop in enumerate(self.__chosen_stops) if stop.is_final_stop]
+
+        # Farthest-point seeding among the final stops, so every cluster starts around route terminals
+        centers = [coordinates[final_indices[0]]]
+        final_coordinates = coordinates[final_indices]
+        while len(centers) < cluster_count:
+            distances = np.min([np.linalg.norm(final_coordinates - center, axis=1) for center in centers], axis=0)
+            centers.append(final_coordinates[int(np.argmax(distances))])
+        centers = np.array(centers)
+
+        for _ in range(self.KMEANS_ITERATIONS):
+            labels = np.argmin(np.linalg.norm(coordinates[:, None, :] - centers[None, :, :], axis=2), axis=1)
+            for cluster in range(cluster_count):
+                members = coordinates[labels == cluster]
+                if len(members):
+                    centers[cluster] = members.mean(axis=0)
+
+        clusters = [list(np.flatnonzero(labels == cluster)) for cluster in range(cluster_count)]
+        return self.__merge_invalid_clusters([cluster for cluster in clusters if cluster], coordinates)
+
+    def __merge_invalid_clusters(self, clusters, coordinates):
+        """ Merge the clusters with too few final stops into the nearest cluster """
+        def final_count(cluster):
+            return sum(self.__chosen_stops[idx].is_final_stop for idx in cluster)
+
+        while len(clusters) > 1:
+            invalid = [cluster for cluster in clusters if final_count(cluster) < self.MIN_FINAL_STOPS]
+            if not invalid:
+                break
+
+            cluster = min(invalid, key=len)
+            clusters.remove(cluster)
+            center = coordinates[cluster].mean(axis=0)
+            nearest = min(clusters, key=lambda other: np.linalg.norm(coordinates[other].mean(axis=0) - center))
+            nearest.extend(cluster)
+
+        return clusters
+
+    def __get_routes_shares(self, clusters):
+        """ Split the routes between the clusters proportionally to their stops count (largest remainder) """
+        total_stops = sum(len(cluster) for cluster in clusters)
+        extra_routes = self.__num_routes - self.MIN_ROUTES * len(clusters)
+        exact_shares = [extra_routes * len(cluster) / total_stops for cluster in clusters]
+        shares = [self.MIN_ROUTES + int(share) for share in exact_shares]
+
+        by_remainder = sorted(range(len(clusters)), key=lambda idx: exact_shares[idx] - int(exact_shares[idx]),
+                              reverse=True)
+        for idx in by_remainder[:self.__num_routes - sum(shares)]:
+            shares[idx] += 1
+
+        return shares
+
+    def __get_cluster_count(self):
+        final_stops_count = sum(stop.is_final_stop for stop in self.__chosen_stops)
+        return max(1, min(math.ceil(len(self.__chosen_stops) / self.__cluster_size),
+                          self.__num_routes // self.MIN_ROUTES,
+                          final_stops_count // self.MIN_FINAL_STOPS))
+
+    def __optimize_clusters(self, clusters, shares):
+        """ Optimize the clusters in parallel processes and stitch their routes into one solution """
+        stops_by_id = {stop.id: stop for stop in self.__chosen_stops}
+        cluster_durations = [None] * len(clusters)
+        solution = []
+
+        # The workers poll a process-shared copy of the cancellation token
+        cancel_event = get_mp_context().Event()
+        max_workers = min(len(clusters), self.__max_workers or len(clusters))
+        with create_process_pool(max_workers, initializer=_init_cluster_worker, initargs=(cancel_event,)) as executor:
+            futures = {executor.submit(_optimize_cluster, self.__algorithm,
+                                       [self.__chosen_stops[idx] for idx in cluster], share, self.__city_id,
+                                       self.__parameters): cluster_idx
+                       for cluster_idx, (cluster, share) in enumerate(zip(clusters, shares))}
+
+            pending = set(futures)
+            while pending:
+                done, pending = wait(pending, timeout=self.CANCELLATION_POLL_SECONDS, return_when=FIRST_COMPLETED)
+                if self.__cancellation_token and self.__cancellation_token.is_cancelled:
+                    # Stop the running clusters and drop the queued ones before the pool waits for its workers
+                    cancel_event.set()
+                    for future in pending:
+                        future.cancel()
+                    self.__cancellation_token.raise_if_cancelled()
+
+                for future in done:
+                    routes, duration = future.result()
+                    cluster_durations[futures[future]] = duration
+                    solution += [[stops_by_id[stop_id] for stop_id in route] for route in routes]
+
+        return solution, cluster_durations
+
+    def execute_optimization(self):
+        """ Execute the decomposed optimization. Returns the stitched solution, the refined final solution,
+        the algorithm parameters and iteration info like OptimizationHandler """
+        cluster_count = self.__get_cluster_count()
+        if cluster_count == 1:
+            # Too small to be split - optimize the whole stop set directly
+            return OptimizationHandler.execute_optimization(self.__algorithm, self.__chosen_stops, self.__num_routes,
+                                                            self.__city_id, self.__parameters,
+                                                            cancellation_token=self.__cancellation_token)
+
+        start_time = time.perf_counter()
+        clusters = self.__cluster_stops(cluster_count)
+        shares = self.__get_routes_shares(clusters)
+        stitched_solution, cluster_durations = self.__optimize_clusters(clusters, shares)
+        clusters_duration = round(time.perf_counter() - start_time, 3)
+
+        if self.__cancellation_token:
+            self.__cancellation_token.raise_if_cancelled()
+
+        # Refine the whole network - swaps are not limited to the routes of one cluster
+        user_parameters = {name: value for name, value in self.__parameters.items()
+                           if name in self.REFINEMENT_PARAMETERS}
+        refinement = SimulatedAnnealing(self.__city_id, iterations=self.__refine_iterations,
+                                        cancellation_token=self.__cancellation_token, **user_parameters)
+        _, final_solution, refinement_parameters, iteration_info = refinement.execute_optimization(
+            self.__chosen_stops, self.__num_routes, stitched_solution)
+
+        algorithm_parameters = {
+            "decomposition": True,
+            "algorithm": self.__algorithm,
+            "clusters_count": len(clusters),
+            "cluster_sizes": [len(cluster) for cluster in clusters],
+            "cluster_routes": shares,
+            "cluster_durations": cluster_durations,
+            "clusters_duration": clusters_duration,
+            "refinement": refinement_parameters
+        }
+
+        return stitched_solution, final_solution, algorithm_parameters, iteration_info
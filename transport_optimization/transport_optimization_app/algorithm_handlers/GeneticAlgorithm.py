@@ -0,0 +1,178 @@
+import random
+import numpy as np
+from .SolutionsHandler import SolutionsHandler
+
+
+class GeneticAlgorithm:
+    def __init__(self, chosen_stops, num_routes, generations=150, population_size=60, crossover_rate=0.9,
+                 mutation_rate=0.3, tournament_size=3, elite_count=2, local_search_neighbors=20, city_id=None,
+                 initial_solution=None, cancellation_token=None):
+        if num_routes == 0:
+            raise Exception("Number of routes should be greater than zero!")
+
+        self.__chosen_stops = chosen_stops
+        self.__num_routes = num_routes
+        self.__generations = generations
+        self.__population_size = population_size
+        self.__crossover_rate = crossover_rate
+        self.__mutation_rate = mutation_rate
+        self.__tournament_size = tournament_size
+        self.__elite_count = elite_count
+        self.__local_search_neighbors = local_search_neighbors
+        self.__initial_solution = initial_solution
+        self.__cancellation_token = cancellation_token
+        if initial_solution and len(initial_solution) != num_routes:
+            raise ValueError("The initial solution should have the given number of routes!")
+
+        # Initialize needed handlers
+        self.__solutions_handler = SolutionsHandler(city_id)
+
+        # Map each stop to its index in the travel matrices. The extra index after the last stop is used
+        # for padding the routes - its row and column are zeros, so padded positions add nothing to the score
+        self.__stop_index = {stop: idx for idx, stop in enumerate(chosen_stops)}
+        self.__padding_idx = len(chosen_stops)
+
+        time_matrix, distance_matrix = self.__solutions_handler.stop_handler.get_travel_matrices(chosen_stops)
+        self.__time_matrix = np.zeros((len(chosen_stops) + 1, len(chosen_stops) + 1), dtype=np.int64)
+        self.__time_matrix[:-1, :-1] = time_matrix
+        self.__distance_matrix = np.zeros((len(chosen_stops) + 1, len(chosen_stops) + 1), dtype=np.int64)
+        self.__distance_matrix[:-1, :-1] = distance_matrix
+
+    def __encode_population(self, population):
+        """ Convert a list of solutions to a padded (solutions x routes x stops) array of stop indices """
+        max_route_length = max(len(route) for solution in population for route in solution)
+        encoded = np.full((len(population), self.__num_routes, max_route_length), self.__padding_idx, dtype=np.intp)
+        for s, solution in enumerate(population):
+            for r, route in enumerate(solution):
+                encoded[s, r, :len(route)] = [self.__stop_index[stop] for stop in route]
+
+        return encoded
+
+    def __evaluate_population(self, encoded):
+        """ Score all solutions at once with a single gather over the travel matrices """
+        from_idx, to_idx = encoded[:, :, :-1], encoded[:, :, 1:]
+        total_times = self.__time_matrix[from_idx, to_idx].sum(axis=(1, 2))
+        total_distances = self.__distance_matrix[from_idx, to_idx].sum(axis=(1, 2))
+
+        # Routes contain no duplicate stops, so the coverage is the count of non-padding positions
+        coverage_scores = (encoded != self.__padding_idx).sum(axis=(1, 2))
+        scores = total_times + total_distances - coverage_scores * 10
+
+        return scores, total_times, total_distances
+
+    def __generate_initial_population(self):
+        """ Generate random initial solutions """
+        population = []
+
+        # Include the given initial solution (e.g. the current network) in the population
+        if self.__initial_solution:
+            routes = [list(route) for route in self.__initial_solution]
+            population.append(self.__solutions_handler.initial_solution_setup(routes, self.__chosen_stops))
+
+        while len(population) < self.__population_size:
+            routes = self.__solutions_handler.generate_initial_routes(self.__num_routes, self.__chosen_stops)
+            population.append(self.__solutions_handler.initial_solution_setup(routes, self.__chosen_stops))
+
+        return population
+
+    def __select_parent(self, population, scores):
+        """ Tournament selection - pick the best of a few random solutions """
+        contenders = random.sample(range(len(population)), min(self.__tournament_size, len(population)))
+        return population[min(contenders, key=lambda idx: scores[idx])]
+
+    def __crossover(self, first_parent, second_parent):
+        """ Take the middle stops of each route from one of the parents and repair the child. The route ends are
+        kept from the first parent - the repair does not add final stops, so mixed ends could lose some of them """
+        child = []
+        for first_route, second_route in zip(first_parent, second_parent):
+            ends = (first_route[0], first_route[-1])
+            middle_stops = first_route[1:-1] if random.random() < 0.5 else second_route[1:-1]
+            child.append([ends[0], *[stop for stop in middle_stops if stop not in ends], ends[1]])
+
+        # Remove duplicate stops and make sure important stops are present in enough routes
+        return self.__solutions_handler.initial_solution_setup(child, self.__chosen_stops)
+
+    def __mutate(self, solution):
+        """ Swap stops between two routes of the solution """
+        if self.__num_routes < 2:
+            return solution
+        return self.__solutions_handler.swap_stops(solution)
+
+    def __local_search(self, solution, score):
+        """ Improve a solution by evaluating a batch of its neighbors at once and keeping the best one """
+        if self.__num_routes < 2 or not self.__local_search_neighbors:
+            return solution, score
+
+        neighbors = [self.__solutions_handler.swap_stops(solution) for _ in range(self.__local_search_neighbors)]
+        neighbor_scores, _, _ = self.__evaluate_population(self.__encode_population(neighbors))
+        best_idx = int(np.argmin(neighbor_scores))
+        if neighbor_scores[best_idx] < score:
+            return neighbors[best_idx], neighbor_scores[best_idx]
+
+        return solution, score
+
+    def execute_optimization(self):
+        """ Execute genetic algorithm optimization """
+        iteration_times, iteration_distances, iteration_best_scores = [], [], []
+        best_solution = None
+        best_score = float('inf')
+
+        population = self.__generate_initial_population()
+
+        for generation in range(self.__generations):
+            # Stop early if the request that started the optimization was abandoned
+            if self.__cancellation_token:
+                self.__cancellation_token.raise_if_cancelled()
+
+            encoded = self.__encode_population(population)
+            scores, total_times, total_distances = self.__evaluate_population(encoded)
+            ranking = np.argsort(scores)
+
+            # Improve the best solution of the generation with a local search (memetic step)
+            best_idx = int(ranking[0])
+            population[best_idx], scores[best_idx] = self.__local_search(population[best_idx], scores[best_idx])
+
+            if scores[best_idx] < best_score:
+                best_score = int(scores[best_idx])
+                best_solution = population[best_idx]
+
+            iteration_times.append(round(int(total_times.min()) / 60, 2))
+            iteration_distances.append(round(int(total_distances.min()) / 1000, 2))
+            iteration_best_scores.append(int(scores[best_idx]))
+
+            # Keep the best solutions unchanged and fill the rest of the next generation with offspring
+            next_population = [population[idx] for idx in ranking[:self.__elite_count]]
+            while len(next_population) < self.__population_size:
+                first_parent = self.__select_parent(population, scores)
+                second_parent = self.__select_parent(population, scores)
+
+                if random.random() < self.__crossover_rate:
+                    child = self.__crossover(first_parent, second_parent)
+                else:
+                    child = [list(route) for route in first_parent]
+
+                if random.random() < self.__mutation_rate:
+                    child = self.__mutate(child)
+
+                next_population.append(child)
+
+            population = next_population
+
+        algorithm_parameters = {
+            "generations": self.__generations,
+            "population_size": self.__population_size,
+            "crossover_rate": self.__crossover_rate,
+            "mutation_rate": self.__mutation_rate,
+            "tournament_size": self.__tournament_size,
+            "elite_count": self.__elite_count,
+            "local_search_neighbors": self.__local_search_neighbors,
+            "initial_solution_used": bool(self.__initial_solution)
+        }
+
+        iteration_info = {
+            "iteration_times": iteration_times,
+            "iteration_distances": iteration_distances,
+            "iteration_best_scores": iteration_best_scores
+        }
+
+        return best_solution, algorithm_parameters, iteration_info
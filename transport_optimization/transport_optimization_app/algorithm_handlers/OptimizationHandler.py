@@ -0,0 +1,32 @@
+from .SimulatedAnnealing import SimulatedAnnealing
+from .AntColonyOptimization import AntColonyOptimization
+from .GeneticAlgorithm import GeneticAlgorithm
+
+
+class OptimizationHandler:
+    ALGORITHMS = ("simulated_annealing", "aco", "genetic")
+
+    @classmethod
+    def execute_optimization(cls, algorithm, chosen_stops, num_routes, city_id=None, parameters=None,
+                             input_solution=None, cancellation_token=None):
+        """ Run the chosen algorithm and get its initial solution (only for SA), final solution,
+        parameters and iteration info. SA starts from the input solution, ACO seeds its pheromone with it
+        and GA includes it in the initial population. The algorithms poll the cancellation token each iteration
+        and raise OptimizationCancelled once it is cancelled """
+        parameters = {**(parameters or {}), "cancellation_token": cancellation_token}
+
+        if algorithm == "simulated_annealing":
+            sim_ann = SimulatedAnnealing(city_id, **parameters)
+            return sim_ann.execute_optimization(chosen_stops, num_routes, input_solution)
+
+        if algorithm == "aco":
+            aco = AntColonyOptimization(chosen_stops, num_routes, city_id=city_id, initial_solution=input_solution,
+                                        **parameters)
+            return None, *aco.execute_optimization()
+
+        if algorithm == "genetic":
+            genetic = GeneticAlgorithm(chosen_stops, num_routes, city_id=city_id, initial_solution=input_solution,
+                                       **parameters)
+            return None, *genetic.execute_optimization()
+
+        raise ValueError(f"Unknown algorithm '{algorithm}'!")
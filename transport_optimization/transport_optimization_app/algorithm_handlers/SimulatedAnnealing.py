@@ -1,25 +1,32 @@
 import math
 import random
 from .SolutionsHandler import SolutionsHandler
+from .SolutionState import SolutionState
+from ..simulation_handlers.PassengerSurrogate import PassengerSurrogate
 
 
 class SimulatedAnnealing:
-    def __init__(self):
-        self.__solutions_handler = SolutionsHandler()
+    def __init__(self, city_id=None, iterations=2400, cooling_rate=0.999, surrogate_weight=0,
+                 cancellation_token=None):
+        self.__solutions_handler = SolutionsHandler(city_id)
+        self.__cancellation_token = cancellation_token
+        self.__surrogate_weight = surrogate_weight
         self.__initial_temp = None
-        self.__cooling_rate = 0.999
-        self.__iterations = 2400
+        self.__cooling_rate = cooling_rate
+        self.__iterations = iterations
 
-    def __evaluate_initial_temperature(self, initial_solution, initial_solution_score,
-                                       samples=800, target_acceptance=0.8):
+    def __evaluate_initial_temperature(self, state, samples=800, target_acceptance=0.8):
         """ Evaluate the initial temperature for this run based on the score magnitude"""
         deltas = []
         for _ in range(samples):
-            new_solution = self.__solutions_handler.swap_stops(initial_solution)
-            new_solution_score, _, _ = self.__solutions_handler.evaluate_solution(new_solution)
-            delta = new_solution_score - initial_solution_score
-            if delta > 0:
-                deltas.append(delta)
+            if self.__cancellation_token:
+                self.__cancellation_token.raise_if_cancelled()
+
+            # Sample the neighbors in place - each move is undone right after scoring it
+            move = state.propose()
+            state.reject(move)
+            if move.delta > 0:
+                deltas.append(move.delta)
 
         if not deltas:
             return 1000
@@ -42,28 +49,42 @@ class SimulatedAnnealing:
         # Set up the initial solution - check for duplicate stops and check important stops presence
         initial_solution = self.__solutions_handler.initial_solution_setup(initial_solution, chosen_stops)
 
-        # Set initial solution as current one and calculate the score for it
-        current_solution = initial_solution
-        current_score, total_time, total_distance = self.__solutions_handler.evaluate_solution(current_solution)
+        # Optimize also for the estimated passenger outcome, scaled to the route costs of the initial solution
+        if self.__surrogate_weight:
+            surrogate = PassengerSurrogate(chosen_stops, self.__solutions_handler.stop_handler)
+            self.__solutions_handler.set_passenger_surrogate(surrogate, self.__surrogate_weight, initial_solution)
+
+        # Set initial solution as current one and calculate the score for it. The current solution is changed
+        # in place by the moves, only improvements of the best solution are copied
+        state = SolutionState(initial_solution, self.__solutions_handler)
+        best_solution, best_score = state.snapshot(), state.score
 
         # Calculate what the initial temperature should be for the given run
-        self.__initial_temp = self.__evaluate_initial_temperature(initial_solution, current_score)
+        self.__initial_temp = self.__evaluate_initial_temperature(state)
         temperature = self.__initial_temp
 
-        iteration_times.append(round(total_time / 60, 2))
-        iteration_distances.append(round(total_distance / 1000, 2))
+        iteration_times.append(round(state.total_time / 60, 2))
+        iteration_distances.append(round(state.total_distance / 1000, 2))
 
         window_accepts, window_total = 0, 0
         for i in range(self.__iterations):
-            new_solution = self.__solutions_handler.swap_stops(current_solution)
-            new_score, total_time, total_distance = self.__solutions_handler.evaluate_solution(new_solution)
+            # Stop early if the request that started the optimization was abandoned
+            if self.__cancellation_token:
+                self.__cancellation_token.raise_if_cancelled()
+
+            move = state.propose()
+            _, total_time, total_distance = move.totals
 
             iteration_times.append(round(total_time / 60, 2))
             iteration_distances.append(round(total_distance / 1000, 2))
 
-            if new_score < current_score or random.random() < math.exp((current_score - new_score) / temperature):
+            if move.delta < 0 or random.random() < math.exp(-move.delta / temperature):
                 window_accepts += 1
-                current_solution, current_score = new_solution, new_score
+                state.accept(move)
+                if state.score < best_score:
+                    best_solution, best_score = state.snapshot(), state.score
+            else:
+                state.reject(move)
             window_total += 1
 
             # Every 200 iterations check the acceptance rate and update the cooling rate if needed
@@ -83,7 +104,9 @@ class SimulatedAnnealing:
         algorithm_parameters = {
             "iterations": self.__iterations,
             "initial_temp": self.__initial_temp,
-            "cooling_rate": self.__cooling_rate
+            "cooling_rate": self.__cooling_rate,
+            "surrogate_weight": self.__surrogate_weight,
+            "input_solution_used": bool(input_solution)
         }
 
         iteration_info = {
@@ -91,4 +114,4 @@ class SimulatedAnnealing:
             "iteration_distances": iteration_distances
         }
 
-        return initial_solution, current_solution, algorithm_parameters, iteration_info
+        return initial_solution, best_solution, algorithm_parameters, iteration_info
@@ -0,0 +1,51 @@
+class SolutionState:
+    """ Solution changed in place by moves. Keeps the cost of each route, so a move is scored by re-evaluating
+    only the routes it changed, and copies the routes only when a snapshot is requested """
+
+    def __init__(self, solution, solutions_handler):
+        self.routes = [list(route) for route in solution]
+        self.__solutions_handler = solutions_handler
+
+        self.__route_costs = [solutions_handler.get_route_cost(route) for route in self.routes]
+        self.__totals = tuple(sum(costs[k] for costs in self.__route_costs) for k in range(3))
+        self.__surrogate_score = solutions_handler.get_surrogate_score(self.routes)
+        self.score = solutions_handler.combine_score(*self.__totals, self.__surrogate_score)
+
+    @property
+    def total_time(self):
+        return self.__totals[0]
+
+    @property
+    def total_distance(self):
+        return self.__totals[1]
+
+    def propose(self):
+        """ Apply a random swap in place and score the changed solution (the move keeps the new score and delta) """
+        move = self.__solutions_handler.create_random_swap(self.routes)
+        move.apply(self.routes)
+
+        move.route_costs = {idx: self.__solutions_handler.get_route_cost(self.routes[idx])
+                            for idx in set(move.route_indices)}
+        move.totals = tuple(self.__totals[k] + sum(costs[k] - self.__route_costs[idx][k]
+                                                   for idx, costs in move.route_costs.items())
+                            for k in range(3))
+        move.surrogate_score = self.__solutions_handler.get_surrogate_score(self.routes)
+        move.score = self.__solutions_handler.combine_score(*move.totals, move.surrogate_score)
+        move.delta = move.score - self.score
+        return move
+
+    def accept(self, move):
+        """ Keep the applied move """
+        for idx, costs in move.route_costs.items():
+            self.__route_costs[idx] = costs
+        self.__totals = move.totals
+        self.__surrogate_score = move.surrogate_score
+        self.score = move.score
+
+    def reject(self, move):
+        """ Undo the applied move """
+        move.revert(self.routes)
+
+    def snapshot(self):
+        """ Copy of the current routes """
+        return [list(route) for route in self.routes]
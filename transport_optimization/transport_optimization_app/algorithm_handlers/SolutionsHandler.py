@@ -1,10 +1,24 @@
 import random
 from .StopHandler import StopHandler
+from .SwapMove import SwapMove
 
 
 class SolutionsHandler:
-    def __init__(self):
-        self.stop_handler = StopHandler()
+    def __init__(self, city_id=None):
+        self.stop_handler = StopHandler(city_id)
+        self.__passenger_surrogate = None
+        self.__surrogate_weight = 0
+
+    def set_passenger_surrogate(self, passenger_surrogate, weight, reference_solution):
+        """ Mix the estimated passenger score of a surrogate into the solution score with the given weight.
+        The surrogate score (km + minutes + transfers of an average trip) is rescaled to the route costs (seconds +
+        meters of the whole network) of the reference solution - with weight 1 both count the same for it """
+        self.__passenger_surrogate, self.__surrogate_weight = None, 0
+        route_score, _, _ = self.evaluate_solution(reference_solution)
+        surrogate_score = passenger_surrogate.evaluate(reference_solution)
+
+        self.__passenger_surrogate = passenger_surrogate
+        self.__surrogate_weight = weight * abs(route_score) / surrogate_score if surrogate_score > 0 else 0
 
     def initial_solution_setup(self, routes, chosen_stops):
         """ Initial solution setup - remove duplicates and set stop importance """
@@ -32,49 +46,69 @@ class SolutionsHandler:
 
         return routes
 
-    def swap_stops(self, solution):
-        """ Swap two random stops in two randomly selected routes of a given solution """
-        solution_as_lists = [list(route) for route in solution]
-        route1, route2 = random.sample(solution_as_lists, 2)
-        if route1 and route2:
+    def create_random_swap(self, solution):
+        """ Pick a swap of two random stops in two randomly selected routes of a given solution (not applied) """
+        route1_idx, route2_idx = random.sample(range(len(solution)), 2)
+        route1, route2 = solution[route1_idx], solution[route2_idx]
+        if not route1 or not route2:
+            # Nothing to swap - the move leaves the solution unchanged (scored with delta 0)
+            return SwapMove(route1_idx, None, route2_idx, None, self.stop_handler)
+
+        stop1 = random.choice(route1)
+        while stop1 in route2:
             stop1 = random.choice(route1)
-            while stop1 in route2:
-                stop1 = random.choice(route1)
-
-            if stop1.is_final_stop:
-                stop2_options = [route2[0], route2[len(route2) - 1]]
-                for stop2 in stop2_options:
-                    if stop2 in route1 or stop2 == stop1:
-                        continue
-                    s1_idx = route1.index(stop1)
-                    s2_idx = route2.index(stop2)
-                    route1[s1_idx], route2[s2_idx] = route2[s2_idx], route1[s1_idx]
-                    break
-            else:
+
+        stop2 = None
+        if stop1.is_final_stop:
+            for stop2_option in [route2[0], route2[len(route2) - 1]]:
+                if stop2_option in route1 or stop2_option == stop1:
+                    continue
+                stop2 = stop2_option
+                break
+        elif len(route2) > 2:
+            # A route of only its final stops has no middle stop to swap with, stop2 stays None (no change)
+            stop2 = random.choice(route2[1:-1])
+            while stop2 in route1:
                 stop2 = random.choice(route2[1:-1])
-                while stop2 in route1:
-                    stop2 = random.choice(route2[1:-1])
-                route1.remove(stop1)
-                route2.remove(stop2)
-                self.stop_handler.insert_stop_in_route(route1, stop2)
-                self.stop_handler.insert_stop_in_route(route2, stop1)
 
+        return SwapMove(route1_idx, stop1, route2_idx, stop2, self.stop_handler)
+
+    def swap_stops(self, solution):
+        """ Swap two random stops in two randomly selected routes of a given solution """
+        solution_as_lists = [list(route) for route in solution]
+        self.create_random_swap(solution_as_lists).apply(solution_as_lists)
         return solution_as_lists
 
+    def get_route_cost(self, route):
+        """ Get the travel time, distance and coverage (unique stops) of a route """
+        total_time = 0
+        total_distance = 0
+        for i in range(len(route) - 1):
+            total_time += self.stop_handler.get_travel_time(route[i], route[i + 1])
+            total_distance += self.stop_handler.get_distance(route[i], route[i + 1])
+        return total_time, total_distance, len(set(route))
+
+    def get_surrogate_score(self, solution):
+        """ Get the estimated passenger score of the solution (0 without a surrogate) """
+        if self.__passenger_surrogate is None:
+            return 0
+        return self.__passenger_surrogate.evaluate(solution)
+
+    def combine_score(self, total_time, total_distance, coverage_score, surrogate_score):
+        """ Combine the solution totals into its score (lower is better) """
+        return total_time + total_distance - coverage_score * 10 + self.__surrogate_weight * surrogate_score
+
     def evaluate_solution(self, solution):
         """ Calculate efficiency of the routes """
         total_time = 0
         total_distance = 0
         coverage_score = 0
         for route in solution:
-            for i in range(len(route) - 1):
-                travel_time = self.stop_handler.get_travel_time(route[i], route[i + 1])
-                travel_distance = self.stop_handler.get_distance(route[i], route[i + 1])
-                total_time += travel_time
-                total_distance += travel_distance
-            unique_stops = set(route)
-            coverage_score += len(unique_stops)
-
-        score = total_time + total_distance - coverage_score * 10
+            route_time, route_distance, route_coverage = self.get_route_cost(route)
+            total_time += route_time
+            total_distance += route_distance
+            coverage_score += route_coverage
+
+        score = self.combine_score(total_time, total_distance, coverage_score, self.get_surrogate_score(solution))
 
         return score, total_time, total_distance
@@ -1,25 +1,19 @@
 import datetime
-import googlemaps
+import threading
 from decouple import config
+from django.conf import settings
+from django.db import connection
 from ..models import TravelTime, Stop
+from ..data_handlers.TravelMatrixStore import TravelMatrixStore
+from ..data_handlers.SpatialIndex import SpatialIndex
+from ..data_handlers.TravelInfoFetcher import TravelInfoFetcher
 
 
 class StopHandler:
-    def __init__(self):
-        self.travel_time_dict = self.__get_travel_time_dict()
-        self.__times = [datetime.time(8, 0), datetime.time(12, 0), datetime.time(18, 0)]
-
-    @staticmethod
-    def __get_travel_time_dict():
-        """ Preload data into a dictionary for fast lookups """
-        travel_time_dict = {
-            (start_stop, end_stop, time_of_day): (travel_time_seconds, distance_meters)
-            for start_stop, end_stop, time_of_day, travel_time_seconds, distance_meters in
-            TravelTime.objects.values_list('start_stop__name', 'end_stop__name', 'time_of_day', 'travel_time_seconds',
-                                           'distance_meters')
-        }
-
-        return travel_time_dict
+    def __init__(self, city_id=None):
+        # With a city the travel info is read from the memory-mapped city matrix, otherwise all the fetched
+        # travel info is streamed from the DB into an in-memory matrix
+        self.travel_matrix = TravelMatrixStore.open(city_id) if city_id is not None else TravelMatrixStore.load_all()
 
     @staticmethod
     def define_stop_importance(chosen_stops, routes_count):
@@ -60,21 +54,22 @@ class StopHandler:
         return sorted_routes[0]
 
     def insert_stop_in_route(self, route, stop):
-        """ Insert a middle stop in the best position in the route that minimizes the distance """
-        min_total_distance = float('inf')
+        """ Insert a middle stop in the best position in the route that minimizes the distance.
+        Returns the position the stop was inserted at """
+        min_added_distance = float('inf')
         best_position = 0
 
+        # The route distance changes only by the replaced segment, so the positions are compared by that change
         for i in range(1, len(route)):
-            new_route = route[:i] + [stop] + route[i:]
-            total_distance = 0
-            for j in range(len(new_route) - 1):
-                total_distance += self.get_distance(new_route[j], new_route[j + 1])
+            added_distance = self.get_distance(route[i - 1], stop) + self.get_distance(stop, route[i]) \
+                - self.get_distance(route[i - 1], route[i])
 
-            if total_distance < min_total_distance:
-                min_total_distance = total_distance
+            if added_distance < min_added_distance:
+                min_added_distance = added_distance
                 best_position = i
 
         route.insert(best_position, stop)
+        return best_position
 
     def stop_importance_setup(self, routes, chosen_stops):
         """ Make sure each stop is in a given number of routes depending on its importance(passenger_flow) """
@@ -103,67 +98,105 @@ class StopHandler:
 
     def get_travel_time(self, stop1, stop2):
         """ Get the travel time between two stops from the DB (taking into account all times of the day) """
-        total_time = 0
-        for time_of_day in self.__times:
-            tt_data = self.travel_time_dict.get((str(stop1), str(stop2), time_of_day))
-            travel_time, _ = tt_data
-            total_time += travel_time
-        return int(total_time/len(self.__times))
+        return self.travel_matrix.get_avg_travel_time(stop1, stop2)
 
     def get_distance(self, stop1, stop2):
         """ Get the distance between two stops from the DB (taking into account all times of the day) """
-        total_distance = 0
-        for time_of_day in self.__times:
-            tt_data = self.travel_time_dict[(str(stop1), str(stop2), time_of_day)]
-            _, distance = tt_data
-            total_distance += distance
-        return int(total_distance/len(self.__times))
+        return self.travel_matrix.get_avg_distance(stop1, stop2)
 
-    @classmethod
-    def extract_travel_info(cls, new_stop):
-        future_times = [
+    def get_travel_matrices(self, stops):
+        """ Get the travel time and distance matrices for the given stops (indexed by their position in the list) """
+        return self.travel_matrix.get_sub_matrices(stops)
+
+    @staticmethod
+    def __get_future_times():
+        """ Get tomorrow's departure times for which the travel info is extracted """
+        return [
             datetime.datetime.now().replace(hour=8, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1),
             datetime.datetime.now().replace(hour=12, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1),
             datetime.datetime.now().replace(hour=18, minute=0, second=0, microsecond=0) + datetime.timedelta(days=1)
         ]
 
-        stops = Stop.objects.all()
+    @staticmethod
+    def __get_nearest_count(nearest_count):
+        """ Number of nearest stops with fetched travel info (0 fetches all pairs) """
+        return settings.TRAVEL_INFO_NEAREST_COUNT if nearest_count is None else nearest_count
 
-        for stop in stops:
-            if new_stop == stop:
-                continue
+    @classmethod
+    def extract_travel_info(cls, new_stop, nearest_count=None):
+        cls.extract_travel_info_bulk([new_stop], nearest_count)
 
-            for t in future_times:
-                # Direction: new_stop -> db_stop
-                cls.__extract_api_info(new_stop, stop, t)
+    @classmethod
+    def extract_travel_info_bulk(cls, new_stops, nearest_count=None):
+        """ Fill the travel info rows and columns of the new stops with concurrent batched API calls """
+        nearest_count = cls.__get_nearest_count(nearest_count)
+        new_stop_ids = {stop.id for stop in new_stops}
+        # The travel matrices are per city, pairs with the stops of other cities are never used
+        stops = list(Stop.objects.filter(city_id__in={stop.city_id for stop in new_stops}))
+        existing_stops = [stop for stop in stops if stop.id not in new_stop_ids]
+
+        nearest_stops_map = {}
+        if nearest_count:
+            # Sparse mode - fetch only the nearest stops of the city, the other pairs are estimated by the matrix store
+            city_indexes = {city_id: SpatialIndex([stop for stop in stops if stop.city_id == city_id])
+                            for city_id in {stop.city_id for stop in new_stops}}
+            for new_stop in new_stops:
+                nearest_stops_map[new_stop] = city_indexes[new_stop.city_id].nearest_stops(new_stop, nearest_count)
+
+        requests = []
+        for t in cls.__get_future_times():
+            if nearest_count:
+                for new_stop, nearest_stops in nearest_stops_map.items():
+                    requests += [([new_stop], nearest_stops, t), (nearest_stops, [new_stop], t)]
+            else:
+                # Rows: new stops -> all stops, columns: existing stops -> new stops
+                requests += [(new_stops, stops, t), (existing_stops, new_stops, t)]
+
+        result = cls.create_travel_info_fetcher().fetch_and_save(requests)
+
+        # The failed pairs are kept as TravelTimeFailure rows, so the stops themselves are done
+        Stop.objects.filter(id__in=new_stop_ids).update(travel_info_pending=False)
+        return result
 
-                # Direction: db_stop -> new_stop
-                cls.__extract_api_info(stop, new_stop, t)
+    @classmethod
+    def schedule_travel_info_extraction(cls, new_stops):
+        """ Run the batched travel info extraction for the new stops in a background thread. The stops stay marked
+        as pending until it completes, so work lost with the process is picked up by the retry_travel_info command """
+        def extract():
+            try:
+                cls.extract_travel_info_bulk(new_stops)
+            finally:
+                # The thread opened its own DB connection
+                connection.close()
+
+        threading.Thread(target=extract, daemon=True).start()
+
+    @classmethod
+    def create_travel_info_fetcher(cls):
+        """ Create a fetcher requesting the travel info with the configured client """
+        source = TravelTime.Source.STUB if settings.GMAPS_STUB else TravelTime.Source.API
+        return TravelInfoFetcher(cls.get_gmaps_client(), source)
 
     @staticmethod
-    def __extract_api_info(first_stop, second_stop, time_of_day):
-        gmaps = googlemaps.Client(key=config('GMAPS_API'))
-        timestamp = int(time_of_day.timestamp())
-
-        result = gmaps.distance_matrix(
-            origins=[(first_stop.latitude, first_stop.longitude)],
-            destinations=[(second_stop.latitude, second_stop.longitude)],
-            mode="driving",
-            departure_time=timestamp
-        )
-
-        if result['status'] == 'OK':
-            elements = result['rows'][0]['elements'][0]
-            if elements['status'] == 'OK':
-                travel_time_seconds = elements['duration']['value']
-                distance_meters = elements['distance']['value']
-
-                TravelTime.objects.update_or_create(
-                    start_stop=first_stop,
-                    end_stop=second_stop,
-                    time_of_day=time_of_day,
-                    defaults={
-                        'travel_time_seconds': travel_time_seconds,
-                        'distance_meters': distance_meters,
-                    }
-                )
\ No newline at end of file
+    def get_gmaps_client():
+        """ Create a Google Maps client - googlemaps is imported here, only by the processes that call the API.
+        With the GMAPS_STUB setting an offline client estimating the travel info is used instead """
+        if settings.GMAPS_STUB:
+            from ..data_handlers.StubDistanceMatrixClient import StubDistanceMatrixClient
+
+            return StubDistanceMatrixClient(settings.GMAPS_STUB_LATENCY_SECONDS, settings.GMAPS_STUB_ERROR_RATE)
+
+        import googlemaps
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        # One session for all the requests of the client, with a kept-alive connection per concurrent request
+        session = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=settings.GMAPS_MAX_WORKERS)
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+
+        # Over query limit responses are retried with backoff by the travel info fetcher
+        client_kwargs = {"base_url": settings.GMAPS_BASE_URL} if settings.GMAPS_BASE_URL else {}
+        return googlemaps.Client(key=config('GMAPS_API'), requests_session=session, retry_over_query_limit=False,
+                                 **client_kwargs)
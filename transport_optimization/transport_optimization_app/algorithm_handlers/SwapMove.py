@@ -0,0 +1,51 @@
+class SwapMove:
+    """ Swap of two stops between two routes, applied in place on the solution and reverted if it is rejected.
+    Final stops exchange their places at the route ends, middle stops are inserted at their best positions """
+
+    def __init__(self, route1_idx, stop1, route2_idx, stop2, stop_handler):
+        self.route_indices = (route1_idx, route2_idx)
+        self.__stop1 = stop1
+        self.__stop2 = stop2
+        self.__stop_handler = stop_handler
+        self.__undo = None
+
+        # Filled when the move is scored
+        self.route_costs = None
+        self.totals = None
+        self.surrogate_score = None
+        self.score = None
+        self.delta = None
+
+    def apply(self, solution):
+        """ Change the solution in place """
+        if self.__stop2 is None:
+            # No valid stop to swap with - the solution stays the same
+            return
+
+        route1, route2 = solution[self.route_indices[0]], solution[self.route_indices[1]]
+        idx1, idx2 = route1.index(self.__stop1), route2.index(self.__stop2)
+        if self.__stop1.is_final_stop:
+            route1[idx1], route2[idx2] = self.__stop2, self.__stop1
+            self.__undo = (idx1, idx2, None, None)
+        else:
+            del route1[idx1]
+            del route2[idx2]
+            position1 = self.__stop_handler.insert_stop_in_route(route1, self.__stop2)
+            position2 = self.__stop_handler.insert_stop_in_route(route2, self.__stop1)
+            self.__undo = (idx1, idx2, position1, position2)
+
+    def revert(self, solution):
+        """ Undo the applied changes """
+        if self.__undo is None:
+            return
+
+        route1, route2 = solution[self.route_indices[0]], solution[self.route_indices[1]]
+        idx1, idx2, position1, position2 = self.__undo
+        if position1 is None:
+            route1[idx1], route2[idx2] = self.__stop1, self.__stop2
+        else:
+            del route1[position1]
+            del route2[position2]
+            route1.insert(idx1, self.__stop1)
+            route2.insert(idx2, self.__stop2)
+        self.__undo = None
@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class TransportOptimizationAppConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'transport_optimization_app'
+
+    def ready(self):
+        from . import signals  # noqa: F401
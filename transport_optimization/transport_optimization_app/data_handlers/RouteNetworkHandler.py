@@ -0,0 +1,50 @@
+import uuid
+import datetime
+from django.db import transaction
+from ..models import Route, RouteStop
+
+
+class RouteNetworkHandler:
+    # The optimizations swap stops between two routes, so they need two routes with a middle stop each
+    MIN_ROUTES = 2
+    MIN_ROUTE_STOPS = 3
+
+    @staticmethod
+    def save_solution(solution, name_prefix=None):
+        """ Save the routes of a solution as Route/RouteStop rows and get the ids of the created routes """
+        # Route names are unique, the random suffix separates the solutions saved in the same second
+        name_prefix = name_prefix or f"Optimized {datetime.datetime.now():%Y-%m-%d %H:%M:%S} {uuid.uuid4().hex[:8]}"
+
+        with transaction.atomic():
+            routes = Route.objects.bulk_create([Route(name=f"{name_prefix} - {i + 1}") for i in range(len(solution))])
+            RouteStop.objects.bulk_create([
+                RouteStop(route=route, stop=stop, order=order)
+                for route, route_stops in zip(routes, solution)
+                for order, stop in enumerate(route_stops)
+            ])
+
+        return [route.id for route in routes]
+
+    @staticmethod
+    def load_solution(route_ids, chosen_stops=None):
+        """ Load saved routes as lists of stops (in the given routes order), optionally keeping only the chosen stops """
+        chosen_stop_ids = {stop.id for stop in chosen_stops} if chosen_stops is not None else None
+
+        routes = {route_id: [] for route_id in route_ids}
+        for route_stop in RouteStop.objects.filter(route_id__in=route_ids).select_related('stop').order_by('order'):
+            if chosen_stop_ids is None or route_stop.stop_id in chosen_stop_ids:
+                routes[route_stop.route_id].append(route_stop.stop)
+
+        return [routes[route_id] for route_id in route_ids if routes[route_id]]
+
+    @classmethod
+    def validate_solution(cls, solution):
+        """ Check that a loaded solution can be optimized - at least two routes, each starting and ending with
+        a final stop and with a middle stop. Raises ValueError otherwise """
+        if len(solution) < cls.MIN_ROUTES:
+            raise ValueError(f"At least {cls.MIN_ROUTES} routes with the chosen stops are needed.")
+
+        for route in solution:
+            if len(route) < cls.MIN_ROUTE_STOPS or not (route[0].is_final_stop and route[-1].is_final_stop):
+                raise ValueError("Each route should start and end with a chosen final stop and have a chosen "
+                                 "middle stop.")
@@ -0,0 +1,86 @@
+import time
+import threading
+import numpy as np
+from scipy.spatial import cKDTree
+from ..models import Stop
+
+
+class SpatialIndex:
+    """ KD-tree over the stop coordinates projected on the unit sphere """
+    EARTH_RADIUS_METERS = 6371000
+
+    # Cached city indexes are rebuilt after this time even without a local invalidation,
+    # since stop changes made by other worker processes are not signaled to this one
+    CACHE_TTL_SECONDS = 60
+
+    __cache = {}
+    __cache_lock = threading.Lock()
+
+    def __init__(self, stops):
+        self.__stops = list(stops)
+        self.__latitudes = np.array([stop.latitude for stop in self.__stops], dtype=np.float64)
+        self.__longitudes = np.array([stop.longitude for stop in self.__stops], dtype=np.float64)
+        self.__tree = cKDTree(self.__to_unit_vectors(self.__latitudes, self.__longitudes)) if self.__stops else None
+
+    @staticmethod
+    def __to_unit_vectors(latitudes, longitudes):
+        """ Convert coordinates to 3D points on the unit sphere, where straight-line distance grows with
+        the great-circle distance """
+        lat, lon = np.radians(latitudes), np.radians(longitudes)
+        return np.column_stack((np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)))
+
+    @classmethod
+    def __to_chord_length(cls, radius_meters):
+        """ Convert a great-circle distance to the straight-line distance between points on the unit sphere """
+        return 2 * np.sin(min(radius_meters / cls.EARTH_RADIUS_METERS, np.pi) / 2)
+
+    def query_radius(self, latitude, longitude, radius_meters):
+        """ Get the stops within the given distance from a point """
+        if self.__tree is None:
+            return []
+
+        point = self.__to_unit_vectors(np.array([latitude]), np.array([longitude]))[0]
+        indices = self.__tree.query_ball_point(point, self.__to_chord_length(radius_meters))
+        return [self.__stops[idx] for idx in sorted(indices)]
+
+    def query_bbox(self, min_latitude, min_longitude, max_latitude, max_longitude):
+        """ Get the stops within a latitude/longitude bounding box """
+        inside = ((self.__latitudes >= min_latitude) & (self.__latitudes <= max_latitude)
+                  & (self.__longitudes >= min_longitude) & (self.__longitudes <= max_longitude))
+        return [self.__stops[idx] for idx in np.flatnonzero(inside)]
+
+    def nearest(self, latitude, longitude, count):
+        """ Get the given number of stops closest to a point, closest first """
+        if self.__tree is None or count <= 0:
+            return []
+
+        point = self.__to_unit_vectors(np.array([latitude]), np.array([longitude]))[0]
+        _, indices = self.__tree.query(point, k=min(count, len(self.__stops)))
+        return [self.__stops[idx] for idx in np.atleast_1d(indices)]
+
+    def nearest_stops(self, stop, count):
+        """ Get the given number of stops closest to a stop, excluding the stop itself """
+        nearest = self.nearest(stop.latitude, stop.longitude, count + 1)
+        return [s for s in nearest if s.id != stop.id][:count]
+
+    @classmethod
+    def for_city(cls, city_id=None):
+        """ Get the cached index of the stops of a city (all stops if no city is given) """
+        with cls.__cache_lock:
+            cached = cls.__cache.get(city_id)
+            if cached and time.monotonic() - cached[1] < cls.CACHE_TTL_SECONDS:
+                return cached[0]
+
+        stops = Stop.objects.all() if city_id is None else Stop.objects.filter(city_id=city_id)
+        index = cls(stops)
+        with cls.__cache_lock:
+            cls.__cache[city_id] = (index, time.monotonic())
+
+        return index
+
+    @classmethod
+    def invalidate(cls, city_id):
+        """ Drop the cached indexes containing the stops of a city """
+        with cls.__cache_lock:
+            cls.__cache.pop(city_id, None)
+            cls.__cache.pop(None, None)
@@ -0,0 +1,67 @@
+import io
+import csv
+import json
+
+
+class StopImportHandler:
+    CSV_FIELDS = ("name", "latitude", "longitude", "passenger_flow", "is_final_stop")
+
+    @classmethod
+    def parse_file(cls, uploaded_file):
+        """ Parse an uploaded CSV or GeoJSON file to a list of raw stop rows """
+        content = uploaded_file.read()
+        if isinstance(content, bytes):
+            content = content.decode("utf-8-sig")
+
+        file_name = (getattr(uploaded_file, "name", "") or "").lower()
+        if file_name.endswith((".geojson", ".json")) or content.lstrip().startswith("{"):
+            return cls.parse_geojson(content)
+        return cls.parse_csv(content)
+
+    @classmethod
+    def parse_csv(cls, content):
+        """ Parse CSV content with a header row containing the stop fields """
+        reader = csv.DictReader(io.StringIO(content))
+        missing_fields = [field for field in cls.CSV_FIELDS if field not in (reader.fieldnames or [])]
+        if missing_fields:
+            raise ValueError(f"CSV file is missing the columns: {', '.join(missing_fields)}.")
+
+        return [{field: row[field] for field in cls.CSV_FIELDS} for row in reader]
+
+    @staticmethod
+    def parse_geojson(content):
+        """ Parse a GeoJSON FeatureCollection of Point features with the stop fields as properties """
+        try:
+            data = json.loads(content)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid GeoJSON file: {e}.")
+
+        if not isinstance(data, dict) or data.get("type") != "FeatureCollection":
+            raise ValueError("GeoJSON file must contain a FeatureCollection.")
+        features = data.get("features", [])
+        if not isinstance(features, list):
+            raise ValueError("GeoJSON features must be a list.")
+
+        rows = []
+        for feature in features:
+            geometry = feature.get("geometry") if isinstance(feature, dict) else None
+            if not isinstance(geometry, dict) or geometry.get("type") != "Point":
+                raise ValueError("All GeoJSON features must be Points.")
+
+            # GeoJSON coordinates are ordered as longitude, latitude
+            coordinates = geometry.get("coordinates")
+            if not isinstance(coordinates, list) or len(coordinates) < 2:
+                raise ValueError("All GeoJSON points must have longitude and latitude coordinates.")
+            longitude, latitude = coordinates[:2]
+            properties = feature.get("properties") or {}
+            if not isinstance(properties, dict):
+                raise ValueError("GeoJSON feature properties must be objects.")
+            rows.append({
+                "name": properties.get("name"),
+                "latitude": latitude,
+                "longitude": longitude,
+                "passenger_flow": properties.get("passenger_flow"),
+                "is_final_stop": properties.get("is_final_stop", False)
+            })
+
+        return rows
@@ -0,0 +1,38 @@
+import time
+import random
+import numpy as np
+from .TravelTimeEstimator import TravelTimeEstimator
+
+
+class StubDistanceMatrixClient:
+    """ Offline stand-in for the Google Maps client used for load tests and local development (GMAPS_STUB setting).
+    Answers distance matrix requests in the Google response format with estimates from the great-circle distance """
+
+    def __init__(self, latency_seconds=0, error_rate=0):
+        self.__latency_seconds = latency_seconds
+        self.__error_rate = error_rate
+
+    def distance_matrix(self, origins, destinations, mode="driving", departure_time=None):
+        """ Get the travel info between the (latitude, longitude) origins and destinations """
+        # Simulate the round trip to the API
+        if self.__latency_seconds:
+            time.sleep(self.__latency_seconds)
+
+        # Simulate transient API errors (retried by the travel info fetcher)
+        if self.__error_rate and random.random() < self.__error_rate:
+            return {"status": random.choice(["OVER_QUERY_LIMIT", "UNKNOWN_ERROR"]), "rows": []}
+
+        haversine = TravelTimeEstimator.haversine_distances([lat for lat, _ in origins], [lon for _, lon in origins],
+                                                            [lat for lat, _ in destinations],
+                                                            [lon for _, lon in destinations])
+        distances = np.maximum(np.rint(haversine * TravelTimeEstimator.DEFAULT_DETOUR_FACTOR), 1)
+        durations = np.maximum(np.rint(distances / TravelTimeEstimator.DEFAULT_SPEED_METERS_PER_SECOND), 1)
+
+        return {
+            "status": "OK",
+            "rows": [{"elements": [{"status": "OK",
+                                    "distance": {"value": int(distance)},
+                                    "duration": {"value": int(duration)}}
+                                   for distance, duration in zip(row_distances, row_durations)]}
+                     for row_distances, row_durations in zip(distances, durations)]
+        }
@@ -0,0 +1,207 @@
+import time
+import random
+import datetime
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .TravelMatrixStore import TravelMatrixStore
+from ..models import TravelTime, TravelTimeFailure
+
+
+class _TokenBucket:
+    """ Thread-safe token bucket - allows bursts of up to capacity requests, then rate requests per second """
+
+    def __init__(self, rate, capacity):
+        self.__rate = rate
+        self.__capacity = capacity
+        self.__tokens = capacity
+        self.__updated_at = time.monotonic()
+        self.__lock = threading.Lock()
+
+    def acquire(self):
+        """ Take a token, waiting until one is available """
+        while True:
+            with self.__lock:
+                now = time.monotonic()
+                self.__tokens = min(self.__capacity, self.__tokens + (now - self.__updated_at) * self.__rate)
+                self.__updated_at = now
+                if self.__tokens >= 1:
+                    self.__tokens -= 1
+                    return
+                wait_seconds = (1 - self.__tokens) / self.__rate
+            time.sleep(wait_seconds)
+
+
+class TravelInfoFetcher:
+    """ Fetch travel info from the Distance Matrix API with a bounded pool of concurrent requests, token bucket rate
+    limiting and retries of transient errors with exponential backoff. A single client (and HTTP session) is shared
+    by all requests. Pairs that still fail are saved as TravelTimeFailure rows to be retried later """
+    # Distance Matrix API limits a request to 25 origins/destinations and 100 elements
+    API_BATCH_SIZE = 10
+    # Statuses worth retrying, the others (invalid request, denied key, ...) fail the same way again
+    TRANSIENT_STATUSES = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
+    PERMANENT_HTTP_STATUSES = range(400, 500)
+
+    def __init__(self, client, source=TravelTime.Source.API, max_workers=None, requests_per_second=None,
+                 max_retries=None, backoff_seconds=None):
+        self.__client = client
+        self.__source = source
+        self.__max_workers = max_workers or settings.GMAPS_MAX_WORKERS
+        requests_per_second = requests_per_second or settings.GMAPS_REQUESTS_PER_SECOND
+        self.__rate_limiter = _TokenBucket(requests_per_second, max(1.0, requests_per_second))
+        self.__max_retries = settings.GMAPS_MAX_RETRIES if max_retries is None else max_retries
+        self.__backoff_seconds = settings.GMAPS_BACKOFF_SECONDS if backoff_seconds is None else backoff_seconds
+        self.__client_errors = self.__get_client_errors()
+
+    @staticmethod
+    def __get_client_errors():
+        """ The request errors of the googlemaps client. Other exceptions are bugs, they are not caught """
+        try:
+            from googlemaps.exceptions import ApiError, HTTPError, Timeout, TransportError
+        except ImportError:
+            # Without googlemaps only the stub client is used, which does not raise
+            return ()
+        return ApiError, HTTPError, Timeout, TransportError
+
+    @staticmethod
+    def get_departure_time(time_of_day):
+        """ Get tomorrow's departure at the given time of the day """
+        return datetime.datetime.combine(datetime.date.today() + datetime.timedelta(days=1), time_of_day)
+
+    def __is_transient(self, error):
+        """ Errors of the client - timeouts, connection and server errors are transient, so are transient statuses """
+        status = getattr(error, "status", None)
+        if status is not None:
+            return status in self.TRANSIENT_STATUSES
+        status_code = getattr(error, "status_code", None)
+        return status_code is None or status_code == 429 or status_code not in self.PERMANENT_HTTP_STATUSES
+
+    def __request(self, origins, destinations, departure_time):
+        """ Request the travel info of a block of pairs, retrying transient errors.
+        Returns the result and None or None and the error of the last attempt """
+        for attempt in range(self.__max_retries + 1):
+            if attempt:
+                # Exponential backoff with jitter, so the retried requests of the workers do not arrive together
+                time.sleep(self.__backoff_seconds * 2 ** (attempt - 1) * random.uniform(0.5, 1.0))
+            self.__rate_limiter.acquire()
+
+            try:
+                result = self.__client.distance_matrix(
+                    origins=[(stop.latitude, stop.longitude) for stop in origins],
+                    destinations=[(stop.latitude, stop.longitude) for stop in destinations],
+                    mode="driving",
+                    departure_time=int(departure_time.timestamp())
+                )
+            except self.__client_errors as e:
+                error, transient = f"{type(e).__name__}: {e}", self.__is_transient(e)
+            else:
+                if result["status"] == "OK":
+                    return result, None
+                error, transient = result["status"], result["status"] in self.TRANSIENT_STATUSES
+
+            if not transient:
+                break
+
+        return None, error[:200]
+
+    def __fetch_block(self, origins, destinations, departure_time):
+        """ Get the TravelTime rows and the failed pairs (start stop, end stop, time of day, error) of a block """
+        time_of_day = departure_time.time()
+        result, error = self.__request(origins, destinations, departure_time)
+        if result is None:
+            return [], [(first_stop, second_stop, time_of_day, error) for first_stop in origins
+                        for second_stop in destinations if first_stop.id != second_stop.id]
+
+        travel_times, failures = [], []
+        fetched_at = timezone.now()
+        for first_stop, row in zip(origins, result["rows"]):
+            for second_stop, elements in zip(destinations, row["elements"]):
+                if first_stop.id == second_stop.id:
+                    continue
+                if elements["status"] != "OK":
+                    failures.append((first_stop, second_stop, time_of_day, elements["status"]))
+                    continue
+                travel_times.append(TravelTime(
+                    start_stop=first_stop,
+                    end_stop=second_stop,
+                    time_of_day=time_of_day,
+                    travel_time_seconds=elements["duration"]["value"],
+                    distance_meters=elements["distance"]["value"],
+                    fetched_at=fetched_at,
+                    source=self.__source
+                ))
+
+        return travel_times, failures
+
+    def fetch(self, requests):
+        """ Fetch the travel info of (origins, destinations, departure time) requests concurrently, in blocks of
+        pairs. Returns the TravelTime rows and the failed pairs """
+        blocks = [(origins[i:i + self.API_BATCH_SIZE], destinations[j:j + self.API_BATCH_SIZE], departure_time)
+                  for origins, destinations, departure_time in requests
+                  for i in range(0, len(origins), self.API_BATCH_SIZE)
+                  for j in range(0, len(destinations), self.API_BATCH_SIZE)]
+
+        travel_times, failures = [], []
+        with ThreadPoolExecutor(max_workers=self.__max_workers) as executor:
+            for block_travel_times, block_failures in executor.map(lambda block: self.__fetch_block(*block), blocks):
+                travel_times += block_travel_times
+                failures += block_failures
+
+        # A pair can be requested twice, e.g. when two new stops are nearest to each other
+        unique_travel_times = {(tt.start_stop.id, tt.end_stop.id, tt.time_of_day): tt for tt in travel_times}
+        fetched_pairs = set(unique_travel_times)
+        unique_failures = {(first_stop.id, second_stop.id, time_of_day): (first_stop, second_stop, time_of_day, error)
+                           for first_stop, second_stop, time_of_day, error in failures
+                           if (first_stop.id, second_stop.id, time_of_day) not in fetched_pairs}
+
+        return list(unique_travel_times.values()), list(unique_failures.values())
+
+    @staticmethod
+    def save(travel_times, failures):
+        """ Save the fetched rows, record the failed pairs and forget the earlier failures of the fetched pairs """
+        fetched_pairs = {(tt.start_stop.id, tt.end_stop.id, tt.time_of_day) for tt in travel_times}
+        failed_pairs = {(first_stop.id, second_stop.id, time_of_day) for first_stop, second_stop, time_of_day, _
+                        in failures}
+        now = timezone.now()
+
+        with transaction.atomic():
+            TravelTime.objects.bulk_create(
+                travel_times,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['start_stop', 'end_stop', 'time_of_day'],
+                update_fields=['travel_time_seconds', 'distance_meters', 'fetched_at', 'source']
+            )
+
+            # The failures table is small, so the earlier failures of the pairs are matched in Python
+            start_stop_ids = {start_stop_id for start_stop_id, _, _ in fetched_pairs | failed_pairs}
+            earlier_failures = {tuple(pair): (failure_id, attempts) for failure_id, attempts, *pair in
+                                TravelTimeFailure.objects.filter(start_stop_id__in=start_stop_ids).values_list(
+                                    'id', 'attempts', 'start_stop_id', 'end_stop_id', 'time_of_day')}
+            TravelTimeFailure.objects.filter(id__in=[earlier_failures[pair][0] for pair in fetched_pairs
+                                                     if pair in earlier_failures]).delete()
+
+            # Upserted in bulk - concurrent runs failing the same pair do not conflict on the unique pair
+            TravelTimeFailure.objects.bulk_create(
+                [TravelTimeFailure(start_stop=first_stop, end_stop=second_stop, time_of_day=time_of_day, error=error,
+                                   attempts=earlier_failures.get((first_stop.id, second_stop.id, time_of_day),
+                                                                 (None, 0))[1] + 1,
+                                   last_attempt_at=now)
+                 for first_stop, second_stop, time_of_day, error in failures],
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=['start_stop', 'end_stop', 'time_of_day'],
+                update_fields=['error', 'attempts', 'last_attempt_at']
+            )
+
+        # Bulk created rows do not send signals, so the city matrices are marked stale here
+        for city_id in {tt.start_stop.city_id for tt in travel_times}:
+            TravelMatrixStore.invalidate(city_id)
+
+    def fetch_and_save(self, requests):
+        """ Fetch and save the travel info of the requests. Returns the number of fetched and failed pairs """
+        travel_times, failures = self.fetch(requests)
+        self.save(travel_times, failures)
+        return {"fetched_pairs": len(travel_times), "failed_pairs": len(failures)}
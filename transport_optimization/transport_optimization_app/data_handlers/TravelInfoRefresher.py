@@ -0,0 +1,65 @@
+import datetime
+from collections import defaultdict
+from django.db.models import F, Q
+from django.utils import timezone
+from .TravelInfoFetcher import TravelInfoFetcher
+from ..models import Stop, RouteStop, TravelTime
+
+
+class TravelInfoRefresher:
+    """ Incremental refresh of the TravelTime table - only the stale (fetched before the max age), invalidated (moved
+    stops) and never dated (fetched before the fetch time was recorded) pairs are fetched again. Pairs used by saved
+    routes go first, then the undated and the oldest """
+
+    @staticmethod
+    def get_route_pairs():
+        """ Get the (start stop id, end stop id) pairs of consecutive stops in the saved routes """
+        route_pairs = set()
+        previous_route_id, previous_stop_id = None, None
+        for route_id, stop_id in RouteStop.objects.order_by('route_id', 'order').values_list('route_id', 'stop_id'):
+            if route_id == previous_route_id:
+                route_pairs.add((previous_stop_id, stop_id))
+            previous_route_id, previous_stop_id = route_id, stop_id
+
+        return route_pairs
+
+    @classmethod
+    def get_stale_pairs(cls, max_age_days, city_id=None, limit=None):
+        """ Get the (start stop id, end stop id, time of day) pairs to refresh in priority order """
+        stale_rows = TravelTime.objects.filter(
+            Q(fetched_at__isnull=True) | Q(fetched_at__lt=timezone.now() - datetime.timedelta(days=max_age_days)))
+        if city_id is not None:
+            stale_rows = stale_rows.filter(start_stop__city_id=city_id)
+        columns = ('start_stop_id', 'end_stop_id', 'time_of_day')
+
+        # The saved routes are few, so their pairs are matched in Python
+        route_pairs = cls.get_route_pairs()
+        stale_order = F('fetched_at').asc(nulls_first=True)
+        pairs = [pair for pair in stale_rows.filter(start_stop_id__in={start for start, _ in route_pairs})
+                 .order_by(stale_order).values_list(*columns) if pair[:2] in route_pairs][:limit]
+
+        # Then the other pairs, undated first and then the oldest, streamed until the limit is reached
+        if limit is None or len(pairs) < limit:
+            for pair in stale_rows.order_by(stale_order).values_list(*columns).iterator():
+                if limit is not None and len(pairs) >= limit:
+                    break
+                if pair[:2] not in route_pairs:
+                    pairs.append(pair)
+
+        return pairs
+
+    @classmethod
+    def refresh(cls, fetcher, max_age_days, city_id=None, limit=None):
+        """ Fetch the stale pairs again with the fetcher. Returns the refresh counts """
+        pairs = cls.get_stale_pairs(max_age_days, city_id, limit)
+        stops = Stop.objects.in_bulk({start for start, _, _ in pairs} | {end for _, end, _ in pairs})
+
+        # One request per start stop and time of the day, with all its stale end stops
+        end_stops_map = defaultdict(list)
+        for start_stop_id, end_stop_id, time_of_day in pairs:
+            end_stops_map[(start_stop_id, time_of_day)].append(stops[end_stop_id])
+        requests = [([stops[start_stop_id]], end_stops, TravelInfoFetcher.get_departure_time(time_of_day))
+                    for (start_stop_id, time_of_day), end_stops in end_stops_map.items()]
+
+        result = fetcher.fetch_and_save(requests) if requests else {"fetched_pairs": 0, "failed_pairs": 0}
+        return {"stale_pairs": len(pairs), **result}
@@ -0,0 +1,67 @@
+import numpy as np
+
+
+class TravelMatrix:
+    """ Travel times and distances between the stops of a city for each time of the day """
+    MISSING_VALUE = -1
+
+    def __init__(self, stop_ids, times, travel_times, distances, avg_travel_times, avg_distances, estimated):
+        self.stop_ids = stop_ids
+        self.times = times
+        self.travel_times = travel_times
+        self.distances = distances
+        self.avg_travel_times = avg_travel_times
+        self.avg_distances = avg_distances
+        self.estimated = estimated
+        self.stop_index = {int(stop_id): idx for idx, stop_id in enumerate(stop_ids)}
+        self.__time_index = {time_of_day: idx for idx, time_of_day in enumerate(times)}
+
+    def get_indices(self, stops):
+        """ Get the matrix indices of the given stops """
+        return np.array([self.stop_index[stop.id] for stop in stops], dtype=np.intp)
+
+    def get_time_index(self, time_of_day):
+        """ Get the time slot index of the given time of the day """
+        return self.__time_index[time_of_day]
+
+    def get_avg_travel_time(self, stop1, stop2):
+        """ Get the travel time between two stops averaged over all times of the day """
+        return self.__get_value(self.avg_travel_times, stop1, stop2)
+
+    def get_avg_distance(self, stop1, stop2):
+        """ Get the distance between two stops averaged over all times of the day """
+        return self.__get_value(self.avg_distances, stop1, stop2)
+
+    def is_estimated(self, stop1, stop2):
+        """ Check if the travel info between two stops is estimated instead of fetched """
+        return bool(self.estimated[self.stop_index[stop1.id], self.stop_index[stop2.id]])
+
+    def get_travel_info(self, stop1, stop2, time_of_day):
+        """ Get the travel time and distance between two stops at a time of the day ((None, None) if missing) """
+        time_idx = self.__time_index.get(time_of_day)
+        idx1, idx2 = self.stop_index.get(stop1.id), self.stop_index.get(stop2.id)
+        if time_idx is None or idx1 is None or idx2 is None:
+            return None, None
+
+        travel_time = int(self.travel_times[time_idx, idx1, idx2])
+        distance = int(self.distances[time_idx, idx1, idx2])
+        if travel_time == self.MISSING_VALUE or distance == self.MISSING_VALUE:
+            return None, None
+
+        return travel_time, distance
+
+    def get_sub_matrices(self, stops):
+        """ Get the average travel time and distance matrices for the given stops (indexed by list position) """
+        indices = self.get_indices(stops)
+        sub_index = np.ix_(indices, indices)
+        time_matrix, distance_matrix = np.array(self.avg_travel_times[sub_index]), np.array(self.avg_distances[sub_index])
+        if (time_matrix == self.MISSING_VALUE).any() or (distance_matrix == self.MISSING_VALUE).any():
+            raise KeyError("Travel info is missing for some of the given stops.")
+
+        return time_matrix, distance_matrix
+
+    def __get_value(self, matrix, stop1, stop2):
+        value = int(matrix[self.stop_index[stop1.id], self.stop_index[stop2.id]])
+        if value == self.MISSING_VALUE:
+            raise KeyError(f"No travel info between {stop1} and {stop2}.")
+        return value
@@ -0,0 +1,117 @@
+import datetime
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+from .TravelMatrix import TravelMatrix
+from .TravelMatrixStore import TravelMatrixStore
+from ..models import Stop, Route, RouteStop, TravelTime
+
+
+class TravelMatrixExport:
+    """ Export the travel matrix of a city and saved solutions to a compressed .npz file and import it back
+    into the TravelTime table (e.g. a snapshot taken on another environment) """
+    IMPORT_BATCH_SIZE = 5000
+
+    @staticmethod
+    def export_city(city_id, file, route_ids=None):
+        """ Write the city matrix (per time slot) with its stop index and the given saved routes to the file.
+        Routes are stored as offsets into a flat array of stop indices """
+        matrix = TravelMatrixStore.open(city_id)
+        stops = Stop.objects.in_bulk([int(stop_id) for stop_id in matrix.stop_ids])
+        ordered_stops = [stops[int(stop_id)] for stop_id in matrix.stop_ids]
+
+        route_names, route_offsets, route_stop_indices = [], [0], []
+        if route_ids:
+            routes = {route.id: route for route in Route.objects.filter(id__in=route_ids)}
+            route_stops = {route_id: [] for route_id in routes}
+            for route_stop in RouteStop.objects.filter(route_id__in=routes).order_by('route_id', 'order'):
+                if route_stop.stop_id not in matrix.stop_index:
+                    raise ValueError(f"Route {route_stop.route_id} has stops outside the city.")
+                route_stops[route_stop.route_id].append(matrix.stop_index[route_stop.stop_id])
+            for route_id in route_ids:
+                if route_id in routes:
+                    route_names.append(routes[route_id].name)
+                    route_stop_indices += route_stops[route_id]
+                    route_offsets.append(len(route_stop_indices))
+
+        np.savez_compressed(
+            file,
+            stop_ids=np.asarray(matrix.stop_ids, dtype=np.int64),
+            stop_names=np.array([stop.name for stop in ordered_stops], dtype=str),
+            latitudes=np.array([stop.latitude for stop in ordered_stops], dtype=np.float64),
+            longitudes=np.array([stop.longitude for stop in ordered_stops], dtype=np.float64),
+            times=np.array([time_of_day.isoformat() for time_of_day in matrix.times], dtype=str),
+            travel_times=np.asarray(matrix.travel_times),
+            distances=np.asarray(matrix.distances),
+            estimated=np.asarray(matrix.estimated),
+            route_names=np.array(route_names, dtype=str),
+            route_offsets=np.array(route_offsets, dtype=np.int64),
+            route_stop_indices=np.array(route_stop_indices, dtype=np.int64)
+        )
+
+    @staticmethod
+    def __validate_shapes(stop_names, times, travel_times, distances, estimated):
+        """ Check that the arrays of the file agree with each other. Raises ValueError otherwise """
+        matrix_shape = (len(times), len(stop_names), len(stop_names))
+        if travel_times.shape != matrix_shape or distances.shape != matrix_shape:
+            raise ValueError("The travel times and distances do not match the stops and times of the file.")
+        if estimated.shape != matrix_shape[1:] or estimated.dtype != bool:
+            raise ValueError("The estimated pairs do not match the stops of the file.")
+        if not (np.issubdtype(travel_times.dtype, np.integer) and np.issubdtype(distances.dtype, np.integer)):
+            raise ValueError("The travel times and distances should be integers.")
+
+    @classmethod
+    def import_city(cls, file, city_id, include_estimated=False):
+        """ Load an exported matrix into the TravelTime table of the city. The exported stops are matched to the
+        city stops by name, since ids differ between environments. Estimated pairs are skipped by default,
+        they are estimated again from the local data """
+        with np.load(file, allow_pickle=False) as data:
+            stop_names = [str(name) for name in data["stop_names"]]
+            times = [datetime.time.fromisoformat(str(time_of_day)) for time_of_day in data["times"]]
+            travel_times, distances, estimated = data["travel_times"], data["distances"], data["estimated"]
+        cls.__validate_shapes(stop_names, times, travel_times, distances, estimated)
+
+        city_stops = {stop.name: stop for stop in Stop.objects.filter(city_id=city_id, name__in=stop_names)}
+        matched = np.array([idx for idx, name in enumerate(stop_names) if name in city_stops], dtype=np.intp)
+        matched_stops = [city_stops[stop_names[idx]] for idx in matched]
+
+        # Pairs of matched stops with travel info (and fetched, unless estimates are included)
+        valid = np.ones((len(matched), len(matched)), dtype=bool)
+        np.fill_diagonal(valid, False)
+        if not include_estimated:
+            valid &= ~estimated[np.ix_(matched, matched)]
+
+        imported_count = 0
+        imported_at = timezone.now()
+        with transaction.atomic():
+            for slot, time_of_day in enumerate(times):
+                slot_times = travel_times[slot][np.ix_(matched, matched)]
+                slot_distances = distances[slot][np.ix_(matched, matched)]
+                slot_valid = valid & (slot_times != TravelMatrix.MISSING_VALUE) \
+                    & (slot_distances != TravelMatrix.MISSING_VALUE)
+                start_idx, end_idx = np.nonzero(slot_valid)
+
+                # Only one batch of rows exists as model instances at a time
+                for i in range(0, len(start_idx), cls.IMPORT_BATCH_SIZE):
+                    batch = zip(start_idx[i:i + cls.IMPORT_BATCH_SIZE], end_idx[i:i + cls.IMPORT_BATCH_SIZE])
+                    TravelTime.objects.bulk_create(
+                        [TravelTime(start_stop=matched_stops[start], end_stop=matched_stops[end],
+                                    time_of_day=time_of_day,
+                                    travel_time_seconds=int(slot_times[start, end]),
+                                    distance_meters=int(slot_distances[start, end]),
+                                    fetched_at=imported_at, source=TravelTime.Source.IMPORT)
+                         for start, end in batch],
+                        update_conflicts=True,
+                        unique_fields=['start_stop', 'end_stop', 'time_of_day'],
+                        update_fields=['travel_time_seconds', 'distance_meters', 'fetched_at', 'source']
+                    )
+                imported_count += len(start_idx)
+
+        # Bulk created rows do not send signals
+        TravelMatrixStore.invalidate(city_id)
+
+        return {
+            "imported_rows": imported_count,
+            "matched_stops": len(matched_stops),
+            "unmatched_stops": sorted(name for name in stop_names if name not in city_stops)
+        }
@@ -0,0 +1,242 @@
+import os
+import sys
+import time
+import uuid
+import shutil
+import datetime
+import numpy as np
+from pathlib import Path
+from contextlib import contextmanager
+from django.conf import settings
+from .TravelMatrix import TravelMatrix
+from .TravelTimeEstimator import TravelTimeEstimator
+from .TravelTimeLoader import TravelTimeLoader
+from ..models import Stop, TravelTime
+
+try:
+    import fcntl
+except ImportError:  # File locking is not available on Windows
+    fcntl = None
+
+try:
+    import resource
+except ImportError:  # Resource usage is not available on Windows
+    resource = None
+
+
+class TravelMatrixStore:
+    """ Per-city travel matrices persisted as .npy files and opened with memory mapping """
+    TIMES = [datetime.time(8, 0), datetime.time(12, 0), datetime.time(18, 0)]
+    STALE_MARKER = "stale"
+    CURRENT_POINTER = "current"
+    LOCK_FILE = "lock"
+    # Touched on every invalidation of any city, tells the processes their all-stops matrix is outdated
+    CHANGED_MARKER = "changed"
+    ARRAY_NAMES = ("stop_ids", "travel_times", "distances", "avg_travel_times", "avg_distances", "estimated")
+
+    # Matrices opened by this process (city id -> (version, matrix)), reused until a new version is built
+    __opened = {}
+    # Matrix between the stops of all cities loaded by this process ((changed marker time, matrix) or None)
+    __all_stops = None
+
+    @staticmethod
+    def __get_city_dir(city_id):
+        return Path(settings.TRAVEL_MATRIX_DIR) / f"city_{city_id}"
+
+    @classmethod
+    @contextmanager
+    def __lock(cls, city_id):
+        """ Serialize the matrix builds of a city between processes """
+        city_dir = cls.__get_city_dir(city_id)
+        city_dir.mkdir(parents=True, exist_ok=True)
+        with open(city_dir / cls.LOCK_FILE, "w") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            yield
+
+    @classmethod
+    def invalidate(cls, city_id):
+        """ Mark the stored matrix of the city as stale, so it is regenerated on next use """
+        city_dir = cls.__get_city_dir(city_id)
+        city_dir.mkdir(parents=True, exist_ok=True)
+        (city_dir / cls.STALE_MARKER).touch()
+        (Path(settings.TRAVEL_MATRIX_DIR) / cls.CHANGED_MARKER).touch()
+
+    @classmethod
+    def is_stale(cls, city_id):
+        """ Check if the matrix of the city needs to be (re)generated """
+        city_dir = cls.__get_city_dir(city_id)
+        return (city_dir / cls.STALE_MARKER).exists() or not (city_dir / cls.CURRENT_POINTER).exists()
+
+    @classmethod
+    def open(cls, city_id):
+        """ Open the matrix of the city with memory mapping, regenerating it first if it is stale.
+        The opened matrix is reused by this process until a new version is built """
+        return cls.__open(city_id, mmap_mode='r')
+
+    @classmethod
+    def __open(cls, city_id, mmap_mode):
+        if cls.is_stale(city_id):
+            cls.build(city_id, only_if_stale=True)
+
+        version = cls.__get_current_version(city_id)
+        opened = cls.__opened.get(city_id)
+        if opened and opened[0] == version:
+            return opened[1]
+
+        try:
+            arrays = cls.__load_version(city_id, version, mmap_mode)
+        except FileNotFoundError:
+            # The version was replaced by another process between reading the pointer and opening the files
+            version = cls.__get_current_version(city_id)
+            arrays = cls.__load_version(city_id, version, mmap_mode)
+
+        matrix = TravelMatrix(times=list(cls.TIMES), **arrays)
+        cls.__opened[city_id] = (version, matrix)
+        return matrix
+
+    @classmethod
+    def __get_current_version(cls, city_id):
+        city_dir = cls.__get_city_dir(city_id)
+        return (city_dir / cls.CURRENT_POINTER).read_text()
+
+    @classmethod
+    def __load_version(cls, city_id, version, mmap_mode):
+        version_dir = cls.__get_city_dir(city_id) / version
+        return {name: np.load(version_dir / f"{name}.npy", mmap_mode=mmap_mode)
+                for name in cls.ARRAY_NAMES}
+
+    @staticmethod
+    def __get_max_rss_mb():
+        """ Peak resident memory of this process in MB (None where it is not available) """
+        if resource is None:
+            return None
+        max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Reported in bytes on macOS and in kilobytes elsewhere
+        return round(max_rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+    @classmethod
+    def preload(cls, city_ids):
+        """ Build the stale matrices of the given cities and load them in memory, so the first optimizations do
+        not pay for it. Called before the web server forks its workers, the arrays are shared with all of them
+        copy-on-write. Returns the preload time and memory """
+        start_time = time.perf_counter()
+        cities = {}
+        for city_id in city_ids:
+            matrix = cls.__open(city_id, mmap_mode=None)
+            cities[city_id] = {
+                "stops": len(matrix.stop_ids),
+                "matrix_mb": round(sum(getattr(matrix, name).nbytes for name in cls.ARRAY_NAMES) / (1024 * 1024), 2)
+            }
+
+        return {
+            "cities": cities,
+            "seconds": round(time.perf_counter() - start_time, 3),
+            "matrix_mb": round(sum(city["matrix_mb"] for city in cities.values()), 2),
+            "max_rss_mb": cls.__get_max_rss_mb()
+        }
+
+    @classmethod
+    def __get_changed_time(cls):
+        changed_marker = Path(settings.TRAVEL_MATRIX_DIR) / cls.CHANGED_MARKER
+        return changed_marker.stat().st_mtime_ns if changed_marker.exists() else None
+
+    @classmethod
+    def load_all(cls):
+        """ Get the travel info between all stops (of all cities), estimated where it was not fetched like in the
+        city matrices. Used when the work is not limited to a single city. The matrix is loaded once per process
+        and shared by all the callers until the travel info of any city changes """
+        # Read before loading, so changes made during the load are picked up by the next call
+        changed_time = cls.__get_changed_time()
+        if cls.__all_stops is None or cls.__all_stops[0] != changed_time:
+            cls.__all_stops = (changed_time, cls.__load_all())
+        return cls.__all_stops[1]
+
+    @classmethod
+    def __load_all(cls):
+        stops = list(Stop.objects.order_by('id').values_list('id', 'latitude', 'longitude'))
+        stop_ids = np.array([stop_id for stop_id, _, _ in stops], dtype=np.int64)
+        travel_times, distances = TravelTimeLoader.load(stop_ids, cls.TIMES, TravelMatrix.MISSING_VALUE)
+
+        diagonal = np.arange(len(stop_ids))
+        travel_times[:, diagonal, diagonal] = 0
+        distances[:, diagonal, diagonal] = 0
+
+        # Pairs without fetched travel info get estimates from their great-circle distance, as in the city matrices
+        estimated = TravelTimeEstimator.fill_missing([latitude for _, latitude, _ in stops],
+                                                     [longitude for _, _, longitude in stops],
+                                                     travel_times, distances, TravelMatrix.MISSING_VALUE)
+
+        arrays = {"stop_ids": stop_ids, "travel_times": travel_times, "distances": distances,
+                  "avg_travel_times": cls.__average_matrices(travel_times),
+                  "avg_distances": cls.__average_matrices(distances),
+                  "estimated": estimated}
+        # Shared by all the callers of the process, like the read-only memory maps of the city matrices
+        for array in arrays.values():
+            array.setflags(write=False)
+
+        return TravelMatrix(times=list(cls.TIMES), **arrays)
+
+    @classmethod
+    def build(cls, city_id, only_if_stale=False):
+        """ Regenerate the stored matrix of the city from the TravelTime table """
+        with cls.__lock(city_id):
+            # Another process may have regenerated the matrix while we were waiting for the lock
+            if only_if_stale and not cls.is_stale(city_id):
+                return
+            cls.__build(city_id)
+
+    @classmethod
+    def __build(cls, city_id):
+        city_dir = cls.__get_city_dir(city_id)
+
+        # Remove the stale marker before reading the DB, so changes made during the build mark it stale again
+        (city_dir / cls.STALE_MARKER).unlink(missing_ok=True)
+
+        stops, travel_times, distances = cls.__load_matrices(city_id)
+        stop_ids = np.array([stop_id for stop_id, _, _ in stops], dtype=np.int64)
+
+        # Pairs without fetched travel info get estimates from their great-circle distance
+        estimated = TravelTimeEstimator.fill_missing([latitude for _, latitude, _ in stops],
+                                                     [longitude for _, _, longitude in stops],
+                                                     travel_times, distances, TravelMatrix.MISSING_VALUE)
+        avg_travel_times, avg_distances = cls.__average_matrices(travel_times), cls.__average_matrices(distances)
+
+        # Write a new version and switch the pointer to it atomically, so readers never see partial files
+        version = uuid.uuid4().hex
+        version_dir = city_dir / version
+        version_dir.mkdir()
+        arrays = (stop_ids, travel_times, distances, avg_travel_times, avg_distances, estimated)
+        for name, array in zip(cls.ARRAY_NAMES, arrays):
+            np.save(version_dir / f"{name}.npy", array)
+
+        pointer_tmp = city_dir / f"{cls.CURRENT_POINTER}.{version}"
+        pointer_tmp.write_text(version)
+        os.replace(pointer_tmp, city_dir / cls.CURRENT_POINTER)
+
+        # Old versions can be removed - already opened memory maps stay valid until they are closed
+        for path in city_dir.iterdir():
+            if path.is_dir() and path.name != version:
+                shutil.rmtree(path, ignore_errors=True)
+
+    @classmethod
+    def __load_matrices(cls, city_id):
+        """ Fill (times x stops x stops) arrays with the fetched travel info between the stops of the city """
+        stops = list(Stop.objects.filter(city_id=city_id).order_by('id').values_list('id', 'latitude', 'longitude'))
+        travel_times, distances = TravelTimeLoader.load(
+            [stop_id for stop_id, _, _ in stops], cls.TIMES, TravelMatrix.MISSING_VALUE,
+            TravelTime.objects.filter(start_stop__city_id=city_id, end_stop__city_id=city_id))
+
+        # The travel info from a stop to itself is zero
+        diagonal = np.arange(len(stops))
+        travel_times[:, diagonal, diagonal] = 0
+        distances[:, diagonal, diagonal] = 0
+
+        return stops, travel_times, distances
+
+    @staticmethod
+    def __average_matrices(matrices):
+        """ Average over the times of the day (truncated like the per-pair lookups), missing if any time is """
+        average = matrices.sum(axis=0, dtype=np.int64) // len(matrices)
+        average[(matrices == TravelMatrix.MISSING_VALUE).any(axis=0)] = TravelMatrix.MISSING_VALUE
+        return average.astype(np.int32)
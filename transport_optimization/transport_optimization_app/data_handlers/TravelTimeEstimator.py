@@ -0,0 +1,58 @@
+import numpy as np
+
+
+class TravelTimeEstimator:
+    """ Estimate the travel info of far apart stops from their great-circle distance """
+    EARTH_RADIUS_METERS = 6371000
+
+    # Used when a city has no fetched travel info to calibrate from
+    DEFAULT_DETOUR_FACTOR = 1.3
+    DEFAULT_SPEED_METERS_PER_SECOND = 30 / 3.6
+
+    @classmethod
+    def haversine_distances(cls, latitudes, longitudes, to_latitudes=None, to_longitudes=None):
+        """ Get the (from x to) matrix of great-circle distances in meters between the given coordinates """
+        to_latitudes = latitudes if to_latitudes is None else to_latitudes
+        to_longitudes = longitudes if to_longitudes is None else to_longitudes
+
+        lat1 = np.radians(np.asarray(latitudes, dtype=np.float64))[:, None]
+        lon1 = np.radians(np.asarray(longitudes, dtype=np.float64))[:, None]
+        lat2 = np.radians(np.asarray(to_latitudes, dtype=np.float64))[None, :]
+        lon2 = np.radians(np.asarray(to_longitudes, dtype=np.float64))[None, :]
+
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        return 2 * cls.EARTH_RADIUS_METERS * np.arcsin(np.sqrt(np.clip(a, 0, 1)))
+
+    @classmethod
+    def calibrate(cls, haversine, travel_times, distances, missing_value):
+        """ Fit the city detour factor and the average speed for each time of the day from the fetched pairs """
+        fetched = (travel_times != missing_value) & (distances != missing_value) & (haversine > 0)[None, :, :]
+
+        detour_factor = cls.DEFAULT_DETOUR_FACTOR
+        if fetched.any():
+            detour_factor = float(np.median(distances[fetched] / np.broadcast_to(haversine, distances.shape)[fetched]))
+
+        speeds = []
+        for slot_fetched, slot_times, slot_distances in zip(fetched, travel_times, distances):
+            total_time = slot_times[slot_fetched].sum(dtype=np.int64)
+            total_distance = slot_distances[slot_fetched].sum(dtype=np.int64)
+            speeds.append(total_distance / total_time if total_time > 0 and total_distance > 0
+                          else cls.DEFAULT_SPEED_METERS_PER_SECOND)
+
+        return detour_factor, speeds
+
+    @classmethod
+    def fill_missing(cls, latitudes, longitudes, travel_times, distances, missing_value):
+        """ Fill the missing entries of the (times x stops x stops) matrices in place with calibrated estimates
+        and return the (stops x stops) mask of estimated pairs """
+        haversine = cls.haversine_distances(latitudes, longitudes)
+        detour_factor, speeds = cls.calibrate(haversine, travel_times, distances, missing_value)
+
+        missing = (travel_times == missing_value) | (distances == missing_value)
+        estimated_distances = np.rint(haversine * detour_factor)
+        for slot, speed in enumerate(speeds):
+            slot_missing = missing[slot]
+            distances[slot][slot_missing] = estimated_distances[slot_missing]
+            travel_times[slot][slot_missing] = np.rint(estimated_distances[slot_missing] / speed)
+
+        return missing.any(axis=0)
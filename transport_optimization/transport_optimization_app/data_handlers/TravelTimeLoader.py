@@ -0,0 +1,120 @@
+import io
+import datetime
+import numpy as np
+from django.db import connections
+from ..models import TravelTime
+
+
+class _CopyChunkWriter:
+    """ File-like target for COPY ... TO STDOUT that parses the received CSV rows in large chunks """
+
+    def __init__(self, handle_chunk, chunk_bytes):
+        self.__handle_chunk = handle_chunk
+        self.__chunk_bytes = chunk_bytes
+        self.__buffer = bytearray()
+
+    def write(self, data):
+        self.__buffer += data.encode() if isinstance(data, str) else data
+        if len(self.__buffer) >= self.__chunk_bytes:
+            # Parse only complete lines, the rest waits for the next write
+            end = self.__buffer.rfind(b"\n") + 1
+            self.__parse(self.__buffer[:end])
+            del self.__buffer[:end]
+
+    def close(self):
+        self.__parse(self.__buffer)
+        self.__buffer = bytearray()
+
+    def __parse(self, data):
+        if data.strip():
+            self.__handle_chunk(np.loadtxt(io.BytesIO(data), delimiter=",", dtype=np.int64, ndmin=2))
+
+
+class TravelTimeLoader:
+    """ Stream TravelTime rows straight into preallocated (times x stops x stops) arrays by stop index, so the peak
+    memory stays close to the size of the arrays. Postgres rows are read with COPY, other databases use
+    a chunked (server-side where supported) cursor """
+    CHUNK_SIZE = 100000
+    CHUNK_BYTES = 8 * 1024 * 1024
+    COLUMNS = ('start_stop_id', 'end_stop_id', 'time_of_day', 'travel_time_seconds', 'distance_meters')
+
+    @classmethod
+    def load(cls, stop_ids, times, missing_value, queryset=None):
+        """ Get the travel time and distance arrays between the given stops (indexed by position in stop_ids).
+        Pairs without a row have the missing value """
+        stop_ids = np.asarray(stop_ids, dtype=np.int64)
+        shape = (len(times), len(stop_ids), len(stop_ids))
+        travel_times = np.full(shape, missing_value, dtype=np.int32)
+        distances = np.full(shape, missing_value, dtype=np.int32)
+        if not len(stop_ids):
+            return travel_times, distances
+
+        # Lookup tables from stop id to stop index and from second of the day to time slot (-1 if not loaded)
+        stop_lookup = np.full(int(stop_ids.max()) + 1, -1, dtype=np.int64)
+        stop_lookup[stop_ids] = np.arange(len(stop_ids))
+        time_lookup = np.full(24 * 60 * 60, -1, dtype=np.int64)
+        for idx, time_of_day in enumerate(times):
+            time_lookup[cls.__get_seconds(time_of_day)] = idx
+
+        def handle_chunk(chunk):
+            cls.__scatter_chunk(chunk, stop_lookup, time_lookup, travel_times, distances)
+
+        queryset = TravelTime.objects.all() if queryset is None else queryset
+        rows = queryset.values_list(*cls.COLUMNS)
+        connection = connections[rows.db]
+        sql, params = rows.query.sql_with_params()
+        with connection.cursor() as cursor:
+            # COPY needs psycopg2 (copy_expert), otherwise the rows are fetched in chunks
+            use_copy = connection.vendor == 'postgresql' and hasattr(cursor.cursor, 'copy_expert')
+
+        if use_copy:
+            cls.__copy_rows(connection, sql, params, handle_chunk)
+        else:
+            cls.__fetch_rows(connection, sql, params, handle_chunk)
+
+        return travel_times, distances
+
+    @staticmethod
+    def __get_seconds(time_of_day):
+        if not isinstance(time_of_day, datetime.time):
+            time_of_day = datetime.time.fromisoformat(str(time_of_day))
+        return time_of_day.hour * 3600 + time_of_day.minute * 60 + time_of_day.second
+
+    @classmethod
+    def __copy_rows(cls, connection, sql, params, handle_chunk):
+        """ Stream the rows with COPY in CSV format, converting the time of the day to seconds in the query """
+        with connection.cursor() as cursor:
+            query = cursor.cursor.mogrify(sql, params).decode()
+            copy_sql = (f"COPY (SELECT travel_time.start_stop_id, travel_time.end_stop_id, "
+                        f"EXTRACT(EPOCH FROM travel_time.time_of_day)::integer, travel_time.travel_time_seconds, "
+                        f"travel_time.distance_meters FROM ({query}) travel_time) TO STDOUT WITH (FORMAT csv)")
+            writer = _CopyChunkWriter(handle_chunk, cls.CHUNK_BYTES)
+            cursor.cursor.copy_expert(copy_sql, writer)
+            writer.close()
+
+    @classmethod
+    def __fetch_rows(cls, connection, sql, params, handle_chunk):
+        """ Fetch the rows in chunks, only one chunk of rows exists as Python objects at a time """
+        with connection.chunked_cursor() as cursor:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(cls.CHUNK_SIZE)
+                if not rows:
+                    break
+                chunk = np.array([(start_stop_id, end_stop_id, cls.__get_seconds(time_of_day), travel_time, distance)
+                                  for start_stop_id, end_stop_id, time_of_day, travel_time, distance in rows],
+                                 dtype=np.int64)
+                handle_chunk(chunk)
+
+    @staticmethod
+    def __scatter_chunk(chunk, stop_lookup, time_lookup, travel_times, distances):
+        """ Write a (rows x 5) chunk of rows into the arrays, skipping stops and times that are not loaded """
+        start_ids, end_ids = chunk[:, 0], chunk[:, 1]
+        in_lookup = (start_ids < len(stop_lookup)) & (end_ids < len(stop_lookup))
+        chunk = chunk[in_lookup]
+
+        start_idx, end_idx, time_idx = stop_lookup[chunk[:, 0]], stop_lookup[chunk[:, 1]], time_lookup[chunk[:, 2]]
+        loaded = (start_idx >= 0) & (end_idx >= 0) & (time_idx >= 0)
+        index = (time_idx[loaded], start_idx[loaded], end_idx[loaded])
+        travel_times[index] = chunk[loaded, 3]
+        distances[index] = chunk[loaded, 4]
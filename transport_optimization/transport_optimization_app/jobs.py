@@ -0,0 +1,96 @@
+import os
+import re
+import sys
+import json
+import uuid
+import datetime
+import subprocess
+from pathlib import Path
+from django.conf import settings
+from rest_framework.utils.encoders import JSONEncoder
+
+# Long optimizations (batches, decompositions) run as background jobs - each in its own manage.py process, so the
+# process pools they fork never start from the multithreaded web server. The job input, process id and result
+# are files under OPTIMIZATION_JOB_DIR, so any web worker can report the status of any job
+JOB_ID_PATTERN = re.compile(r"^[0-9]{8}T[0-9]{6}-[0-9a-f]{12}$")
+JOB_KINDS = ("batch", "decomposition")
+MANAGE_PY = Path(__file__).resolve().parent.parent / "manage.py"
+
+
+def _get_job_path(job_id, suffix):
+    return Path(settings.OPTIMIZATION_JOB_DIR) / f"{job_id}.{suffix}"
+
+
+def _is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _is_running(job_id):
+    """ The job has no result yet and its process is alive """
+    pid_path = _get_job_path(job_id, "pid")
+    if _get_job_path(job_id, "result.json").exists() or not pid_path.exists():
+        return False
+    return _is_process_alive(int(pid_path.read_text()))
+
+
+def count_running_jobs():
+    job_dir = Path(settings.OPTIMIZATION_JOB_DIR)
+    if not job_dir.exists():
+        return 0
+    return sum(_is_running(path.name.split(".")[0]) for path in job_dir.glob("*.pid"))
+
+
+def start_job(kind, request_data):
+    """ Start a job processing the request data in a new process and get its id.
+    Returns None if OPTIMIZATION_JOBS_MAX_RUNNING jobs are already running """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind '{kind}'!")
+    if count_running_jobs() >= settings.OPTIMIZATION_JOBS_MAX_RUNNING:
+        return None
+
+    job_id = f"{datetime.datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:12]}"
+    Path(settings.OPTIMIZATION_JOB_DIR).mkdir(parents=True, exist_ok=True)
+    _get_job_path(job_id, "input.json").write_text(json.dumps({"kind": kind, "request_data": request_data},
+                                                               cls=JSONEncoder))
+
+    # A new session, so the job is not stopped together with the web worker that started it
+    with open(_get_job_path(job_id, "log"), "w") as log_file:
+        process = subprocess.Popen([sys.executable, str(MANAGE_PY), "run_optimization_job", job_id],
+                                   stdin=subprocess.DEVNULL, stdout=log_file, stderr=subprocess.STDOUT,
+                                   start_new_session=True)
+    _get_job_path(job_id, "pid").write_text(str(process.pid))
+
+    return job_id
+
+
+def read_job_input(job_id):
+    """ Get the kind and the request data of the job """
+    job_input = json.loads(_get_job_path(job_id, "input.json").read_text())
+    return job_input["kind"], job_input["request_data"]
+
+
+def write_job_result(job_id, result):
+    """ Save the result of the job atomically, so it is never read partially written """
+    result_path = _get_job_path(job_id, "result.json")
+    tmp_path = result_path.with_suffix(".tmp")
+    tmp_path.write_text(json.dumps(result, cls=JSONEncoder))
+    os.replace(tmp_path, result_path)
+
+
+def get_job(job_id):
+    """ Get the status of the job (running, done or failed) with its result. None for unknown (or invalid) ids """
+    if not JOB_ID_PATTERN.match(job_id or "") or not _get_job_path(job_id, "input.json").exists():
+        return None
+
+    result_path = _get_job_path(job_id, "result.json")
+    if result_path.exists():
+        return {"job_id": job_id, **json.loads(result_path.read_text())}
+    if _is_running(job_id):
+        return {"job_id": job_id, "status": "running"}
+    return {"job_id": job_id, "status": "failed", "error": "The job process exited without a result."}
@@ -0,0 +1,57 @@
+import os
+import sys
+import json
+import subprocess
+from django.core.management.base import BaseCommand, CommandError
+
+# Dependencies of the optimization, simulation and Google Maps stacks that should be loaded only on first use
+HEAVY_MODULES = ("numpy", "scipy", "networkx", "mesa", "googlemaps", "pandas", "matplotlib")
+
+# Run in a fresh interpreter - set up Django and import the URL configuration (and with it all the views)
+# the way a web worker does at startup
+IMPORT_SCRIPT = """
+import sys, json, time
+start_time = time.perf_counter()
+import django
+django.setup()
+from django.urls import get_resolver
+get_resolver().url_patterns
+print(json.dumps({{"seconds": time.perf_counter() - start_time,
+                   "loaded_heavy_modules": [m for m in {heavy_modules!r} if m in sys.modules]}}))
+"""
+
+
+class Command(BaseCommand):
+    help = ("Check that a fresh Django process starts within the import time budget "
+            "and without loading the heavy optimization dependencies")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--budget", type=float, default=1.5, help="Import time budget in seconds")
+        parser.add_argument("--repeat", type=int, default=3, help="Number of runs, the fastest one is checked")
+
+    @staticmethod
+    def __measure_startup():
+        """ Measure the startup of a new interpreter, with the same settings module and import path """
+        env = {**os.environ, "PYTHONPATH": os.pathsep.join(p for p in sys.path if p)}
+        completed = subprocess.run([sys.executable, "-c", IMPORT_SCRIPT.format(heavy_modules=HEAVY_MODULES)],
+                                   env=env, capture_output=True, text=True)
+        if completed.returncode != 0:
+            raise CommandError(f"The import check process failed:\n{completed.stderr}")
+
+        return json.loads(completed.stdout.strip().splitlines()[-1])
+
+    def handle(self, *args, **options):
+        measurements = [self.__measure_startup() for _ in range(max(1, options["repeat"]))]
+        fastest = min(measurements, key=lambda measurement: measurement["seconds"])
+        self.stdout.write(f"Startup import time: {fastest['seconds']:.3f}s (budget {options['budget']:.3f}s)")
+
+        errors = []
+        if fastest["seconds"] > options["budget"]:
+            errors.append(f"Import time {fastest['seconds']:.3f}s is over the {options['budget']:.3f}s budget.")
+        loaded_modules = set(module for measurement in measurements for module in measurement["loaded_heavy_modules"])
+        if loaded_modules:
+            errors.append(f"Heavy modules loaded at startup: {', '.join(sorted(loaded_modules))}.")
+
+        if errors:
+            raise CommandError(" ".join(errors))
+        self.stdout.write(self.style.SUCCESS("Import budget check passed."))
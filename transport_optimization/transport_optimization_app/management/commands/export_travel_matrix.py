@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from ...models import City
+from ...data_handlers.TravelMatrixExport import TravelMatrixExport
+
+
+class Command(BaseCommand):
+    help = "Export the travel matrix of a city (and saved routes) to a compressed .npz file"
+
+    def add_arguments(self, parser):
+        parser.add_argument("city_id", type=int)
+        parser.add_argument("output", help="Path of the .npz file")
+        parser.add_argument("--route-ids", type=int, nargs="*", default=None, help="Saved routes to include")
+
+    def handle(self, *args, **options):
+        if not City.objects.filter(id=options["city_id"]).exists():
+            raise CommandError("City does not exist.")
+
+        try:
+            with open(options["output"], "wb") as output_file:
+                TravelMatrixExport.export_city(options["city_id"], output_file, options["route_ids"])
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(f"Exported the travel matrix of city {options['city_id']} "
+                                             f"to {options['output']}."))
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from ...models import City
+from ...data_handlers.TravelMatrixExport import TravelMatrixExport
+
+
+class Command(BaseCommand):
+    help = "Import an exported .npz travel matrix into the TravelTime table of a city (stops are matched by name)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("input", help="Path of the exported .npz file")
+        parser.add_argument("city_id", type=int)
+        parser.add_argument("--include-estimated", action="store_true",
+                            help="Import also the pairs estimated on the exporting environment")
+
+    def handle(self, *args, **options):
+        if not City.objects.filter(id=options["city_id"]).exists():
+            raise CommandError("City does not exist.")
+
+        summary = TravelMatrixExport.import_city(options["input"], options["city_id"], options["include_estimated"])
+
+        self.stdout.write(self.style.SUCCESS(f"Imported {summary['imported_rows']} travel info rows for "
+                                             f"{summary['matched_stops']} stops."))
+        if summary["unmatched_stops"]:
+            self.stdout.write(self.style.WARNING(f"{len(summary['unmatched_stops'])} exported stops do not exist "
+                                                 f"in the city: {', '.join(summary['unmatched_stops'])}"))
@@ -0,0 +1,265 @@
+import json
+import time
+import uuid
+import random
+import threading
+import datetime
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from ...models import City, Stop, TravelTime
+from ...signals import invalidate_city_stops
+
+ENDPOINTS = ("optimize", "stop_list", "stop_create")
+SYNTHETIC_CITY_NAME = "Load Test City"
+SYNTHETIC_CITY_CENTER = (42.6977, 23.3219)
+SYNTHETIC_CITY_RADIUS_DEGREES = 0.05
+SYNTHETIC_FINAL_STOPS_SHARE = 0.2
+# Every optimize request needs final stops to start and end its routes
+MIN_FINAL_STOPS = 2
+
+
+def _percentile(sorted_values, percent):
+    """ Nearest-rank percentile of already sorted values """
+    if not sorted_values:
+        return None
+    rank = max(1, round(percent / 100 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class Command(BaseCommand):
+    help = ("Seed a synthetic city and replay a mix of optimize, stop list and stop create requests at a target rate "
+            "against the app (in-process or a local server), reporting throughput, latency percentiles and errors. "
+            "Run with GMAPS_STUB=True and TRAVEL_INFO_FETCH_ON_CREATE=False, so Google Maps calls are answered by the "
+            "offline stub and the created stops get no travel info. The synthetic city is deleted with all its data "
+            "after the test")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--url", default=None,
+                            help="Base URL of a running server (started with GMAPS_STUB=True and "
+                                 "TRAVEL_INFO_FETCH_ON_CREATE=False). Without it the requests are handled in-process")
+        parser.add_argument("--mix", default="optimize=1,stop_list=8,stop_create=1",
+                            help="Relative weights of the endpoints, e.g. optimize=1,stop_list=8,stop_create=1")
+        parser.add_argument("--rate", type=float, default=5.0, help="Target requests per second")
+        parser.add_argument("--duration", type=float, default=30.0, help="Duration of the test in seconds")
+        parser.add_argument("--concurrency", type=int, default=8, help="Maximum number of requests in flight")
+        parser.add_argument("--stops", type=int, default=40, help="Number of stops of the synthetic city")
+        parser.add_argument("--optimize-stops", type=int, default=12, help="Number of stops per optimize request")
+        parser.add_argument("--routes", type=int, default=3, help="Number of routes per optimize request")
+        parser.add_argument("--algorithm", default="simulated_annealing", help="Algorithm of the optimize requests")
+        parser.add_argument("--seed", type=int, default=None, help="Random seed of the seeded city and the requests")
+        parser.add_argument("--output", default=None, help="Write the report as JSON to this file")
+
+    @staticmethod
+    def __parse_mix(mix):
+        """ Parse the endpoint=weight pairs of the mix """
+        weights = {}
+        for part in mix.split(","):
+            endpoint, _, weight = part.partition("=")
+            endpoint = endpoint.strip()
+            if endpoint not in ENDPOINTS:
+                raise CommandError(f"Unknown endpoint '{endpoint}' in the mix, expected one of {', '.join(ENDPOINTS)}.")
+            try:
+                weights[endpoint] = float(weight)
+            except ValueError:
+                raise CommandError(f"Invalid weight for '{endpoint}' in the mix.")
+
+        if not any(weight > 0 for weight in weights.values()):
+            raise CommandError("At least one endpoint should have a positive weight.")
+        return weights
+
+    @staticmethod
+    def __seed_city(stops_count):
+        """ Create the synthetic city with random stops and the stub travel info between all of them """
+        from ...data_handlers.StubDistanceMatrixClient import StubDistanceMatrixClient
+        from ...data_handlers.TravelMatrixStore import TravelMatrixStore
+
+        city, _ = City.objects.get_or_create(name=SYNTHETIC_CITY_NAME, defaults={"country": "Synthetic"})
+        existing_count = Stop.objects.filter(city=city).count()
+        new_stops = []
+        for i in range(existing_count, stops_count):
+            new_stops.append(Stop(
+                name=f"{SYNTHETIC_CITY_NAME} stop {city.id}-{i}",
+                latitude=SYNTHETIC_CITY_CENTER[0] + random.uniform(-1, 1) * SYNTHETIC_CITY_RADIUS_DEGREES,
+                longitude=SYNTHETIC_CITY_CENTER[1] + random.uniform(-1, 1) * SYNTHETIC_CITY_RADIUS_DEGREES,
+                passenger_flow=random.randint(100, 5000),
+                is_final_stop=i < MIN_FINAL_STOPS or random.random() < SYNTHETIC_FINAL_STOPS_SHARE,
+                city=city
+            ))
+        Stop.objects.bulk_create(new_stops)
+
+        stops = list(Stop.objects.filter(city=city).order_by('id'))
+        if sum(stop.is_final_stop for stop in stops) < MIN_FINAL_STOPS:
+            raise CommandError(f"The synthetic city needs at least {MIN_FINAL_STOPS} final stops.")
+        coordinates = [(stop.latitude, stop.longitude) for stop in stops]
+        result = StubDistanceMatrixClient().distance_matrix(coordinates, coordinates)
+        travel_times = [
+            TravelTime(start_stop=first_stop, end_stop=second_stop, time_of_day=time_of_day,
+                       travel_time_seconds=elements["duration"]["value"],
+                       distance_meters=elements["distance"]["value"], source=TravelTime.Source.STUB)
+            for time_of_day in TravelMatrixStore.TIMES
+            for first_stop, row in zip(stops, result["rows"])
+            for second_stop, elements in zip(stops, row["elements"])
+            if first_stop.id != second_stop.id
+        ]
+        TravelTime.objects.bulk_create(travel_times, batch_size=1000, ignore_conflicts=True)
+
+        # Bulk created rows do not send signals
+        invalidate_city_stops(city.id)
+        return city, stops
+
+    def __create_request(self, endpoint, city, stops, options):
+        """ Build the method, path and JSON body of a request to the endpoint """
+        if endpoint == "optimize":
+            # At least the minimum of final stops, so no request is rejected by the validation
+            final_stops = [stop for stop in stops if stop.is_final_stop]
+            chosen_stops = random.sample(final_stops, MIN_FINAL_STOPS)
+            other_stops = [stop for stop in stops if stop not in chosen_stops]
+            chosen_stops += random.sample(other_stops, min(options["optimize_stops"], len(stops)) - MIN_FINAL_STOPS)
+            return "post", "/api/optimize/", {
+                "algorithm": options["algorithm"],
+                "city_id": city.id,
+                "stop_ids": [stop.id for stop in chosen_stops],
+                "number_of_routes": options["routes"],
+                "response_format": "compact"
+            }
+
+        if endpoint == "stop_list":
+            return "get", f"/api/stops/?city={city.id}&page={random.randint(1, max(1, len(stops) // 10))}", None
+
+        latitude, longitude = SYNTHETIC_CITY_CENTER
+        return "post", "/api/stops/", {
+            "name": f"{SYNTHETIC_CITY_NAME} stop {uuid.uuid4().hex[:12]}",
+            "latitude": latitude + random.uniform(-1, 1) * SYNTHETIC_CITY_RADIUS_DEGREES,
+            "longitude": longitude + random.uniform(-1, 1) * SYNTHETIC_CITY_RADIUS_DEGREES,
+            "passenger_flow": random.randint(100, 5000),
+            "is_final_stop": False,
+            "city": city.id
+        }
+
+    @staticmethod
+    def __create_sender(base_url):
+        """ Get a function sending a request and returning its status code, with a client per thread """
+        local = threading.local()
+
+        if base_url:
+            import requests
+
+            def send(method, path, body):
+                if not hasattr(local, "session"):
+                    local.session = requests.Session()
+                response = local.session.request(method, base_url.rstrip("/") + path, json=body)
+                return response.status_code
+        else:
+            def send(method, path, body):
+                if not hasattr(local, "client"):
+                    local.client = Client(SERVER_NAME="localhost", raise_request_exception=False)
+                if method == "get":
+                    response = local.client.get(path)
+                else:
+                    response = local.client.post(path, data=json.dumps(body), content_type="application/json")
+                return response.status_code
+
+        return send
+
+    @staticmethod
+    def __timed_request(send, endpoint, method, path, body):
+        start_time = time.perf_counter()
+        try:
+            status_code = send(method, path, body)
+            error = None if status_code < 400 else f"HTTP {status_code}"
+        except Exception as e:
+            error = type(e).__name__
+        return endpoint, time.perf_counter() - start_time, error
+
+    def __run(self, send, city, stops, weights, options):
+        """ Send requests at the target rate (open loop) and collect their latencies and errors """
+        endpoints, endpoint_weights = list(weights.keys()), list(weights.values())
+        requests_count = int(options["rate"] * options["duration"])
+        futures = []
+
+        start_time = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            for i in range(requests_count):
+                # Wait for the scheduled send time of the request
+                delay = start_time + i / options["rate"] - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+
+                endpoint = random.choices(endpoints, weights=endpoint_weights)[0]
+                method, path, body = self.__create_request(endpoint, city, stops, options)
+                futures.append(executor.submit(self.__timed_request, send, endpoint, method, path, body))
+
+            results = [future.result() for future in futures]
+
+        return results, time.perf_counter() - start_time
+
+    @staticmethod
+    def __create_report(results, elapsed_seconds, options):
+        """ Aggregate the throughput, latency percentiles and error rate of each endpoint """
+        latencies, errors = defaultdict(list), defaultdict(lambda: defaultdict(int))
+        for endpoint, latency, error in results:
+            latencies[endpoint].append(latency * 1000)
+            if error:
+                errors[endpoint][error] += 1
+
+        endpoints = {}
+        for endpoint, endpoint_latencies in latencies.items():
+            endpoint_latencies.sort()
+            errors_count = sum(errors[endpoint].values())
+            endpoints[endpoint] = {
+                "requests": len(endpoint_latencies),
+                "throughput_per_second": round(len(endpoint_latencies) / elapsed_seconds, 2),
+                "p50_ms": round(_percentile(endpoint_latencies, 50), 1),
+                "p95_ms": round(_percentile(endpoint_latencies, 95), 1),
+                "p99_ms": round(_percentile(endpoint_latencies, 99), 1),
+                "error_rate": round(errors_count / len(endpoint_latencies), 4),
+                "errors": dict(errors[endpoint])
+            }
+
+        return {
+            "started_at": datetime.datetime.now().isoformat(timespec="seconds"),
+            "target_rate": options["rate"],
+            "concurrency": options["concurrency"],
+            "elapsed_seconds": round(elapsed_seconds, 2),
+            "requests": len(results),
+            "throughput_per_second": round(len(results) / elapsed_seconds, 2) if elapsed_seconds else 0,
+            "endpoints": endpoints
+        }
+
+    def handle(self, *args, **options):
+        if options["rate"] <= 0 or options["duration"] <= 0:
+            raise CommandError("The rate and the duration should be positive.")
+        if options["stops"] < MIN_FINAL_STOPS or options["optimize_stops"] < MIN_FINAL_STOPS:
+            raise CommandError(f"The city and the optimize requests need at least {MIN_FINAL_STOPS} stops.")
+        # The in-process app should never call the real Google Maps API, and the stops created by the test should
+        # not fetch travel info (which would write rows and invalidate matrices outside the synthetic city)
+        if not options["url"] and (not settings.GMAPS_STUB or settings.TRAVEL_INFO_FETCH_ON_CREATE):
+            raise CommandError("Run the in-process load test with GMAPS_STUB=True and "
+                               "TRAVEL_INFO_FETCH_ON_CREATE=False in the environment.")
+        weights = self.__parse_mix(options["mix"])
+        if options["seed"] is not None:
+            random.seed(options["seed"])
+
+        try:
+            city, stops = self.__seed_city(options["stops"])
+            self.stdout.write(f"Seeded '{city.name}' with {len(stops)} stops.")
+
+            results, elapsed_seconds = self.__run(self.__create_sender(options["url"]), city, stops, weights, options)
+        finally:
+            # The stops and travel info of the synthetic city are deleted with it
+            City.objects.filter(name=SYNTHETIC_CITY_NAME).delete()
+
+        report = self.__create_report(results, elapsed_seconds, options)
+        self.stdout.write(f"{report['requests']} requests in {report['elapsed_seconds']}s "
+                          f"({report['throughput_per_second']}/s)")
+        for endpoint, stats in report["endpoints"].items():
+            self.stdout.write(f"{endpoint:<12} {stats['requests']:>6} req  {stats['throughput_per_second']:>7}/s  "
+                              f"p50 {stats['p50_ms']:>8}ms  p95 {stats['p95_ms']:>8}ms  p99 {stats['p99_ms']:>8}ms  "
+                              f"errors {stats['error_rate']:.2%}")
+
+        if options["output"]:
+            with open(options["output"], "w") as output_file:
+                json.dump(report, output_file, indent=2)
@@ -0,0 +1,155 @@
+import json
+import time
+import random
+import numpy as np
+from pathlib import Path
+from concurrent.futures import as_completed
+from django.core.management.base import BaseCommand, CommandError
+from ...models import Stop
+from ...process_pool import create_process_pool
+from ...algorithm_handlers.OptimizationHandler import OptimizationHandler
+from ...algorithm_handlers.SolutionsHandler import SolutionsHandler
+from ...data_handlers.TravelMatrixStore import TravelMatrixStore
+from ...simulation_handlers.SimulationHandler import SimulationHandler
+
+
+def _run_scenario(scenario, stops):
+    """ Run the optimization of a single scenario in a worker process """
+    start_time = time.perf_counter()
+    if scenario.get("seed") is not None:
+        random.seed(scenario["seed"])
+        np.random.seed(scenario["seed"])
+
+    stop_ids = set(scenario.get("stop_ids") or [])
+    chosen_stops = [stop for stop in stops if stop.id in stop_ids] if stop_ids else stops
+    city_id = scenario["city_id"]
+
+    _, final_solution, algorithm_parameters, iteration_info = OptimizationHandler.execute_optimization(
+        scenario.get("algorithm", "simulated_annealing"), chosen_stops, scenario["number_of_routes"], city_id,
+        scenario.get("parameters"))
+    score, total_time, total_distance = SolutionsHandler(city_id).evaluate_solution(final_solution)
+
+    result = {
+        "scenario_id": scenario["id"],
+        "status": "ok",
+        "final_score": int(score),
+        "total_time_minutes": round(total_time / 60, 2),
+        "total_distance_km": round(total_distance / 1000, 2),
+        "final_solution": [[stop.id for stop in route] for route in final_solution],
+        "algorithm_parameters": algorithm_parameters,
+        "iteration_info": iteration_info,
+    }
+
+    if scenario.get("simulate"):
+        final_solution_dict = {f"route_{i}": route for i, route in enumerate(final_solution)}
+        sim_handler = SimulationHandler(chosen_stops, city_id=city_id,
+                                        demand_model=scenario.get("demand_model", "uniform"))
+        result["final_solution_metrics"] = sim_handler.run_simulation(final_solution_dict)
+
+    result["duration_seconds"] = round(time.perf_counter() - start_time, 3)
+    return result
+
+
+class Command(BaseCommand):
+    help = "Run optimization scenarios from a JSON/JSONL file in a process pool and write the results to JSONL"
+
+    def add_arguments(self, parser):
+        parser.add_argument("scenarios", help="JSON list or JSONL file with one scenario per line")
+        parser.add_argument("output", help="JSONL file the results are appended to")
+        parser.add_argument("--workers", type=int, default=None, help="Number of worker processes")
+        parser.add_argument("--overwrite", action="store_true",
+                            help="Start from scratch instead of skipping the scenarios already in the output")
+
+    @staticmethod
+    def __read_scenarios(path):
+        """ Read the scenarios and give each one an id (its position if not set) """
+        content = Path(path).read_text()
+        if content.lstrip().startswith("["):
+            scenarios = json.loads(content)
+        else:
+            scenarios = [json.loads(line) for line in content.splitlines() if line.strip()]
+
+        for idx, scenario in enumerate(scenarios):
+            scenario.setdefault("id", str(idx))
+            for field in ("city_id", "number_of_routes"):
+                if field not in scenario:
+                    raise CommandError(f"Scenario {scenario['id']} is missing '{field}'.")
+            if scenario.get("algorithm", "simulated_annealing") not in OptimizationHandler.ALGORITHMS:
+                raise CommandError(f"Scenario {scenario['id']} has an unknown algorithm.")
+
+        return scenarios
+
+    @staticmethod
+    def __read_completed_ids(path):
+        """ Get the ids of the scenarios successfully completed in a previous run """
+        if not path.exists():
+            return set()
+
+        completed = set()
+        for line in path.read_text().splitlines():
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                # The last line may be incomplete if the previous run was interrupted
+                continue
+            if result.get("status") == "ok":
+                completed.add(result["scenario_id"])
+
+        return completed
+
+    @staticmethod
+    def __truncate_incomplete_line(path):
+        """ Cut the incomplete last line of an interrupted run, so the appended results start on a new line """
+        if not path.exists():
+            return
+
+        with open(path, "rb+") as output_file:
+            content = output_file.read()
+            if content and not content.endswith(b"\n"):
+                output_file.truncate(content.rfind(b"\n") + 1)
+
+    @staticmethod
+    def __check_stop_ids(scenarios, city_stops):
+        """ Make sure the stops of each scenario belong to its city """
+        for scenario in scenarios:
+            city_stop_ids = {stop.id for stop in city_stops[scenario["city_id"]]}
+            unknown_ids = sorted(set(scenario.get("stop_ids") or []) - city_stop_ids)
+            if unknown_ids:
+                raise CommandError(f"Scenario {scenario['id']} has stops not in city {scenario['city_id']}: "
+                                   f"{', '.join(map(str, unknown_ids))}.")
+
+    def handle(self, *args, **options):
+        scenarios = self.__read_scenarios(options["scenarios"])
+        output_path = Path(options["output"])
+
+        completed_ids = set() if options["overwrite"] else self.__read_completed_ids(output_path)
+        pending = [scenario for scenario in scenarios if scenario["id"] not in completed_ids]
+        self.stdout.write(f"{len(pending)} scenarios to run ({len(completed_ids)} already completed).")
+        if not pending:
+            return
+
+        # Load the stops and (re)generate the travel matrix of each city once, the workers only map it
+        city_stops = {}
+        for city_id in {scenario["city_id"] for scenario in pending}:
+            city_stops[city_id] = list(Stop.objects.filter(city_id=city_id).order_by('id'))
+            TravelMatrixStore.open(city_id)
+        self.__check_stop_ids(pending, city_stops)
+
+        if not options["overwrite"]:
+            self.__truncate_incomplete_line(output_path)
+
+        with open(output_path, "w" if options["overwrite"] else "a") as output_file, \
+                create_process_pool(options["workers"]) as executor:
+            futures = {executor.submit(_run_scenario, scenario, city_stops[scenario["city_id"]]): scenario
+                       for scenario in pending}
+
+            for future in as_completed(futures):
+                scenario = futures[future]
+                try:
+                    result = future.result()
+                except Exception as e:
+                    result = {"scenario_id": scenario["id"], "status": "error", "error": str(e)}
+
+                output_file.write(json.dumps(result) + "\n")
+                output_file.flush()
+                self.stdout.write(f"Scenario {scenario['id']}: {result['status']}")
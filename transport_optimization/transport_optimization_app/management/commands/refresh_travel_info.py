@@ -0,0 +1,36 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from ...models import TravelTime
+from ...algorithm_handlers.StopHandler import StopHandler
+from ...data_handlers.TravelInfoRefresher import TravelInfoRefresher
+
+
+class Command(BaseCommand):
+    help = ("Fetch again the stale and invalidated travel info pairs, pairs of saved routes first. "
+            "Meant to be scheduled (e.g. daily with cron) with a limit matching the API budget")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--max-age-days", type=float, default=settings.TRAVEL_INFO_MAX_AGE_DAYS,
+                            help="Pairs fetched longer ago are stale")
+        parser.add_argument("--limit", type=int, default=None, help="Maximum number of pairs to fetch")
+        parser.add_argument("--city-id", type=int, default=None, help="Refresh only the pairs of this city")
+        parser.add_argument("--dry-run", action="store_true", help="Only count the pairs that would be fetched")
+
+    def handle(self, *args, **options):
+        if options["max_age_days"] < 0 or (options["limit"] is not None and options["limit"] <= 0):
+            raise CommandError("The max age should not be negative and the limit should be positive.")
+
+        rows = TravelTime.objects.all()
+        if options["city_id"] is not None:
+            rows = rows.filter(start_stop__city_id=options["city_id"])
+        total_pairs = rows.count()
+
+        if options["dry_run"]:
+            pairs = TravelInfoRefresher.get_stale_pairs(options["max_age_days"], options["city_id"], options["limit"])
+            self.stdout.write(f"{len(pairs)} of {total_pairs} pairs would be fetched.")
+            return
+
+        result = TravelInfoRefresher.refresh(StopHandler.create_travel_info_fetcher(), options["max_age_days"],
+                                             options["city_id"], options["limit"])
+        self.stdout.write(self.style.SUCCESS(f"Refreshed {result['fetched_pairs']} of {total_pairs} pairs, "
+                                             f"{result['failed_pairs']} pairs failed."))
@@ -0,0 +1,46 @@
+from collections import defaultdict
+from django.core.management.base import BaseCommand
+from ...models import Stop, TravelTimeFailure
+from ...algorithm_handlers.StopHandler import StopHandler
+from ...data_handlers.TravelInfoFetcher import TravelInfoFetcher
+
+
+class Command(BaseCommand):
+    help = ("Fetch the travel info of the stops whose fetch never completed (e.g. the process was restarted during "
+            "a bulk import) and of the pairs whose earlier fetches failed")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--city-id", type=int, default=None, help="Retry only the pairs of this city")
+        parser.add_argument("--max-attempts", type=int, default=None,
+                            help="Skip the pairs that already failed this many times")
+
+    def handle(self, *args, **options):
+        pending_stops = Stop.objects.filter(travel_info_pending=True)
+        if options["city_id"] is not None:
+            pending_stops = pending_stops.filter(city_id=options["city_id"])
+        pending_stops = list(pending_stops)
+        if pending_stops:
+            result = StopHandler.extract_travel_info_bulk(pending_stops)
+            self.stdout.write(f"Fetched {result['fetched_pairs']} pairs of {len(pending_stops)} pending stops.")
+
+        failures = TravelTimeFailure.objects.select_related('start_stop', 'end_stop')
+        if options["city_id"] is not None:
+            failures = failures.filter(start_stop__city_id=options["city_id"])
+        if options["max_attempts"] is not None:
+            failures = failures.filter(attempts__lt=options["max_attempts"])
+
+        # One request per start stop and time of the day, with all its failed end stops
+        end_stops_map = defaultdict(list)
+        for failure in failures:
+            end_stops_map[(failure.start_stop, failure.time_of_day)].append(failure.end_stop)
+
+        if not end_stops_map:
+            self.stdout.write("No failed pairs to retry.")
+            return
+
+        requests = [([start_stop], end_stops, TravelInfoFetcher.get_departure_time(time_of_day))
+                    for (start_stop, time_of_day), end_stops in end_stops_map.items()]
+        result = StopHandler.create_travel_info_fetcher().fetch_and_save(requests)
+
+        self.stdout.write(self.style.SUCCESS(f"Fetched {result['fetched_pairs']} pairs, "
+                                             f"{result['failed_pairs']} pairs failed again."))
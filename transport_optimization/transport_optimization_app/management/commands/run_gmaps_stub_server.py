@@ -0,0 +1,73 @@
+import json
+import random
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from django.core.management.base import BaseCommand, CommandError
+from ...data_handlers.StubDistanceMatrixClient import StubDistanceMatrixClient
+
+DISTANCE_MATRIX_PATH = "/maps/api/distancematrix/json"
+
+
+def _parse_locations(value):
+    """ Parse the lat,lng|lat,lng locations of a Distance Matrix request """
+    return [tuple(float(coordinate) for coordinate in location.split(",")) for location in value.split("|")]
+
+
+class Command(BaseCommand):
+    help = ("Serve the Distance Matrix API locally with the offline stub, simulating latency and transient errors. "
+            "Point the app to it with GMAPS_BASE_URL=http://<host>:<port> (GMAPS_API needs an 'AIza' prefixed "
+            "dummy key) to exercise the travel info fetcher over HTTP")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument("--latency", type=float, default=0.05, help="Delay of each response in seconds")
+        parser.add_argument("--error-rate", type=float, default=0.0,
+                            help="Share of requests answered with an OVER_QUERY_LIMIT/UNKNOWN_ERROR status")
+        parser.add_argument("--server-error-rate", type=float, default=0.0,
+                            help="Share of requests answered with HTTP 503")
+
+    def handle(self, *args, **options):
+        if not (0 <= options["error_rate"] <= 1 and 0 <= options["server_error_rate"] <= 1):
+            raise CommandError("The error rates should be between 0 and 1.")
+
+        client = StubDistanceMatrixClient(options["latency"], options["error_rate"])
+        server_error_rate = options["server_error_rate"]
+        stdout = self.stdout
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != DISTANCE_MATRIX_PATH:
+                    return self.__respond(404, {"status": "NOT_FOUND"})
+                if random.random() < server_error_rate:
+                    return self.__respond(503, {"status": "UNKNOWN_ERROR"})
+
+                query = parse_qs(url.query)
+                try:
+                    origins = _parse_locations(query["origins"][0])
+                    destinations = _parse_locations(query["destinations"][0])
+                except (KeyError, ValueError):
+                    return self.__respond(200, {"status": "INVALID_REQUEST"})
+
+                self.__respond(200, client.distance_matrix(origins, destinations))
+
+            def __respond(self, status_code, body):
+                content = json.dumps(body).encode()
+                self.send_response(status_code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def log_message(self, format, *args):
+                stdout.write(f"{self.address_string()} - {format % args}")
+
+        server = ThreadingHTTPServer((options["host"], options["port"]), Handler)
+        self.stdout.write(f"Distance Matrix stub listening on http://{options['host']}:{options['port']}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
@@ -0,0 +1,51 @@
+import sys
+import signal
+from django.core.management.base import BaseCommand, CommandError
+from ...jobs import read_job_input, write_job_result
+from ...views import BatchOptimizationView, UnifiedOptimizationInputView
+from ...algorithm_handlers.CancellationToken import CancellationToken
+
+
+class Command(BaseCommand):
+    help = "Run a background optimization job started by the API and save its result (used by the job runner)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("job_id")
+
+    def handle(self, *args, **options):
+        job_id = options["job_id"]
+        try:
+            kind, request_data = read_job_input(job_id)
+        except (OSError, ValueError, KeyError):
+            raise CommandError(f"Job {job_id} does not exist.")
+
+        # Stopping the job (SIGTERM) still records it as failed. A decomposition is cancelled, so it stops its
+        # cluster workers before exiting
+        cancellation_token = CancellationToken()
+
+        def stop(signum, frame):
+            if kind == "decomposition":
+                cancellation_token.cancel()
+            else:
+                sys.exit(1)
+
+        signal.signal(signal.SIGTERM, stop)
+
+        try:
+            data, status_code = self.__run(kind, request_data, cancellation_token)
+        except BaseException as e:
+            write_job_result(job_id, {"status": "failed", "error": str(e) or type(e).__name__})
+            raise
+
+        write_job_result(job_id, {"status": "done" if status_code < 400 else "failed", "status_code": status_code,
+                                  "result": data})
+        self.stdout.write(f"Job {job_id} ({kind}) finished with status {status_code}.")
+
+    @staticmethod
+    def __run(kind, request_data, cancellation_token):
+        """ Process the request data of the job and get the response data and status """
+        if kind == "batch":
+            return BatchOptimizationView.run_batch(request_data)
+        if kind == "decomposition":
+            return UnifiedOptimizationInputView.optimize(request_data, cancellation_token, allow_decomposition=True)
+        raise CommandError(f"Unknown job kind '{kind}'.")
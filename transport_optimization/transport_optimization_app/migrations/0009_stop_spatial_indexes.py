@@ -0,0 +1,21 @@
+# Generated by Django 5.1.7 on 2026-10-19 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport_optimization_app', '0008_remove_route_frequency'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='stop',
+            index=models.Index(fields=['city', 'latitude', 'longitude'], name='stop_city_lat_lon_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='stop',
+            index=models.Index(fields=['latitude', 'longitude'], name='stop_lat_lon_idx'),
+        ),
+    ]
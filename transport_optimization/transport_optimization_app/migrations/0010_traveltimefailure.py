@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-19 14:05
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport_optimization_app', '0009_stop_spatial_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TravelTimeFailure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('time_of_day', models.TimeField(help_text='Time of day of the failed request')),
+                ('error', models.CharField(help_text='Last error of the request', max_length=200)),
+                ('attempts', models.PositiveIntegerField(default=1, help_text='Number of failed fetches')),
+                ('last_attempt_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('end_stop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='transport_optimization_app.stop')),
+                ('start_stop', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='transport_optimization_app.stop')),
+            ],
+            options={
+                'unique_together': {('start_stop', 'end_stop', 'time_of_day')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 5.1.7 on 2026-10-19 15:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport_optimization_app', '0010_traveltimefailure'),
+    ]
+
+    operations = [
+        # The existing rows are left empty - when they were fetched is unknown, so they are refreshed first
+        migrations.AddField(
+            model_name='traveltime',
+            name='fetched_at',
+            field=models.DateTimeField(blank=True, db_index=True, help_text='When the travel info was fetched (empty if unknown or invalidated)', null=True),
+        ),
+        migrations.AlterField(
+            model_name='traveltime',
+            name='fetched_at',
+            field=models.DateTimeField(blank=True, db_index=True, default=django.utils.timezone.now, help_text='When the travel info was fetched (empty if unknown or invalidated)', null=True),
+        ),
+        migrations.AddField(
+            model_name='traveltime',
+            name='source',
+            field=models.CharField(choices=[('api', 'Google Maps API'), ('stub', 'Offline stub'), ('import', 'Imported matrix')], default='api', max_length=10),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.7 on 2026-10-19 17:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transport_optimization_app', '0011_traveltime_fetched_at_source'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='stop',
+            name='travel_info_pending',
+            field=models.BooleanField(default=False, help_text='The travel info of the stop is still to be fetched'),
+        ),
+    ]
@@ -1,4 +1,5 @@
 from django.db import models
+from django.utils import timezone
 
 
 class City(models.Model):
@@ -19,6 +20,14 @@ class Stop(models.Model):
     passenger_flow = models.IntegerField(help_text="Average number of passengers per day")
     is_final_stop = models.BooleanField()
     city = models.ForeignKey(City, on_delete=models.CASCADE, related_name="stops")
+    travel_info_pending = models.BooleanField(default=False,
+                                              help_text="The travel info of the stop is still to be fetched")
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['city', 'latitude', 'longitude'], name='stop_city_lat_lon_idx'),
+            models.Index(fields=['latitude', 'longitude'], name='stop_lat_lon_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -45,14 +54,38 @@ class RouteStop(models.Model):
 
 
 class TravelTime(models.Model):
+    class Source(models.TextChoices):
+        API = 'api', 'Google Maps API'
+        STUB = 'stub', 'Offline stub'
+        IMPORT = 'import', 'Imported matrix'
+
     start_stop = models.ForeignKey(Stop, related_name='start_stop', on_delete=models.CASCADE)
     end_stop = models.ForeignKey(Stop, related_name='end_stop', on_delete=models.CASCADE)
     travel_time_seconds = models.IntegerField(help_text="Time to travel between start and end stop in seconds")
     distance_meters = models.IntegerField(help_text="Distance between start and end stop in meters")
     time_of_day = models.TimeField(help_text="Time of day for this travel time")
+    fetched_at = models.DateTimeField(null=True, blank=True, default=timezone.now, db_index=True,
+                                      help_text="When the travel info was fetched (empty if unknown or invalidated)")
+    source = models.CharField(max_length=10, choices=Source.choices, default=Source.API)
 
     class Meta:
         unique_together = ('start_stop', 'end_stop', 'time_of_day')
 
     def __str__(self):
         return f"{self.start_stop} to {self.end_stop} at {self.time_of_day} - {self.travel_time_seconds}s"
+
+
+class TravelTimeFailure(models.Model):
+    """ Pair whose travel info could not be fetched, kept to be retried later """
+    start_stop = models.ForeignKey(Stop, related_name='+', on_delete=models.CASCADE)
+    end_stop = models.ForeignKey(Stop, related_name='+', on_delete=models.CASCADE)
+    time_of_day = models.TimeField(help_text="Time of day of the failed request")
+    error = models.CharField(max_length=200, help_text="Last error of the request")
+    attempts = models.PositiveIntegerField(default=1, help_text="Number of failed fetches")
+    last_attempt_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = ('start_stop', 'end_stop', 'time_of_day')
+
+    def __str__(self):
+        return f"{self.start_stop} to {self.end_stop} at {self.time_of_day} - {self.error} ({self.attempts})"
@@ -0,0 +1,8 @@
+from rest_framework.pagination import CursorPagination
+
+
+class StopCursorPagination(CursorPagination):
+    """ Keyset pagination for the stop listing - the cost of a page does not grow with its position """
+    ordering = 'id'
+    page_size_query_param = 'page_size'
+    max_page_size = 1000
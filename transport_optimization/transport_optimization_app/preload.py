@@ -0,0 +1,23 @@
+import logging
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+
+def preload_travel_matrices(city_ids=None):
+    """ Load the travel matrices of the configured cities (PRELOAD_TRAVEL_MATRIX_CITIES) ahead of the first request.
+    Called from the WSGI/ASGI entry points - the database is not available yet in AppConfig.ready() """
+    city_ids = settings.PRELOAD_TRAVEL_MATRIX_CITIES if city_ids is None else city_ids
+    if not city_ids:
+        return None
+
+    from .data_handlers.TravelMatrixStore import TravelMatrixStore
+
+    report = TravelMatrixStore.preload(city_ids)
+    # The forked workers must not share the DB connections of this process
+    connections.close_all()
+
+    logger.info("Preloaded travel matrices of %d cities in %.3fs (%.2f MB of matrices, peak RSS %s MB)",
+                len(report["cities"]), report["seconds"], report["matrix_mb"], report["max_rss_mb"])
+    return report
@@ -0,0 +1,29 @@
+import multiprocessing
+import django
+from concurrent.futures import ProcessPoolExecutor
+from django.db import connections
+
+
+def _setup_worker(initializer, initargs):
+    """ Make sure Django is set up in the worker before running the given initializer """
+    django.setup()
+    if initializer:
+        initializer(*initargs)
+
+
+def get_mp_context():
+    """ Get the multiprocessing context of the process pools (fork where possible). Synchronization primitives
+    shared with the workers (passed in initargs) are created with it """
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def create_process_pool(max_workers=None, initializer=None, initargs=()):
+    """ Create a process pool for CPU-bound work. Workers are forked where possible, so they share the memory
+    (loaded stops, travel data) of this process copy-on-write instead of receiving pickled copies """
+    # Forked workers must not share the DB connections of this process
+    connections.close_all()
+
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=get_mp_context(), initializer=_setup_worker,
+                               initargs=(initializer, initargs))
@@ -0,0 +1,45 @@
+import re
+import uuid
+import cProfile
+import datetime
+from pathlib import Path
+from django.conf import settings
+from rest_framework.throttling import UserRateThrottle
+
+PROFILE_ID_PATTERN = re.compile(r"^[0-9]{8}T[0-9]{6}-[0-9a-f]{12}$")
+
+
+class ProfileRateThrottle(UserRateThrottle):
+    """ Limit how often a user can run profiled requests (PROFILE_RATE_LIMIT, e.g. 5/hour) """
+    scope = 'profile'
+
+    def get_rate(self):
+        return settings.PROFILE_RATE_LIMIT
+
+
+def is_profiling_requested(request):
+    """ Profiling is requested with the X-Profile: 1 header or the ?profile=1 query parameter """
+    value = request.headers.get('X-Profile') or request.query_params.get('profile')
+    return str(value).lower() in ('1', 'true')
+
+
+def get_profile_path(profile_id):
+    """ Get the path of a saved profile (None for invalid ids, so no other files can be accessed) """
+    if not PROFILE_ID_PATTERN.match(profile_id or ""):
+        return None
+    return Path(settings.PROFILE_DIR) / f"{profile_id}.pstats"
+
+
+def run_profiled(function, *args, **kwargs):
+    """ Run the function under the deterministic profiler and save the stats as a .pstats file
+    (readable with pstats, snakeviz or converted to a flamegraph). Returns the result and the profile id """
+    profile_id = f"{datetime.datetime.now():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:12]}"
+    profiler = cProfile.Profile()
+    try:
+        result = profiler.runcall(function, *args, **kwargs)
+    finally:
+        profile_path = get_profile_path(profile_id)
+        profile_path.parent.mkdir(parents=True, exist_ok=True)
+        profiler.dump_stats(profile_path)
+
+    return result, profile_id
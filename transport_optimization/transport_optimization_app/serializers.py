@@ -1,5 +1,7 @@
+from collections import Counter
 from rest_framework import serializers
-from .models import City, Stop
+from .models import City, Stop, Route
+from .data_handlers.StopImportHandler import StopImportHandler
 
 
 class CitySerializer(serializers.ModelSerializer):
@@ -16,6 +18,58 @@ class StopSerializer(serializers.ModelSerializer):
         fields = ['id', 'name', 'latitude', 'longitude', 'passenger_flow', 'city', 'city_name', 'is_final_stop']
 
 
+class StopQuerySerializer(serializers.Serializer):
+    """ Filter query parameters of the stops list """
+    city = serializers.IntegerField(required=False)
+    near = serializers.CharField(required=False)
+    radius = serializers.FloatField(required=False, min_value=0)
+
+    def validate(self, attrs):
+        if 'near' in attrs and 'radius' not in attrs:
+            raise serializers.ValidationError({"radius": "A radius in meters is required with near."})
+        return attrs
+
+
+class StopImportRowSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Stop
+        fields = ['name', 'latitude', 'longitude', 'passenger_flow', 'is_final_stop']
+        # Name uniqueness is checked for all rows with a single query in BulkStopImportSerializer
+        extra_kwargs = {'name': {'validators': []}}
+
+
+class BulkStopImportSerializer(serializers.Serializer):
+    city = serializers.PrimaryKeyRelatedField(queryset=City.objects.all())
+    file = serializers.FileField()
+
+    def validate(self, attrs):
+        try:
+            rows = StopImportHandler.parse_file(attrs['file'])
+        except (ValueError, UnicodeDecodeError) as e:
+            raise serializers.ValidationError({"file": str(e)})
+
+        if not rows:
+            raise serializers.ValidationError({"file": "The file does not contain any stops."})
+
+        row_serializer = StopImportRowSerializer(data=rows, many=True)
+        if not row_serializer.is_valid():
+            errors = {f"row_{i}": row_errors for i, row_errors in enumerate(row_serializer.errors) if row_errors}
+            raise serializers.ValidationError({"stops": errors})
+
+        # Validate for duplicate names in the file and in the DB
+        names = [row['name'] for row in row_serializer.validated_data]
+        duplicate_names = {name for name, count in Counter(names).items() if count > 1}
+        duplicate_names.update(Stop.objects.filter(name__in=names).values_list('name', flat=True))
+        if duplicate_names:
+            raise serializers.ValidationError(
+                {"stops": f"Stops with these names already exist: {', '.join(sorted(duplicate_names))}."})
+
+        # The travel info is fetched after the import, the flag is cleared once it is done
+        attrs['stops'] = [Stop(city=attrs['city'], travel_info_pending=True, **row)
+                          for row in row_serializer.validated_data]
+        return attrs
+
+
 class InitialRouteSerializer(serializers.ListField):
     child = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
 
@@ -37,6 +91,8 @@ class InitialRouteSerializer(serializers.ListField):
 
 
 class OptimizationInputSerializer(serializers.Serializer):
+    SURROGATE_ALGORITHMS = ("simulated_annealing", "aco")
+
     city_id = serializers.IntegerField()
     stop_ids = serializers.ListField(
         child=serializers.IntegerField(),
@@ -45,6 +101,79 @@ class OptimizationInputSerializer(serializers.Serializer):
     )
     number_of_routes = serializers.IntegerField(min_value=1)
     initial_solution = InitialRouteSerializer(required=False)
+    pheromone_strategy = serializers.ChoiceField(choices=["all", "elitist", "max_min"], required=False)
+    response_format = serializers.ChoiceField(choices=["full", "compact"], default="full")
+    initial_route_ids = serializers.ListField(child=serializers.IntegerField(), required=False, allow_empty=False)
+    save_solution = serializers.BooleanField(default=False)
+    demand_model = serializers.ChoiceField(choices=["uniform", "gravity"], default="uniform")
+    surrogate_weight = serializers.FloatField(min_value=0, required=False)
+    route_name_prefix = serializers.CharField(required=False, max_length=80)
+    decomposition = serializers.BooleanField(default=False)
+    cluster_size = serializers.IntegerField(min_value=20, default=150)
+
+    def validate_city_id(self, value):
+        if not City.objects.filter(id=value).exists():
+            raise serializers.ValidationError("City does not exist.")
+        return value
+
+    def validate_stop_ids(self, value):
+        if len(set(value)) != len(value):
+            raise serializers.ValidationError("Duplicate stops are not allowed.")
+        return value
+
+    def validate_initial_route_ids(self, value):
+        if Route.objects.filter(id__in=value).count() != len(set(value)):
+            raise serializers.ValidationError("Some of the routes do not exist.")
+        return value
+
+    def validate(self, attrs):
+        # The travel info is read from the city matrix, so all stops need to belong to the city
+        if Stop.objects.filter(id__in=attrs['stop_ids'], city_id=attrs['city_id']).count() != len(attrs['stop_ids']):
+            raise serializers.ValidationError({"stop_ids": "All stops should belong to the selected city."})
+        if attrs.get('initial_solution') and attrs.get('initial_route_ids'):
+            raise serializers.ValidationError("Use either initial_solution or initial_route_ids, not both.")
+        # The algorithm is validated by the view (unknown algorithms get their own error)
+        algorithm = self.initial_data.get('algorithm', 'simulated_annealing')
+        if attrs.get('surrogate_weight') is not None and algorithm not in self.SURROGATE_ALGORITHMS:
+            raise serializers.ValidationError(
+                {"surrogate_weight": "The surrogate objective is only supported by simulated_annealing and aco."})
+        if attrs['decomposition'] and (attrs.get('initial_solution') or attrs.get('initial_route_ids')):
+            raise serializers.ValidationError(
+                {"decomposition": "Decomposition does not start from an initial solution."})
+        if attrs.get('route_name_prefix') and Route.objects.filter(
+                name__startswith=f"{attrs['route_name_prefix']} - ").exists():
+            raise serializers.ValidationError({"route_name_prefix": "Routes with this prefix already exist."})
+        return attrs
+
+
+class ScenarioVariantSerializer(serializers.Serializer):
+    name = serializers.CharField(required=False, max_length=100)
+    algorithm = serializers.ChoiceField(choices=["simulated_annealing", "aco", "genetic"],
+                                        default="simulated_annealing")
+    number_of_routes = serializers.IntegerField(min_value=1)
+    pheromone_strategy = serializers.ChoiceField(choices=["all", "elitist", "max_min"], required=False)
+    surrogate_weight = serializers.FloatField(min_value=0, required=False)
+    seed = serializers.IntegerField(required=False)
+
+    def validate(self, attrs):
+        if attrs.get('surrogate_weight') is not None and \
+                attrs['algorithm'] not in OptimizationInputSerializer.SURROGATE_ALGORITHMS:
+            raise serializers.ValidationError(
+                {"surrogate_weight": "The surrogate objective is only supported by simulated_annealing and aco."})
+        return attrs
+
+
+class BatchOptimizationInputSerializer(serializers.Serializer):
+    MAX_VARIANTS = 24
+
+    city_id = serializers.IntegerField()
+    stop_ids = serializers.ListField(
+        child=serializers.IntegerField(),
+        allow_empty=False,
+        min_length=2
+    )
+    demand_model = serializers.ChoiceField(choices=["uniform", "gravity"], default="uniform")
+    variants = ScenarioVariantSerializer(many=True, allow_empty=False, max_length=MAX_VARIANTS)
 
     def validate_city_id(self, value):
         if not City.objects.filter(id=value).exists():
@@ -55,3 +184,17 @@ class OptimizationInputSerializer(serializers.Serializer):
         if len(set(value)) != len(value):
             raise serializers.ValidationError("Duplicate stops are not allowed.")
         return value
+
+    def validate_variants(self, value):
+        # Unnamed variants are named after their position
+        for idx, variant in enumerate(value):
+            variant.setdefault('name', f"variant_{idx + 1}")
+        if len({variant['name'] for variant in value}) != len(value):
+            raise serializers.ValidationError("Variant names should be unique.")
+        return value
+
+    def validate(self, attrs):
+        # The travel info is read from the city matrix, so all stops need to belong to the city
+        if Stop.objects.filter(id__in=attrs['stop_ids'], city_id=attrs['city_id']).count() != len(attrs['stop_ids']):
+            raise serializers.ValidationError({"stop_ids": "All stops should belong to the selected city."})
+        return attrs
@@ -0,0 +1,54 @@
+import sys
+from django.db.models import Q
+from django.db.models.signals import pre_save, post_save, post_delete
+from django.dispatch import receiver
+from .models import Stop, TravelTime
+
+# The data handlers depend on numpy and scipy, so they are imported on the first invalidation
+# instead of in every process that loads the app (migrations, admin, CRUD only workers)
+SPATIAL_INDEX_MODULE = __package__ + ".data_handlers.SpatialIndex"
+
+
+@receiver(pre_save, sender=Stop)
+def detect_stop_move(sender, instance, **kwargs):
+    """ Remember whether the saved stop changes its coordinates """
+    previous = Stop.objects.filter(id=instance.id).values_list('latitude', 'longitude').first() \
+        if instance.id is not None else None
+    instance._moved = previous is not None and previous != (instance.latitude, instance.longitude)
+
+
+@receiver(post_save, sender=Stop)
+def invalidate_travel_times_on_stop_move(sender, instance, **kwargs):
+    """ The fetched travel info of a moved stop (its matrix row and column) is outdated. The values are kept as
+    an approximation until the pairs are fetched again by the refresh_travel_info command """
+    if getattr(instance, '_moved', False):
+        TravelTime.objects.filter(Q(start_stop=instance) | Q(end_stop=instance)).update(fetched_at=None)
+
+
+def invalidate_city_stops(city_id):
+    """ Mark the travel matrix of the city stale and drop its cached spatial index. Called by the signals and
+    after bulk changes of the stops, which send no signals """
+    from .data_handlers.TravelMatrixStore import TravelMatrixStore
+
+    TravelMatrixStore.invalidate(city_id)
+
+    # The spatial indexes are cached in-process, so there is nothing to invalidate if they were never loaded
+    spatial_index_module = sys.modules.get(SPATIAL_INDEX_MODULE)
+    if spatial_index_module is not None:
+        spatial_index_module.SpatialIndex.invalidate(city_id)
+
+
+@receiver([post_save, post_delete], sender=Stop)
+def invalidate_city_matrix_on_stop_change(sender, instance, **kwargs):
+    """ Adding, moving or removing a stop changes the rows and columns of the city travel matrix """
+    invalidate_city_stops(instance.city_id)
+
+
+@receiver([post_save, post_delete], sender=TravelTime)
+def invalidate_city_matrix_on_travel_time_change(sender, instance, **kwargs):
+    """ Mark the travel matrix of the start stop city as stale """
+    from .data_handlers.TravelMatrixStore import TravelMatrixStore
+
+    city_id = Stop.objects.filter(id=instance.start_stop_id).values_list('city_id', flat=True).first()
+    if city_id is not None:
+        TravelMatrixStore.invalidate(city_id)
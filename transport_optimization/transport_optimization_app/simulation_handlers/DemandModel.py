@@ -0,0 +1,40 @@
+import numpy as np
+from ..data_handlers.TravelTimeEstimator import TravelTimeEstimator
+
+
+class DemandModel:
+    """Gravity model of the daily trips between stops based on their passenger flow"""
+
+    def __init__(self, chosen_stops, distance_decay=1.0, min_distance_meters=200):
+        self.__stops = list(chosen_stops)
+        flows = np.array([stop.passenger_flow for stop in self.__stops], dtype=np.float64)
+        if flows.sum() <= 0:
+            flows = np.ones(len(self.__stops))
+
+        # Trips between two stops grow with their passenger flows and decay with the distance between them
+        distances = TravelTimeEstimator.haversine_distances([stop.latitude for stop in self.__stops],
+                                                            [stop.longitude for stop in self.__stops])
+        demand = np.outer(flows, flows) / np.maximum(distances, min_distance_meters) ** distance_decay
+        np.fill_diagonal(demand, 0)
+
+        # Every trip is counted in the passenger flow of both its start and end stop
+        self.total_trips = flows.sum() / 2
+        self.__demand = demand * (self.total_trips / demand.sum())
+
+    def get_od_pairs(self, max_pairs):
+        """Get at most max_pairs distinct (start stop, end stop, daily trips) tuples representing the demand.
+        If there are more pairs, they are sampled proportionally to their demand and weighted by the number
+        of draws, so the weighted results are unbiased estimates for the whole demand"""
+        flat_demand = self.__demand.ravel()
+        positive = np.flatnonzero(flat_demand)
+
+        if len(positive) <= max_pairs:
+            weights = flat_demand[positive]
+        else:
+            draws = np.random.choice(positive, size=max_pairs, p=flat_demand[positive] / flat_demand[positive].sum())
+            positive, counts = np.unique(draws, return_counts=True)
+            weights = counts * (self.total_trips / max_pairs)
+
+        stops_count = len(self.__stops)
+        return [(self.__stops[idx // stops_count], self.__stops[idx % stops_count], float(weight))
+                for idx, weight in zip(positive, weights)]
@@ -0,0 +1,76 @@
+from collections import defaultdict
+
+
+class IncrementalSimulation:
+    """Simulation that keeps the graph and the passenger results between solutions and, when some routes
+    change, re-routes only the passengers whose best route could be affected by the change"""
+
+    def __init__(self, model, passengers_info, metrics_calculator):
+        self.__model = model
+        self.__metrics_calculator = metrics_calculator
+
+        # Passengers with the same start stop, end stop and time of the day share one result
+        self.__trip_weights = defaultdict(float)
+        for passenger in passengers_info:
+            self.__trip_weights[(passenger['start_stop'], passenger['end_stop'], passenger['time'])] += \
+                passenger.get('weight', 1)
+
+        self.__results = {trip: self.__route_trip(trip) for trip in self.__trip_weights}
+
+    def __route_trip(self, trip):
+        """Find the best route of a trip and keep the graph path details needed to check if it is affected"""
+        start_stop, end_stop, time_of_the_day = trip
+        transfers, travel_time, distance, path = self.__model.find_best_route_with_path(start_stop, end_stop,
+                                                                                        time_of_the_day)
+        path_cost = self.__model.get_path_cost(path, time_of_the_day) if path else None
+        path_edges = {frozenset(edge) for edge in zip(path, path[1:])} if path else set()
+        return (transfers, travel_time, distance), path_cost, path_edges
+
+    def __can_be_shortened(self, trip, path_cost, new_edges, path_costs_cache):
+        """Check if going over one of the new edges is shorter than the current path of the trip"""
+        start_stop, end_stop, time_of_the_day = trip
+        for stop1, stop2 in new_edges:
+            weight = self.__model.get_edge_weight(stop1, stop2, time_of_the_day)
+            if weight is None:
+                continue
+
+            for stop in (stop1, stop2):
+                if (stop, time_of_the_day) not in path_costs_cache:
+                    path_costs_cache[(stop, time_of_the_day)] = self.__model.get_path_costs_from(stop,
+                                                                                                 time_of_the_day)
+            costs1, costs2 = path_costs_cache[(stop1, time_of_the_day)], path_costs_cache[(stop2, time_of_the_day)]
+
+            inf = float('inf')
+            if min(costs1.get(start_stop, inf) + weight + costs2.get(end_stop, inf),
+                   costs2.get(start_stop, inf) + weight + costs1.get(end_stop, inf)) < path_cost:
+                return True
+
+        return False
+
+    def update(self, changed_routes):
+        """Apply route changes (route name -> new stops, [] to remove a route) and get the updated metrics"""
+        routes_solution = self.__model.routes_solution
+        changed_route_stops, changed_edges = [], set()
+        for route, stops in changed_routes.items():
+            for version in (routes_solution.get(route, []), stops):
+                changed_route_stops.append(set(version))
+                changed_edges.update(frozenset(edge) for edge in zip(version, version[1:]))
+
+        new_edges = self.__model.update_routes(changed_routes)
+
+        path_costs_cache = {}
+        for trip, (_, path_cost, path_edges) in list(self.__results.items()):
+            start_stop, end_stop, _ = trip
+            # Direct route options changed, the path uses a changed route or a new edge may shorten the path
+            if any(start_stop in stops and end_stop in stops for stops in changed_route_stops) \
+                    or path_edges & changed_edges \
+                    or (path_cost is not None and new_edges
+                        and self.__can_be_shortened(trip, path_cost, new_edges, path_costs_cache)):
+                self.__results[trip] = self.__route_trip(trip)
+
+        return self.get_metrics()
+
+    def get_metrics(self):
+        """Get the metrics of the current solution"""
+        return self.__metrics_calculator(
+            (*result, self.__trip_weights[trip]) for trip, (result, _, _) in self.__results.items())
@@ -4,11 +4,13 @@ from mesa import Agent
 class PassengerAgent(Agent):
     """Passenger agent who chooses a route to test"""
 
-    def __init__(self, unique_id, model, start_stop, end_stop, time_of_the_day):
+    def __init__(self, unique_id, model, start_stop, end_stop, time_of_the_day, weight=1):
         super().__init__(unique_id, model)
         self.start_stop = start_stop
         self.end_stop = end_stop
         self.time_of_the_day = time_of_the_day
+        # Number of passengers represented by this agent
+        self.weight = weight
         self.travel_distance = 0
         self.travel_time = 0
         self.transfer_count = 0
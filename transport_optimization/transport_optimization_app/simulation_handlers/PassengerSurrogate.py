@@ -0,0 +1,65 @@
+import random
+import numpy as np
+from .DemandModel import DemandModel
+
+
+class PassengerSurrogate:
+    """Fast estimate of the passenger simulation score (average distance in km + time in minutes + transfers)
+    for a fixed sample of start and end stop pairs. Routes are evaluated independently and cached, so
+    evaluating a neighbor solution only computes the routes that changed"""
+
+    # Trips without a direct route are assumed to need one transfer and a detour over the direct travel
+    TRANSFER_DETOUR_FACTOR = 1.5
+    MAX_CACHED_ROUTES = 5000
+
+    def __init__(self, chosen_stops, stop_handler, od_pairs_count=300, demand_model="uniform"):
+        self.__stop_index = {stop: idx for idx, stop in enumerate(chosen_stops)}
+        self.__time_matrix, self.__distance_matrix = stop_handler.get_travel_matrices(chosen_stops)
+
+        if demand_model == "gravity":
+            od_pairs = DemandModel(chosen_stops).get_od_pairs(od_pairs_count)
+        else:
+            od_pairs = [(*random.sample(chosen_stops, 2), 1) for _ in range(od_pairs_count)]
+
+        self.__start_idx = np.array([self.__stop_index[start] for start, _, _ in od_pairs], dtype=np.intp)
+        self.__end_idx = np.array([self.__stop_index[end] for _, end, _ in od_pairs], dtype=np.intp)
+        self.__weights = np.array([weight for _, _, weight in od_pairs], dtype=np.float64)
+        self.__weights /= self.__weights.sum()
+
+        # Cost of the trips without a direct route
+        self.__transfer_costs = (self.TRANSFER_DETOUR_FACTOR
+                                 * (self.__distance_matrix[self.__start_idx, self.__end_idx] / 1000
+                                    + self.__time_matrix[self.__start_idx, self.__end_idx] / 60) + 1)
+        self.__route_costs_cache = {}
+
+    def __get_route_costs(self, route):
+        """Get the cost of each sampled trip on the route (inf if the route does not include both stops)"""
+        key = tuple(self.__stop_index[stop] for stop in route)
+        costs = self.__route_costs_cache.get(key)
+        if costs is not None:
+            return costs
+
+        route_idx = np.array(key, dtype=np.intp)
+        positions = np.full(len(self.__stop_index), -1, dtype=np.intp)
+        positions[route_idx] = np.arange(len(route_idx))
+
+        # Cumulative time and distance from the first stop of the route
+        cumulative_costs = np.zeros(len(route_idx))
+        cumulative_costs[1:] = np.cumsum(self.__distance_matrix[route_idx[:-1], route_idx[1:]] / 1000
+                                         + self.__time_matrix[route_idx[:-1], route_idx[1:]] / 60)
+
+        start_positions, end_positions = positions[self.__start_idx], positions[self.__end_idx]
+        on_route = (start_positions >= 0) & (end_positions >= 0)
+        costs = np.full(len(self.__start_idx), np.inf)
+        costs[on_route] = np.abs(cumulative_costs[end_positions[on_route]] - cumulative_costs[start_positions[on_route]])
+
+        if len(self.__route_costs_cache) >= self.MAX_CACHED_ROUTES:
+            self.__route_costs_cache.clear()
+        self.__route_costs_cache[key] = costs
+        return costs
+
+    def evaluate(self, solution):
+        """Estimate the average passenger score of the solution (lower is better)"""
+        direct_costs = np.min([self.__get_route_costs(route) for route in solution], axis=0)
+        trip_costs = np.where(np.isinf(direct_costs), self.__transfer_costs, direct_costs)
+        return float(np.dot(self.__weights, trip_costs))
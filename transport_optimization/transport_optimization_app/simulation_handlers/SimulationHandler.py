@@ -1,14 +1,58 @@
+import os
 import random
 import datetime
 from .TransportModel import TransportModel
 from .PassengerAgent import PassengerAgent
+from .IncrementalSimulation import IncrementalSimulation
+from .DemandModel import DemandModel
+from ..data_handlers.TravelMatrixStore import TravelMatrixStore
+from ..process_pool import create_process_pool
+
+# Simulation handler shared by all simulations in a worker process
+_worker_sim_handler = None
+
+
+def _init_simulation_worker(sim_handler):
+    global _worker_sim_handler
+    _worker_sim_handler = sim_handler
+
+
+def _run_worker_simulation(routes_solution):
+    return _worker_sim_handler.run_simulation(routes_solution)
 
 
 class SimulationHandler:
-    def __init__(self, chosen_stops, num_passengers=1000, steps=10):
+    DEMAND_MODELS = ("uniform", "gravity")
+
+    def __init__(self, chosen_stops, num_passengers=1000, steps=10, city_id=None, demand_model="uniform"):
         self.__num_passengers = num_passengers
+        self.__city_id = city_id
         self.__steps = steps
-        self.__passengers_info = self.__create_passengers_info(chosen_stops)
+        self.__represented_trips = None
+        if demand_model == "gravity":
+            self.__passengers_info = self.__create_demand_passengers_info(chosen_stops)
+        else:
+            self.__passengers_info = self.__create_passengers_info(chosen_stops)
+
+        # Load the travel data once for all simulations
+        self.__travel_matrix = TravelMatrixStore.open(city_id) if city_id is not None else TravelMatrixStore.load_all()
+
+    def __create_demand_passengers_info(self, chosen_stops):
+        """Create one weighted passenger per distinct start and end stop pair of the gravity demand model
+        (num_passengers is the maximum number of pairs) and time of the day"""
+        demand_model = DemandModel(chosen_stops)
+        self.__represented_trips = demand_model.total_trips
+
+        passengers_info = []
+        times = [datetime.time(8, 0), datetime.time(12, 0), datetime.time(18, 0)]
+        for start_stop, end_stop, daily_trips in demand_model.get_od_pairs(self.__num_passengers):
+            # The daily trips are split equally between the times of the day
+            for time_of_day in times:
+                info = {"index": len(passengers_info), "start_stop": start_stop, "end_stop": end_stop,
+                        "time": time_of_day, "weight": daily_trips / len(times)}
+                passengers_info.append(info)
+
+        return passengers_info
 
     def __create_passengers_info(self, chosen_stops):
         """Create passengers info by choosing random start and end stops"""
@@ -23,32 +67,81 @@ class SimulationHandler:
 
         return passengers_info
 
+    def run_simulations(self, routes_solutions, max_workers=1, incremental=False):
+        """Simulate many solutions with the same passengers and travel data, so their metrics can be compared
+        fairly. The metrics are returned in the solutions order. By default the solutions are simulated one after
+        another - max_workers > 1 forks a process pool, which is only safe outside the multithreaded web server
+        (management commands, background jobs).
+        With incremental=True the solutions are simulated one after another in a single graph, re-routing
+        only the passengers affected by the routes that differ from the previous solution"""
+        if incremental:
+            return self.__run_incremental_simulations(routes_solutions)
+
+        if len(routes_solutions) <= 1 or max_workers == 1:
+            return [self.run_simulation(routes_solution) for routes_solution in routes_solutions]
+
+        max_workers = min(len(routes_solutions), max_workers or os.cpu_count() or 1)
+        with create_process_pool(max_workers, initializer=_init_simulation_worker, initargs=(self,)) as executor:
+            return list(executor.map(_run_worker_simulation, routes_solutions))
+
+    def __run_incremental_simulations(self, routes_solutions):
+        """Simulate solutions that differ in a few routes by updating a single incremental simulation"""
+        results = []
+        simulation, previous_solution = None, None
+        for routes_solution in routes_solutions:
+            if simulation is None:
+                simulation = self.create_incremental_simulation(routes_solution)
+                results.append(simulation.get_metrics())
+            else:
+                # Routes are matched by name, a missing route is simulated as removed
+                changed_routes = {route: stops for route, stops in routes_solution.items()
+                                  if previous_solution.get(route) != stops}
+                changed_routes.update({route: [] for route in previous_solution if route not in routes_solution})
+                results.append(simulation.update(changed_routes))
+            previous_solution = routes_solution
+
+        return results
+
+    def create_incremental_simulation(self, routes_solution):
+        """Create a simulation of the given solution that can be updated when only some of its routes change"""
+        model = TransportModel(self.__num_passengers, routes_solution, [], self.__city_id,
+                               self.__travel_matrix)
+        return IncrementalSimulation(model, self.__passengers_info, self.calculate_metrics)
+
     def run_simulation(self, routes_solution):
         """Start the simulation with a given number of passengers"""
-        model = TransportModel(self.__num_passengers, routes_solution, self.__passengers_info)
+        model = TransportModel(self.__num_passengers, routes_solution, self.__passengers_info, self.__city_id,
+                               self.__travel_matrix)
 
         # Execute the simulation with different passengers
         for _ in range(self.__steps):
             model.step()
 
         # Collect the results from all the passengers
+        return self.calculate_metrics((agent.transfer_count, agent.travel_time, agent.travel_distance, agent.weight)
+                                      for agent in model.schedule.agents if isinstance(agent, PassengerAgent))
+
+    def calculate_metrics(self, trip_results):
+        """Calculate the solution metrics from (transfers, travel time, distance, weight) trip results,
+        weighted by the number of passengers each trip represents"""
         travel_distances = []
         travel_times = []
         transfers = []
+        weights = []
 
-        for agent in model.schedule.agents:
-            if isinstance(agent, PassengerAgent):
-                travel_distances.append(agent.travel_distance)
-                travel_times.append(agent.travel_time)
-                transfers.append(agent.transfer_count)
+        for transfer_count, travel_time, travel_distance, weight in trip_results:
+            travel_distances.append(travel_distance * weight)
+            travel_times.append(travel_time * weight)
+            transfers.append((transfer_count, weight))
+            weights.append(weight)
 
         # Calculate the score of the solution based on the average values for travel time, distance,
         # transfers count and direct trips percentage
-        agents_count = len(model.schedule.agents)
-        avg_travel_distance = (sum(travel_distances) / agents_count) / 1000
-        avg_travel_time = (sum(travel_times) / agents_count) / 60
-        avg_transfers = sum(transfers) / agents_count
-        direct_trips_percentage = (sum(1 for t in transfers if t == 0) / agents_count) * 100
+        total_weight = sum(weights)
+        avg_travel_distance = (sum(travel_distances) / total_weight) / 1000
+        avg_travel_time = (sum(travel_times) / total_weight) / 60
+        avg_transfers = sum(t * w for t, w in transfers) / total_weight
+        direct_trips_percentage = (sum(w for t, w in transfers if t == 0) / total_weight) * 100
 
         # Lower score means better solution
         score = avg_travel_distance + avg_travel_time + avg_transfers
@@ -61,4 +154,7 @@ class SimulationHandler:
             'direct_trips_percentage': round(direct_trips_percentage, 2)
         }
 
+        if self.__represented_trips is not None:
+            result['represented_daily_trips'] = round(self.__represented_trips)
+
         return result
@@ -1,43 +1,44 @@
 from mesa import Model
 from mesa.time import RandomActivation
 from .PassengerAgent import PassengerAgent
-from ..models import TravelTime
+from ..data_handlers.TravelMatrixStore import TravelMatrixStore
 import datetime
 import networkx as nx
+from collections import Counter
 
 
 class TransportModel(Model):
     """Transport network simulation model"""
 
-    def __init__(self, num_passengers, routes_solution, passengers_info):
+    def __init__(self, num_passengers, routes_solution, passengers_info, city_id=None, travel_matrix=None):
         self.__num_passengers = num_passengers
-        self.__routes_solution = routes_solution
+        self.__routes_solution = dict(routes_solution)
 
         self.schedule = RandomActivation(self)
         self.__times = [datetime.time(8, 0), datetime.time(12, 0), datetime.time(18, 0)]
-        self.__travel_time_dict = None
+        # An already loaded travel matrix can be passed in to share it between many simulations
+        self.__travel_matrix = travel_matrix
         self.__graph = nx.Graph()
         self.__time_to_graph_attr_map = {}
+        # Number of routes using each (undirected) edge of the graph
+        self.__edge_routes_count = Counter()
 
         self.__add_passengers_to_schedule(passengers_info)
-        self.__create_travel_time_dict()
+        if self.__travel_matrix is None:
+            self.__travel_matrix = TravelMatrixStore.open(city_id) if city_id is not None \
+                else TravelMatrixStore.load_all()
         self.__fill_routes_to_graph()
 
     def __add_passengers_to_schedule(self, passengers_info):
         """Create passengers by choosing random start and end stops"""
         for passenger in passengers_info:
             passenger = PassengerAgent(passenger['index'], self, passenger['start_stop'],
-                                       passenger['end_stop'], passenger['time'])
+                                       passenger['end_stop'], passenger['time'], passenger.get('weight', 1))
             self.schedule.add(passenger)
 
-    def __create_travel_time_dict(self):
-        """Preload DB data into a dictionary for fast lookups"""
-        self.__travel_time_dict = {
-            (start_stop, end_stop, time_of_day): (travel_time_seconds, distance_meters)
-            for start_stop, end_stop, time_of_day, travel_time_seconds, distance_meters in
-            TravelTime.objects.values_list('start_stop__name', 'end_stop__name', 'time_of_day', 'travel_time_seconds',
-                                           'distance_meters')
-        }
+    def __get_travel_info(self, stop1, stop2, time_of_the_day):
+        """Get the travel time and distance between two stops ((None, None) if missing)"""
+        return self.__travel_matrix.get_travel_info(stop1, stop2, time_of_the_day)
 
     def __fill_routes_to_graph(self):
         """Built a graph for the given routes solution"""
@@ -48,13 +49,60 @@ class TransportModel(Model):
 
         # Fill the graph with all the routes from the given solution
         for route, stops in self.__routes_solution.items():
-            for i in range(len(stops) - 1):
-                stop1, stop2 = stops[i], stops[i + 1]
-                for j in range(len(self.__times)):
-                    travel_time, distance = self.__travel_time_dict.get((str(stop1), str(stop2), self.__times[j]),
-                                                                        (None, None))
-                    if travel_time and distance:
-                        self.__graph.add_edge(stop1, stop2, **{attr_name.format(j): travel_time + distance})
+            self.__add_route_edges(stops)
+
+    def __add_route_edges(self, stops):
+        """Add the edges between the consecutive stops of a route to the graph"""
+        for i in range(len(stops) - 1):
+            stop1, stop2 = stops[i], stops[i + 1]
+            self.__edge_routes_count[frozenset((stop1, stop2))] += 1
+            for j in range(len(self.__times)):
+                travel_time, distance = self.__get_travel_info(stop1, stop2, self.__times[j])
+                if travel_time and distance:
+                    self.__graph.add_edge(stop1, stop2, **{self.__time_to_graph_attr_map[str(self.__times[j])]:
+                                                           travel_time + distance})
+
+    def __remove_route_edges(self, stops):
+        """Remove the edges of a route from the graph, unless another route also uses them"""
+        for i in range(len(stops) - 1):
+            edge = frozenset((stops[i], stops[i + 1]))
+            self.__edge_routes_count[edge] -= 1
+            if self.__edge_routes_count[edge] <= 0:
+                del self.__edge_routes_count[edge]
+                if self.__graph.has_edge(stops[i], stops[i + 1]):
+                    self.__graph.remove_edge(stops[i], stops[i + 1])
+
+    @property
+    def routes_solution(self):
+        """Routes of the simulated solution (route name -> stops)"""
+        return self.__routes_solution
+
+    def update_routes(self, changed_routes):
+        """Replace the stops of the given routes, applying only the edge differences to the graph.
+        Returns the edges that were not in the graph before"""
+        edges_before = set(self.__edge_routes_count)
+        for route, stops in changed_routes.items():
+            self.__remove_route_edges(self.__routes_solution.get(route, []))
+            self.__routes_solution[route] = stops
+            self.__add_route_edges(stops)
+
+        return [tuple(edge) for edge in set(self.__edge_routes_count) - edges_before]
+
+    def get_edge_weight(self, stop1, stop2, time_of_the_day):
+        """Get the graph weight of an edge at the given time of the day (None if missing)"""
+        edge_data = self.__graph.get_edge_data(stop1, stop2) or {}
+        return edge_data.get(self.__time_to_graph_attr_map[str(time_of_the_day)])
+
+    def get_path_cost(self, path, time_of_the_day):
+        """Get the total graph weight of a path at the given time of the day"""
+        return sum(self.get_edge_weight(path[i], path[i + 1], time_of_the_day) for i in range(len(path) - 1))
+
+    def get_path_costs_from(self, stop, time_of_the_day):
+        """Get the shortest path costs from a stop to all reachable stops at the given time of the day"""
+        if stop not in self.__graph:
+            return {}
+        return nx.single_source_dijkstra_path_length(self.__graph, stop,
+                                                     weight=self.__time_to_graph_attr_map[str(time_of_the_day)])
 
     def step(self):
         """Execute one step of the simulation"""
@@ -67,9 +115,9 @@ class TransportModel(Model):
         time, dist = 0, 0
 
         for i in range(start_index, end_index):
-            tt_data = self.__travel_time_dict.get((str(route[i]), str(route[i + 1]), time_of_the_day))
-            time += tt_data[0]
-            dist += tt_data[1]
+            travel_time, distance = self.__get_travel_info(route[i], route[i + 1], time_of_the_day)
+            time += travel_time
+            dist += distance
 
         return time, dist
 
@@ -124,6 +172,12 @@ class TransportModel(Model):
 
     def find_best_route(self, start_stop, end_stop, time_of_the_day):
         """Find best route (direct or with transfer)"""
+        transfers_count, travel_time, distance, _ = self.find_best_route_with_path(start_stop, end_stop,
+                                                                                   time_of_the_day)
+        return transfers_count, travel_time, distance
+
+    def find_best_route_with_path(self, start_stop, end_stop, time_of_the_day):
+        """Find best route (direct or with transfer) and the graph path it takes (None for a direct route)"""
         # First we check if there is a direct route for the two stops and if there is we return it
         routes = list(self.__routes_solution.keys())
         direct_routes = [r for r in routes if start_stop in self.__routes_solution[r]
@@ -135,7 +189,7 @@ class TransportModel(Model):
                                                                                    start_stop, end_stop,
                                                                                    time_of_the_day)))
             return 0, *self.__get_travel_time_and_distance(self.__routes_solution[best_route], start_stop,
-                                                           end_stop, time_of_the_day)
+                                                           end_stop, time_of_the_day), None
 
         # If there is no direct route find the shortest one in the graph
         best_route = self.__find_shortest_path(start_stop, end_stop, time_of_the_day)
@@ -143,4 +197,5 @@ class TransportModel(Model):
         # Calculate the number of transfers in the best route
         transfers_count = self.__get_transfers_count_in_route(best_route)
 
-        return transfers_count, *self.__get_travel_time_and_distance(best_route, start_stop, end_stop, time_of_the_day)
+        return transfers_count, *self.__get_travel_time_and_distance(best_route, start_stop, end_stop,
+                                                                     time_of_the_day), best_route
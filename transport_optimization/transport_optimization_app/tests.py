@@ -1,3 +1,269 @@
-from django.test import TestCase
+import io
+import json
+import datetime
+import random
+import tempfile
+import numpy as np
+from pathlib import Path
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from .models import City, Stop, TravelTime, TravelTimeFailure
+from .algorithm_handlers.GeneticAlgorithm import GeneticAlgorithm
+from .algorithm_handlers.SolutionsHandler import SolutionsHandler
+from .data_handlers.SpatialIndex import SpatialIndex
+from .data_handlers.StubDistanceMatrixClient import StubDistanceMatrixClient
+from .data_handlers.TravelInfoFetcher import TravelInfoFetcher
+from .data_handlers.TravelInfoRefresher import TravelInfoRefresher
+from .data_handlers.TravelMatrixStore import TravelMatrixStore
+from .simulation_handlers.PassengerSurrogate import PassengerSurrogate
+from .simulation_handlers.SimulationHandler import SimulationHandler
 
-# Create your tests here.
+
+def create_stops(city, count, final_count):
+    """ Create a grid of stops around the city center, the first final_count of them are final stops """
+    return [Stop.objects.create(name=f"{city.name} stop {idx}", latitude=42.65 + (idx // 10) * 0.01,
+                                longitude=23.30 + (idx % 10) * 0.01, passenger_flow=100 + idx * 10,
+                                is_final_stop=idx < final_count, city=city)
+            for idx in range(count)]
+
+
+class TravelMatrixDirMixin:
+    """ Keep the travel matrices built by the tests in a temporary directory """
+
+    def setUp(self):
+        super().setUp()
+        matrix_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(matrix_dir.cleanup)
+        settings_override = override_settings(TRAVEL_MATRIX_DIR=matrix_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class GeneticAlgorithmTests(TravelMatrixDirMixin, TestCase):
+    def test_every_final_stop_ends_a_route(self):
+        # The travel info is estimated, no pairs need to be fetched
+        city = City.objects.create(name="Genetic city", country="Bulgaria")
+        stops = create_stops(city, count=30, final_count=6)
+        final_stops = {stop for stop in stops if stop.is_final_stop}
+
+        for seed in range(5):
+            random.seed(seed)
+            solution, _, _ = GeneticAlgorithm(stops, 3, population_size=20, city_id=city.id).execute_optimization()
+            with self.subTest(seed=seed):
+                self.assertEqual({route[0] for route in solution} | {route[-1] for route in solution}, final_stops)
+
+
+@override_settings(TRAVEL_INFO_FETCH_ON_CREATE=False)
+class StopBulkImportTests(TravelMatrixDirMixin, TestCase):
+    def test_import_invalidates_the_city_caches(self):
+        city = City.objects.create(name="Import city", country="Bulgaria")
+        create_stops(city, count=4, final_count=2)
+        # Load the caches of the city before the import
+        self.assertEqual(len(TravelMatrixStore.open(city.id).stop_ids), 4)
+        self.assertEqual(SpatialIndex.for_city(city.id).query_radius(42.70, 23.35, 50), [])
+
+        csv_file = SimpleUploadedFile("stops.csv", b"name,latitude,longitude,passenger_flow,is_final_stop\n"
+                                                   b"Imported stop,42.70,23.35,120,true\n", content_type="text/csv")
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('stop-bulk-import'), {"city": city.id, "file": csv_file})
+
+        self.assertEqual(response.status_code, 201)
+        stop_id = response.json()["stops"][0]["id"]
+        self.assertIn(stop_id, TravelMatrixStore.open(city.id).stop_index)
+        self.assertEqual([stop.id for stop in SpatialIndex.for_city(city.id).query_radius(42.70, 23.35, 50)],
+                         [stop_id])
+
+
+# The scenarios run in a process pool, which closes the DB connections - not possible inside a test transaction
+class OptimizeBatchTests(TravelMatrixDirMixin, TransactionTestCase):
+    def setUp(self):
+        super().setUp()
+        work_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(work_dir.cleanup)
+        self.work_dir = Path(work_dir.name)
+        self.city = City.objects.create(name="Batch city", country="Bulgaria")
+        self.stops = create_stops(self.city, count=12, final_count=4)
+
+    def __write_scenarios(self, *scenarios):
+        scenarios_path = self.work_dir / "scenarios.jsonl"
+        scenarios_path.write_text("".join(json.dumps(scenario) + "\n" for scenario in scenarios))
+        return scenarios_path
+
+    def __scenario(self, scenario_id, **fields):
+        return {"id": scenario_id, "city_id": self.city.id, "number_of_routes": 2, "parameters": {"iterations": 50},
+                **fields}
+
+    def test_resume_after_an_interrupted_run(self):
+        scenarios_path = self.__write_scenarios(self.__scenario("done"), self.__scenario("pending"))
+        output_path = self.work_dir / "results.jsonl"
+        # The run was interrupted while writing the result of the pending scenario
+        output_path.write_text(json.dumps({"scenario_id": "done", "status": "ok"}) + "\n"
+                               + '{"scenario_id": "pend')
+
+        call_command("optimize_batch", str(scenarios_path), str(output_path), workers=1, stdout=io.StringIO())
+
+        results = [json.loads(line) for line in output_path.read_text().splitlines()]
+        self.assertEqual([(result["scenario_id"], result["status"]) for result in results],
+                         [("done", "ok"), ("pending", "ok")])
+
+    def test_stops_of_another_city_are_rejected(self):
+        other_city = City.objects.create(name="Other batch city", country="Bulgaria")
+        other_stop = create_stops(other_city, count=1, final_count=1)[0]
+        stop_ids = [stop.id for stop in self.stops] + [other_stop.id]
+        scenarios_path = self.__write_scenarios(self.__scenario("mixed", stop_ids=stop_ids))
+
+        with self.assertRaisesMessage(CommandError, str(other_stop.id)):
+            call_command("optimize_batch", str(scenarios_path), str(self.work_dir / "results.jsonl"), workers=1,
+                         stdout=io.StringIO())
+
+
+class PassengerSurrogateTests(TravelMatrixDirMixin, TestCase):
+    def test_weight_one_matches_the_route_costs_of_the_reference(self):
+        city = City.objects.create(name="Surrogate city", country="Bulgaria")
+        stops = create_stops(city, count=20, final_count=4)
+        solutions_handler = SolutionsHandler(city.id)
+        solution = solutions_handler.initial_solution_setup(
+            SolutionsHandler.generate_initial_routes(2, stops), stops)
+        route_score, _, _ = solutions_handler.evaluate_solution(solution)
+
+        surrogate = PassengerSurrogate(stops, solutions_handler.stop_handler)
+        solutions_handler.set_passenger_surrogate(surrogate, 1, solution)
+        score, _, _ = solutions_handler.evaluate_solution(solution)
+
+        self.assertAlmostEqual(score, route_score + abs(route_score))
+
+
+class IncrementalSimulationTests(TravelMatrixDirMixin, TestCase):
+    def test_matches_the_full_simulation(self):
+        random.seed(7)
+        city = City.objects.create(name="Simulation city", country="Bulgaria")
+        stops = create_stops(city, count=24, final_count=6)
+        solutions_handler = SolutionsHandler(city.id)
+        solution = solutions_handler.initial_solution_setup(
+            SolutionsHandler.generate_initial_routes(3, stops), stops)
+
+        # A few local moves from the previous solution each, like the optimization makes
+        routes_solutions = [{f"route_{i}": route for i, route in enumerate(solution)}]
+        for _ in range(4):
+            for _ in range(3):
+                solution = solutions_handler.swap_stops(solution)
+            routes_solutions.append({f"route_{i}": route for i, route in enumerate(solution)})
+
+        sim_handler = SimulationHandler(stops, num_passengers=60, city_id=city.id)
+        full_metrics = sim_handler.run_simulations(routes_solutions)
+        incremental_metrics = sim_handler.run_simulations(routes_solutions, incremental=True)
+
+        for full, incremental in zip(full_metrics, incremental_metrics):
+            self.assertEqual(full.keys(), incremental.keys())
+            for name in full:
+                self.assertAlmostEqual(full[name], incremental[name], delta=0.011)
+
+
+class TravelMatrixImportTests(TravelMatrixDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        self.city = City.objects.create(name="Matrix city", country="Bulgaria")
+        self.first_stop, self.second_stop = create_stops(self.city, count=2, final_count=2)
+        # Fetched in one direction only, the other one is estimated
+        for time_of_day in TravelMatrixStore.TIMES:
+            TravelTime.objects.create(start_stop=self.first_stop, end_stop=self.second_stop, time_of_day=time_of_day,
+                                      travel_time_seconds=321, distance_meters=4321)
+        self.url = reverse('city-travel-matrix', args=[self.city.id])
+
+    def __import(self, content):
+        return self.client.post(self.url, {"file": SimpleUploadedFile("matrix.npz", content)})
+
+    def test_export_import_round_trip(self):
+        exported = self.client.get(self.url).content
+        TravelTime.objects.all().delete()
+
+        response = self.__import(exported)
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.json()["matched_stops"], 2)
+        # Only the fetched pair is imported, the estimated one is estimated again
+        self.assertEqual(set(TravelTime.objects.values_list('start_stop', 'end_stop', 'time_of_day',
+                                                            'travel_time_seconds', 'distance_meters', 'source')),
+                         {(self.first_stop.id, self.second_stop.id, time_of_day, 321, 4321, TravelTime.Source.IMPORT)
+                          for time_of_day in TravelMatrixStore.TIMES})
+
+    def test_malformed_files_are_rejected(self):
+        mismatched = io.BytesIO()
+        np.savez_compressed(mismatched, stop_names=np.array(["a", "b", "c"]), times=np.array(["08:00:00"]),
+                            travel_times=np.zeros((1, 2, 2), dtype=np.int32),
+                            distances=np.zeros((1, 2, 2), dtype=np.int32), estimated=np.zeros((2, 2), dtype=bool))
+        exported = self.client.get(self.url).content
+
+        for name, content in (("empty", b""), ("not a zip", b"stop,latitude\n"),
+                              ("truncated", exported[:len(exported) // 2]), ("mismatched", mismatched.getvalue())):
+            with self.subTest(name):
+                self.assertEqual(self.__import(content).status_code, 400)
+        self.assertEqual(TravelTime.objects.count(), len(TravelMatrixStore.TIMES))
+
+
+class _FailingClient:
+    """ Client of a bug in the request code, its errors are not request errors """
+
+    def distance_matrix(self, origins, destinations, mode="driving", departure_time=None):
+        raise ValueError("Unexpected origins")
+
+
+class TravelInfoFetcherTests(TravelMatrixDirMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        city = City.objects.create(name="Fetcher city", country="Bulgaria")
+        self.first_stop, self.second_stop = create_stops(city, count=2, final_count=2)
+        self.requests = [([self.first_stop], [self.second_stop], TravelInfoFetcher.get_departure_time(time_of_day))
+                         for time_of_day in TravelMatrixStore.TIMES]
+
+    def __fetcher(self, client):
+        return TravelInfoFetcher(client, TravelTime.Source.STUB, max_workers=2, requests_per_second=1000,
+                                 max_retries=2, backoff_seconds=0)
+
+    def test_failures_are_upserted_and_cleared_on_success(self):
+        failing_fetcher = self.__fetcher(StubDistanceMatrixClient(error_rate=1))
+        for attempts in (1, 2):
+            self.assertEqual(failing_fetcher.fetch_and_save(self.requests), {"fetched_pairs": 0, "failed_pairs": 3})
+            self.assertEqual(set(TravelTimeFailure.objects.values_list('time_of_day', 'attempts')),
+                             {(time_of_day, attempts) for time_of_day in TravelMatrixStore.TIMES})
+
+        self.assertEqual(self.__fetcher(StubDistanceMatrixClient()).fetch_and_save(self.requests),
+                         {"fetched_pairs": 3, "failed_pairs": 0})
+        self.assertFalse(TravelTimeFailure.objects.exists())
+        self.assertEqual(set(TravelTime.objects.values_list('start_stop', 'end_stop', 'time_of_day', 'source')),
+                         {(self.first_stop.id, self.second_stop.id, time_of_day, TravelTime.Source.STUB)
+                          for time_of_day in TravelMatrixStore.TIMES})
+
+    def test_transient_errors_are_retried(self):
+        # Each block fails about half of its attempts - with 20 attempts per block all of them get through
+        random.seed(3)
+        fetcher = TravelInfoFetcher(StubDistanceMatrixClient(error_rate=0.5), TravelTime.Source.STUB,
+                                    requests_per_second=1000, max_retries=19, backoff_seconds=0)
+
+        self.assertEqual(fetcher.fetch_and_save(self.requests), {"fetched_pairs": 3, "failed_pairs": 0})
+
+    def test_other_errors_are_not_caught(self):
+        with self.assertRaises(ValueError):
+            self.__fetcher(_FailingClient()).fetch_and_save(self.requests)
+        self.assertFalse(TravelTimeFailure.objects.exists())
+
+
+class TravelInfoRefresherTests(TravelMatrixDirMixin, TestCase):
+    def test_undated_pairs_are_refreshed_first(self):
+        city = City.objects.create(name="Refresh city", country="Bulgaria")
+        first_stop, second_stop, third_stop = create_stops(city, count=3, final_count=2)
+        time_of_day = TravelMatrixStore.TIMES[0]
+        now = timezone.now()
+        for end_stop, fetched_at in ((second_stop, now - datetime.timedelta(days=60)), (third_stop, None)):
+            TravelTime.objects.create(start_stop=first_stop, end_stop=end_stop, time_of_day=time_of_day,
+                                      travel_time_seconds=300, distance_meters=3000, fetched_at=fetched_at)
+        # Recently fetched, not stale
+        TravelTime.objects.create(start_stop=second_stop, end_stop=third_stop, time_of_day=time_of_day,
+                                  travel_time_seconds=300, distance_meters=3000, fetched_at=now)
+
+        self.assertEqual(TravelInfoRefresher.get_stale_pairs(max_age_days=30, city_id=city.id),
+                         [(first_stop.id, third_stop.id, time_of_day), (first_stop.id, second_stop.id, time_of_day)])
@@ -1,6 +1,7 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CityViewSet, StopViewSet, UnifiedOptimizationInputView, CityListView
+from .views import CityViewSet, StopViewSet, UnifiedOptimizationInputView, CityListView, AsyncOptimizationView, \
+    BatchOptimizationView, ProfileDownloadView, OptimizationJobView
 
 router = DefaultRouter()
 router.register(r'cities', CityViewSet)
@@ -9,5 +10,9 @@ router.register(r'stops', StopViewSet)
 urlpatterns = [
     path('api/', include(router.urls)),
     path('api/optimize/', UnifiedOptimizationInputView.as_view(), name='route-optimization-input'),
+    path('api/optimize/batch/', BatchOptimizationView.as_view(), name='route-optimization-batch'),
+    path('api/optimize/jobs/<str:job_id>/', OptimizationJobView.as_view(), name='optimization-job'),
+    path('api/optimize/async/', AsyncOptimizationView.as_view(), name='route-optimization-async'),
+    path('api/profiles/<str:profile_id>/', ProfileDownloadView.as_view(), name='profile-download'),
     path('api/cities/', CityListView.as_view(), name='cities-list'),
 ]
\ No newline at end of file
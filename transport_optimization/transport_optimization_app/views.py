@@ -1,12 +1,37 @@
+import io
+import asyncio
+import zipfile
+from collections.abc import Mapping
+from asgiref.sync import sync_to_async
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.db import transaction, connections
+from django.http import JsonResponse, HttpResponse, FileResponse
+from django.urls import reverse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import viewsets, status, filters
+from rest_framework.decorators import action
+from rest_framework.exceptions import ValidationError, Throttled
+from rest_framework.fields import BooleanField
+from rest_framework.parsers import MultiPartParser, FormParser
+from rest_framework.permissions import IsAdminUser
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 from .models import City, Stop
-from .serializers import CitySerializer, StopSerializer, OptimizationInputSerializer
-from .algorithm_handlers.SimulatedAnnealing import SimulatedAnnealing
-from .algorithm_handlers.AntColonyOptimization import AntColonyOptimization
-from .algorithm_handlers.StopHandler import StopHandler
-from .simulation_handlers.SimulationHandler import SimulationHandler
+from .pagination import StopCursorPagination
+from .profiling import ProfileRateThrottle, is_profiling_requested, get_profile_path, run_profiled
+from .jobs import start_job, get_job
+from .signals import invalidate_city_stops
+from .serializers import CitySerializer, StopSerializer, OptimizationInputSerializer, BulkStopImportSerializer, \
+    BatchOptimizationInputSerializer, StopQuerySerializer
+from .algorithm_handlers.CancellationToken import CancellationToken
+from .data_handlers.RouteNetworkHandler import RouteNetworkHandler
+
+# The optimization, simulation and Google Maps stacks (numpy, scipy, networkx, mesa, googlemaps) are imported
+# in the views that use them, so processes serving only CRUD requests or running commands never load them
 
 
 class CityViewSet(viewsets.ModelViewSet):
@@ -16,23 +41,129 @@ class CityViewSet(viewsets.ModelViewSet):
     search_fields = ['name', 'country']
     ordering_fields = ['name', 'country']
 
+    @action(detail=True, methods=['get', 'post'], url_path='travel-matrix',
+            parser_classes=[MultiPartParser, FormParser])
+    def travel_matrix(self, request, pk=None):
+        """ GET exports the city travel matrix (and the saved routes in ?route_ids=1,2) as a compressed .npz file,
+        POST imports an exported .npz file into the city travel info """
+        from .data_handlers.TravelMatrixExport import TravelMatrixExport
+
+        city = self.get_object()
+        if request.method == 'POST':
+            file = request.data.get('file')
+            if file is None:
+                return Response({"file": "An exported .npz file is required."}, status=status.HTTP_400_BAD_REQUEST)
+            include_estimated = str(request.data.get('include_estimated', '')).lower() in ('1', 'true')
+            try:
+                summary = TravelMatrixExport.import_city(file, city.id, include_estimated)
+            except (ValueError, KeyError, OSError, EOFError, zipfile.BadZipFile):
+                return Response({"file": "The file is not a valid travel matrix export."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            return Response(summary, status=status.HTTP_201_CREATED)
+
+        route_ids = request.query_params.get('route_ids')
+        try:
+            route_ids = [int(route_id) for route_id in route_ids.split(',')] if route_ids else None
+        except ValueError:
+            raise ValidationError({"route_ids": "Expected comma separated route ids."})
+
+        buffer = io.BytesIO()
+        try:
+            TravelMatrixExport.export_city(city.id, buffer, route_ids)
+        except ValueError as e:
+            return Response({"route_ids": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        response = HttpResponse(buffer.getvalue(), content_type='application/octet-stream')
+        response['Content-Disposition'] = f'attachment; filename="city_{city.id}_travel_matrix.npz"'
+        return response
+
 
 class StopViewSet(viewsets.ModelViewSet):
-    queryset = Stop.objects.all()
+    queryset = Stop.objects.select_related('city')
     serializer_class = StopSerializer
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['name']
     ordering_fields = ['name', 'passenger_flow']
 
+    @property
+    def paginator(self):
+        """ Use cursor pagination when requested with ?pagination=cursor, page numbers otherwise """
+        if not hasattr(self, '_paginator'):
+            if self.request is not None and self.request.query_params.get('pagination') == 'cursor':
+                self._paginator = StopCursorPagination()
+            else:
+                self._paginator = super().paginator
+        return self._paginator
+
     def perform_create(self, serializer):
+        from .algorithm_handlers.StopHandler import StopHandler
+
         stop = serializer.save()
-        StopHandler.extract_travel_info(stop)
+        if settings.TRAVEL_INFO_FETCH_ON_CREATE:
+            StopHandler.extract_travel_info(stop)
+
+    @action(detail=False, methods=['post'], url_path='bulk-import', parser_classes=[MultiPartParser, FormParser])
+    def bulk_import(self, request):
+        """ Import all stops of a city from a CSV or GeoJSON file """
+        from .algorithm_handlers.StopHandler import StopHandler
+
+        serializer = BulkStopImportSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        with transaction.atomic():
+            city_id = serializer.validated_data['city'].id
+            stops = Stop.objects.bulk_create(serializer.validated_data['stops'])
+            # Bulk created stops send no signals - the cached matrix and spatial index of the city miss them,
+            # whether their travel info is fetched or not
+            transaction.on_commit(lambda: invalidate_city_stops(city_id))
+            # Fill the travel info for all new stops at once, after the stops are committed
+            if settings.TRAVEL_INFO_FETCH_ON_CREATE:
+                transaction.on_commit(lambda: StopHandler.schedule_travel_info_extraction(stops))
+
+        return Response({
+            "created_count": len(stops),
+            "stops": StopSerializer(stops, many=True).data
+        }, status=status.HTTP_201_CREATED)
+
+    @staticmethod
+    def __parse_coordinates(value, count, param_name):
+        """ Parse a comma separated list of coordinates from a query parameter """
+        try:
+            coordinates = [float(v) for v in value.split(',')]
+        except ValueError:
+            coordinates = []
+        if len(coordinates) != count:
+            raise ValidationError({param_name: f"Expected {count} comma separated numbers."})
+        return coordinates
 
     def get_queryset(self):
         queryset = self.queryset
-        city_id = self.request.query_params.get('city')
-        if city_id:
+        params = self.request.query_params
+        # Empty parameters are ignored like missing ones
+        query_serializer = StopQuerySerializer(data={key: value for key, value in params.items() if value})
+        query_serializer.is_valid(raise_exception=True)
+        query = query_serializer.validated_data
+
+        city_id = query.get('city')
+        if city_id is not None:
             queryset = queryset.filter(city_id=city_id)
+
+        # Bounding box as min_longitude,min_latitude,max_longitude,max_latitude (GeoJSON order)
+        bbox = params.get('bbox')
+        if bbox:
+            min_lon, min_lat, max_lon, max_lat = self.__parse_coordinates(bbox, 4, 'bbox')
+            queryset = queryset.filter(latitude__range=(min_lat, max_lat), longitude__range=(min_lon, max_lon))
+
+        # Stops within radius meters from the latitude,longitude point
+        near = query.get('near')
+        if near:
+            from .data_handlers.SpatialIndex import SpatialIndex
+
+            latitude, longitude = self.__parse_coordinates(near, 2, 'near')
+            stops = SpatialIndex.for_city(city_id).query_radius(latitude, longitude, query['radius'])
+            queryset = queryset.filter(id__in=[stop.id for stop in stops])
+
         return queryset
 
 
@@ -44,69 +175,294 @@ class CityListView(APIView):
 
 
 class UnifiedOptimizationInputView(APIView):
+    @staticmethod
+    def __serialize_solutions(response_format, **solutions):
+        """ Serialize the solutions routes - each stop is serialized only once and reused between the routes """
+        route_stops = {stop.id: stop for solution in solutions.values() for route in solution for stop in route}
+        serialized_stops = {stop_data['id']: stop_data
+                            for stop_data in StopSerializer(list(route_stops.values()), many=True).data}
+
+        # Compact format - one stops dictionary and routes as lists of stop ids
+        if response_format == "compact":
+            serialized_solutions = {name: [[stop.id for stop in route] for route in solution]
+                                    for name, solution in solutions.items()}
+            serialized_solutions["stops"] = serialized_stops
+            return serialized_solutions
+
+        return {name: [[serialized_stops[stop.id] for stop in route] for route in solution]
+                for name, solution in solutions.items()}
+
     def post(self, request):
-        algorithm = request.data.get("algorithm", "simulated_annealing")
-        serializer = OptimizationInputSerializer(data=request.data)
+        if _is_decomposition_requested(request.data):
+            return Response(*_start_decomposition_job(request, request.data))
+        if not is_profiling_requested(request):
+            response_data, response_status = self.optimize(request.data)
+            return Response(response_data, status=response_status)
+
+        # Profiled run - staff only and rate limited, the profile is saved under PROFILE_DIR
+        if not request.user.is_staff:
+            return Response({"error": "Profiling is only available to staff users."},
+                            status=status.HTTP_403_FORBIDDEN)
+        throttle = ProfileRateThrottle()
+        if not throttle.allow_request(request, self):
+            raise Throttled(throttle.wait())
+
+        (response_data, response_status), profile_id = run_profiled(self.optimize, request.data)
+        return Response({**response_data, "profile_id": profile_id}, status=response_status)
+
+    @classmethod
+    def optimize(cls, request_data, cancellation_token=None, allow_decomposition=False):
+        """ Validate the input, run the optimization and simulate the solutions. Returns the response data and
+        status. The optimization stops with OptimizationCancelled once the cancellation token is cancelled.
+        Decomposition forks a process pool, so it is only allowed in the background job processes """
+        from .algorithm_handlers.OptimizationHandler import OptimizationHandler
+        from .algorithm_handlers.DecompositionHandler import DecompositionHandler
+        from .simulation_handlers.SimulationHandler import SimulationHandler
+
+        algorithm = request_data.get("algorithm", "simulated_annealing")
+        serializer = OptimizationInputSerializer(data=request_data)
         if not serializer.is_valid():
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+            return serializer.errors, status.HTTP_400_BAD_REQUEST
 
         data = serializer.validated_data
         stop_ids = data['stop_ids']
         num_routes = data['number_of_routes']
-        stops = list(Stop.objects.filter(id__in=stop_ids))
+        city_id = data['city_id']
+        response_format = data['response_format']
+        stops = list(Stop.objects.filter(id__in=stop_ids).select_related('city'))
 
-        if algorithm == "simulated_annealing":
-            initial_solution = data.get("initial_solution")
+        if algorithm not in OptimizationHandler.ALGORITHMS:
+            return {"error": "Unknown algorithm selected."}, status.HTTP_400_BAD_REQUEST
+
+        parameters = {}
+        input_solution = None
+        if algorithm == "simulated_annealing" and data.get("initial_solution"):
             stop_id_to_obj = {stop.id: stop for stop in stops}
+            input_solution = [[stop_id_to_obj[stop_id] for stop_id in route] for route in data["initial_solution"]]
+        elif data.get("initial_route_ids"):
+            # Warm start from a saved network - SA starts from it, ACO and GA are seeded with it
+            input_solution = RouteNetworkHandler.load_solution(data["initial_route_ids"], stops)
+            try:
+                RouteNetworkHandler.validate_solution(input_solution)
+            except ValueError as e:
+                return {"initial_route_ids": str(e)}, status.HTTP_400_BAD_REQUEST
+            if algorithm == "genetic" and len(input_solution) != num_routes:
+                return {"initial_route_ids": "The number of routes should match number_of_routes."}, \
+                    status.HTTP_400_BAD_REQUEST
+        if algorithm == "aco":
+            parameters["pheromone_strategy"] = data.get("pheromone_strategy", "all")
+        if algorithm in ("simulated_annealing", "aco") and data.get("surrogate_weight"):
+            parameters["surrogate_weight"] = data["surrogate_weight"]
 
-            sim_ann = SimulatedAnnealing()
-            if initial_solution:
-                input_solution = [[stop_id_to_obj[stop_id] for stop_id in route] for route in initial_solution]
-                initial_solution, final_solution, algorithm_parameters, iteration_info = \
-                    sim_ann.execute_optimization(stops, num_routes, input_solution)
-                initial_used = True
-            else:
-                initial_solution, final_solution, algorithm_parameters, iteration_info = \
-                    sim_ann.execute_optimization(stops, num_routes)
-                initial_used = False
+        if data["decomposition"] and not allow_decomposition:
+            return {"decomposition": "Decomposition runs as a background job only."}, status.HTTP_400_BAD_REQUEST
 
-            initial_solution_dict = {f"route_{i}": route for i, route in enumerate(initial_solution)}
-            final_solution_dict = {f"route_{i}": route for i, route in enumerate(final_solution)}
+        if data["decomposition"]:
+            # Large stop sets are split geographically, optimized per cluster in parallel and refined together
+            decomposition = DecompositionHandler(stops, num_routes, city_id, algorithm, parameters,
+                                                 cluster_size=data["cluster_size"],
+                                                 cancellation_token=cancellation_token)
+            initial_solution, final_solution, algorithm_parameters, iteration_info = \
+                decomposition.execute_optimization()
+        else:
+            initial_solution, final_solution, algorithm_parameters, iteration_info = \
+                OptimizationHandler.execute_optimization(algorithm, stops, num_routes, city_id, parameters,
+                                                         input_solution, cancellation_token)
+
+        saved_routes = {}
+        if data["save_solution"]:
+            saved_routes["saved_route_ids"] = RouteNetworkHandler.save_solution(final_solution,
+                                                                                data.get("route_name_prefix"))
 
-            sim_handler = SimulationHandler(stops)
-            initial_solution_metrics = sim_handler.run_simulation(initial_solution_dict)
-            final_solution_metrics = sim_handler.run_simulation(final_solution_dict)
+        # Do not simulate the solutions of an abandoned request
+        if cancellation_token:
+            cancellation_token.raise_if_cancelled()
 
-            serialized_initial = [StopSerializer(route, many=True).data for route in initial_solution]
-            serialized_final = [StopSerializer(route, many=True).data for route in final_solution]
+        sim_handler = SimulationHandler(stops, city_id=city_id, demand_model=data["demand_model"])
+        final_solution_dict = {f"route_{i}": route for i, route in enumerate(final_solution)}
 
-            return Response({
-                "initial_solution_used": initial_used,
-                "initial_solution": serialized_initial,
-                "optimized_solution": serialized_final,
+        # Only SA (and the decomposition with its stitched network) starts from an initial solution,
+        # which is returned for comparison with the optimized one
+        if initial_solution is not None:
+            initial_solution_dict = {f"route_{i}": route for i, route in enumerate(initial_solution)}
+            # The final solution is reached by local moves from the initial one, so it is simulated incrementally -
+            # only the passengers affected by the changed routes are re-routed (in this thread, no process pool)
+            initial_solution_metrics, final_solution_metrics = sim_handler.run_simulations(
+                [initial_solution_dict, final_solution_dict], incremental=True)
+
+            serialized_solutions = cls.__serialize_solutions(response_format, initial_solution=initial_solution,
+                                                             optimized_solution=final_solution)
+
+            return {
+                "initial_solution_used": algorithm_parameters.get("input_solution_used", False),
+                **serialized_solutions,
                 "initial_solution_metrics": initial_solution_metrics,
                 "final_solution_metrics": final_solution_metrics,
                 "algorithm_parameters": algorithm_parameters,
-                "iteration_info": iteration_info
-            })
+                "iteration_info": iteration_info,
+                **saved_routes
+            }, status.HTTP_200_OK
 
-        elif algorithm == "aco":
-            aco = AntColonyOptimization(stops, num_routes)
-            final_solution, algorithm_parameters, iteration_info = aco.execute_optimization()
-            final_solution_dict = {f"route_{i}": route for i, route in enumerate(final_solution)}
+        final_solution_metrics = sim_handler.run_simulation(final_solution_dict)
+        serialized_solutions = cls.__serialize_solutions(response_format, optimized_solution=final_solution)
 
-            sim_handler = SimulationHandler(stops)
-            final_solution_metrics = sim_handler.run_simulation(final_solution_dict)
-            serialized_final = [StopSerializer(route, many=True).data for route in final_solution]
+        return {
+            **serialized_solutions,
+            "final_solution_metrics": final_solution_metrics,
+            "algorithm_parameters": algorithm_parameters,
+            "iteration_info": iteration_info,
+            **saved_routes
+        }, status.HTTP_200_OK
 
-            return Response({
-                "optimized_solution": serialized_final,
-                "final_solution_metrics": final_solution_metrics,
-                "algorithm_parameters": algorithm_parameters,
-                "iteration_info": iteration_info
-            })
 
-        else:
-            return Response({"error": "Unknown algorithm selected."}, status=400)
+class ProfileDownloadView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request, profile_id):
+        """ Download a saved request profile (.pstats) """
+        profile_path = get_profile_path(profile_id)
+        if profile_path is None or not profile_path.exists():
+            return Response({"error": "Profile not found."}, status=status.HTTP_404_NOT_FOUND)
+        return FileResponse(open(profile_path, 'rb'), as_attachment=True, filename=profile_path.name)
+
+
+class BatchOptimizationView(APIView):
+    def post(self, request):
+        """ Validate the variants and queue their comparison as a background job. The comparison table is
+        returned by the job endpoint once all variants are done """
+        serializer = BatchOptimizationInputSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        return _start_job_response(request, "batch", request.data)
+
+    @staticmethod
+    def run_batch(request_data):
+        """ Run the optimization variants over one stop set and get their comparison table and the status.
+        Runs in the background job process - the variants are optimized in a process pool """
+        from .algorithm_handlers.BatchOptimizationHandler import BatchOptimizationHandler
+
+        serializer = BatchOptimizationInputSerializer(data=request_data)
+        if not serializer.is_valid():
+            return serializer.errors, status.HTTP_400_BAD_REQUEST
+
+        data = serializer.validated_data
+        stops = list(Stop.objects.filter(id__in=data['stop_ids']).select_related('city'))
+
+        batch_handler = BatchOptimizationHandler(stops, data['city_id'], data['demand_model'])
+        comparison = batch_handler.run([dict(variant) for variant in data['variants']])
+
+        return {
+            "variants_count": len(comparison),
+            "best_variant": comparison[0]["variant"] if comparison[0]["status"] == "ok" else None,
+            "comparison": comparison
+        }, status.HTTP_200_OK
+
+
+def _start_job(request, kind, request_data):
+    """ Start a background job. Returns its id and status URL and 202, or an error and 503 if too many jobs run """
+    job_id = start_job(kind, request_data)
+    if job_id is None:
+        return {"error": "Too many optimization jobs are running, try again later."}, \
+            status.HTTP_503_SERVICE_UNAVAILABLE
+
+    return {
+        "job_id": job_id,
+        "status": "running",
+        "status_url": request.build_absolute_uri(reverse('optimization-job', args=[job_id]))
+    }, status.HTTP_202_ACCEPTED
+
+
+def _start_job_response(request, kind, request_data):
+    return Response(*_start_job(request, kind, request_data))
+
+
+def _is_decomposition_requested(request_data):
+    """ Check the decomposition flag of the raw input, the input is validated before the job starts """
+    try:
+        return isinstance(request_data, Mapping) and \
+            BooleanField().to_internal_value(request_data.get("decomposition", False))
+    except ValidationError:
+        return False
+
+
+def _start_decomposition_job(request, request_data):
+    """ Validate the optimization input and queue the decomposition as a background job - it optimizes the clusters
+    in a process pool, which is never forked from the web server. Returns the response data and status """
+    from .algorithm_handlers.OptimizationHandler import OptimizationHandler
+
+    serializer = OptimizationInputSerializer(data=request_data)
+    if not serializer.is_valid():
+        return serializer.errors, status.HTTP_400_BAD_REQUEST
+    if request_data.get("algorithm", "simulated_annealing") not in OptimizationHandler.ALGORITHMS:
+        return {"error": "Unknown algorithm selected."}, status.HTTP_400_BAD_REQUEST
+
+    return _start_job(request, "decomposition", request_data)
+
+
+class OptimizationJobView(APIView):
+    def get(self, request, job_id):
+        """ Get the status of a background optimization job and its result once it is done """
+        job = get_job(job_id)
+        if job is None:
+            return Response({"error": "Job not found."}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job)
+
+
+def _run_cancellable_optimization(request_data, cancellation_token):
+    try:
+        return UnifiedOptimizationInputView.optimize(request_data, cancellation_token)
+    finally:
+        # The executor threads are reused, so their database connections are closed as after a request
+        connections.close_all()
+
+
+def _check_optimization_request(request):
+    """ Run the DRF checks of the sync optimization endpoint - content negotiation, authentication (which enforces
+    CSRF for session authenticated users), permissions and the configured throttling - and parse the body.
+    Returns the request data and None or None and the rendered error response """
+    view = UnifiedOptimizationInputView()
+    view.args, view.kwargs = (), {}
+    drf_request = view.initialize_request(request)
+    view.request, view.headers = drf_request, view.default_response_headers
+
+    try:
+        view.initial(drf_request)
+        return drf_request.data, None
+    except Exception as exc:
+        response = view.finalize_response(drf_request, view.handle_exception(exc))
+        return None, response.render()
+
+
+# Django's CSRF check is skipped as for the DRF views - the DRF session authentication enforces it instead,
+# so token and basic authenticated API clients are not affected
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncOptimizationView(View):
+    """ Async version of the optimization endpoint for ASGI servers, with the same authentication and permissions.
+    The optimization runs in a bounded executor (requests over its size wait in its queue) and is cancelled when
+    the client disconnects """
+    executor = ThreadPoolExecutor(max_workers=settings.OPTIMIZATION_EXECUTOR_WORKERS,
+                                  thread_name_prefix="optimization")
+
+    async def post(self, request):
+        request_data, error_response = await sync_to_async(_check_optimization_request)(request)
+        if error_response is not None:
+            return error_response
+        if not isinstance(request_data, dict):
+            return JsonResponse({"error": "A JSON object body is expected."}, status=status.HTTP_400_BAD_REQUEST)
+
+        if _is_decomposition_requested(request_data):
+            response_data, response_status = await sync_to_async(_start_decomposition_job)(request, request_data)
+            return JsonResponse(response_data, status=response_status, encoder=JSONEncoder, safe=False)
 
+        cancellation_token = CancellationToken()
+        loop = asyncio.get_running_loop()
+        try:
+            response_data, response_status = await loop.run_in_executor(
+                self.executor, _run_cancellable_optimization, request_data, cancellation_token)
+        except asyncio.CancelledError:
+            # Django cancels the view when the client disconnects - stop the optimization with it
+            cancellation_token.cancel()
+            raise
 
+        return JsonResponse(response_data, status=response_status, encoder=JSONEncoder, safe=False)
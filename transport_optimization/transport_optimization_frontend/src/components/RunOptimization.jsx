@@ -29,7 +29,7 @@ function RunOptimization() {
     if (selectedCity) {
       const fetchAllStops = async () => {
         let allStops = [];
-        let nextPageUrl = `http://localhost:8000/api/stops/?city=${selectedCity.value}`;
+        let nextPageUrl = `http://localhost:8000/api/stops/?city=${selectedCity.value}&pagination=cursor&page_size=500`;
 
         while (nextPageUrl) {
           const res = await axios.get(nextPageUrl);
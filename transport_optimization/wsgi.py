@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'transport_optimization.settings')
 
 application = get_wsgi_application()
+
+# Opt-in warm-up of the travel matrices of the PRELOAD_TRAVEL_MATRIX_CITIES, before the server forks its workers
+from transport_optimization_app.preload import preload_travel_matrices  # noqa: E402
+
+preload_travel_matrices()